@@ -23,13 +23,13 @@
 I provide the pythonic interface of ktbs:StoredTrace and ktbs:ComputedTrace.
 """
 import logging
+from itertools import islice
 from numbers import Integral, Real
 from rdflib import Graph, Literal, RDF, RDFS, URIRef, XSD
 from rdflib.term import Node
 
 from datetime import datetime
 
-from ktbs.namespace import KTBS_NS_URI
 from ktbs.time import lit2datetime
 from rdfrest.cores.local import ILocalCore
 from rdfrest.cores.factory import factory as universal_factory
@@ -99,7 +99,7 @@ class AbstractTraceMixin(InBaseMixin):
             origin = unicode(origin)
         return origin
 
-    def iter_obsels(self, begin=None, end=None, after=None, before=None, reverse=False, bgp=None, limit=None, offset=None, refresh=None):
+    def iter_obsels(self, begin=None, end=None, after=None, before=None, reverse=False, bgp=None, limit=None, offset=None, refresh=None, otypes=None):
         """
         Iter over the obsels of this trace.
 
@@ -129,6 +129,9 @@ class AbstractTraceMixin(InBaseMixin):
             even if the sources have not change
           - if "recursive", will recursively force recomputatioon as above
 
+        * otypes: an iterable of obsel types (or their URIs); only obsels
+          having one of these types, or one of their subtypes, will be yielded
+
         In the `bgp` parameter, notice that:
 
         * the variable `?obs` is bound each obsel
@@ -144,14 +147,18 @@ class AbstractTraceMixin(InBaseMixin):
 
         collection = self.obsel_collection
         collection.force_state_refresh(parameters or None)
+        filtered = bgp is not None or otypes is not None
         if isinstance(self, ILocalCore):
             # we have direct access to the raw resource instead,
-            # so we directly query the graph
+            # so we directly use the temporal index of the collection
             # (pylint does not know that, hence the directive below)
             obsels_graph = collection.state #pylint: disable=E1101
-            select = collection.build_select(begin, end, after, before, reverse, bgp,
-                                             limit, offset,
-                                             "DISTINCT ?obs" if bgp else "?obs")
+            if not filtered:
+                keys = collection.iter_obsel_keys( #pylint: disable=E1101
+                    begin, end, after, before, reverse, limit, offset)
+            else:
+                keys = collection.iter_obsel_keys( #pylint: disable=E1101
+                    begin, end, after, before, reverse)
         else:
             # we are remote,
             # so we push as much as possible of the parameters to the server
@@ -163,16 +170,33 @@ class AbstractTraceMixin(InBaseMixin):
                 parameters["after"] = unicode(coerce_to_uri(after))
             if before is not None:
                 parameters["before"] = unicode(coerce_to_uri(before))
-            if limit is not None:
-                parameters['limit'] = limit
-            if offset is not None:
-                parameters['offset'] = offset
+            if not filtered:
+                # (otherwise, slicing must happen after filtering, below)
+                if limit is not None:
+                    parameters['limit'] = limit
+                if offset is not None:
+                    parameters['offset'] = offset
+            if reverse:
+                parameters['reverse'] = 'yes'
             obsels_graph = collection.get_state(parameters)
-            select = collection.build_select(
-                bgp=bgp, selected="DISTINCT ?obs" if bgp else "?obs")
-        query_str = "PREFIX ktbs: <%s#> %s" % (KTBS_NS_URI, select)
-        tuples = list(obsels_graph.query(query_str, initNs={"m": self.model_prefix}))
-        for obs_uri, in tuples:
+            keys = _get_graph_keys(obsels_graph, self.uri, reverse)
+
+        if bgp is not None:
+            # the BGP is evaluated once (with a prepared query),
+            # and the keys are then filtered against its result
+            matching = set(collection.iter_bgp_matches(
+                obsels_graph, bgp, self.model_prefix))
+            keys = ( key for key in keys if key[2] in matching )
+        if otypes is not None:
+            # obsel types are checked against the (cached) closure
+            # of the subtypes in the trace model
+            otypes = self._expand_obsel_types(otypes)
+            graph_types = obsels_graph.objects
+            keys = ( key for key in keys
+                     if not otypes.isdisjoint(graph_types(key[2], RDF.type)) )
+        if filtered:
+            keys = _slice_keys(keys, limit, offset)
+        for _, _, obs_uri in list(keys):
             types = obsels_graph.objects(obs_uri, RDF.type)
             cls = get_wrapped(ObselProxy, types)
             yield cls(obs_uri, collection, obsels_graph, parameters or None)
@@ -233,6 +257,18 @@ class AbstractTraceMixin(InBaseMixin):
         tmodel_uri = self.state.value(self.uri, KTBS.hasModel)
         return tmodel_uri
 
+    def _expand_obsel_types(self, otypes):
+        """
+        I return the frozenset of the URIs of `otypes` and of their subtypes,
+        according to the trace model of this trace.
+        """
+        model = self.get_model()
+        if model is None:
+            # model is not available; only direct types can be matched
+            model_uri = self.model_uri
+            return frozenset( coerce_to_uri(i, model_uri) for i in otypes )
+        return model.expand_obsel_types(otypes)
+
     def get_model_prefix(self, _NICE_SUFFIX={"#", "/"}):
         """
         I return a prefix-friendly version of the model URI for this trace.
@@ -727,4 +763,28 @@ class OpportunisticObselCollection(AbstractTraceObselsMixin):
         """
         return self.actual.delete(parameters, _trust)
 
+def _get_graph_keys(graph, trace_uri, reverse):
+    """
+    I return the sorted (end, begin, uri) keys of the obsels in graph.
+    """
+    in_trace = set(graph.subjects(KTBS.hasTrace, trace_uri))
+    begins = dict( (obs, int(begin))
+                   for obs, begin in graph.subject_objects(KTBS.hasBegin)
+                   if obs in in_trace )
+    keys = [ (int(end), begins[obs], obs)
+             for obs, end in graph.subject_objects(KTBS.hasEnd)
+             if obs in begins ]
+    keys.sort(reverse=reverse)
+    return keys
+
+def _slice_keys(keys, limit, offset):
+    """
+    I apply `limit` and `offset` to an iterable of keys.
+    """
+    if offset:
+        keys = islice(keys, offset, None)
+    if limit is not None:
+        keys = islice(keys, limit)
+    return keys
+
 _NOW = datetime.now
@@ -21,7 +21,7 @@
 """
 I provide the pythonic interface of ktbs:TraceModel .
 """
-from rdflib import Literal, RDF
+from rdflib import Literal, RDF, URIRef
 from warnings import warn
 
 from rdfrest.cores.factory import factory as universal_factory
@@ -278,6 +278,78 @@ class TraceModelMixin(InBaseMixin):
 
     ######## Extension to the abstract kTBS API ########
 
+    def get_obsel_type_closure(self):
+        """
+        I return the transitive closure of ``ktbs:hasSuperObselType``.
+
+        The result is a dict, mapping the URI of every obsel type of this
+        model (including inherited ones) to the frozenset of the URIs of all
+        its subtypes (direct or indirect), including itself.
+
+        NB: this dict is cached, and recomputed only when the etag of this
+        model or of one of its parents changes. It must not be modified.
+        """
+        models = [self]
+        models.extend( i for i in self.iter_parents(True)
+                       if not isinstance(i, URIRef) )
+        token = []
+        for model in models:
+            iter_etags = getattr(model, "iter_etags", None)
+            if iter_etags is None:
+                token = None # no etag available, so no caching
+                break
+            token.append(next(iter(iter_etags()), None))
+        if token is not None:
+            token = tuple(token)
+            cached = self.__dict__.get("_obsel_type_closure")
+            if cached is not None and cached[0] == token:
+                return cached[1]
+
+        supertypes = {}
+        for model in models:
+            state = model.state
+            for otype in state.subjects(RDF.type, KTBS.ObselType):
+                supertypes.setdefault(otype, set())
+            for otype, supertype \
+            in state.subject_objects(KTBS.hasSuperObselType):
+                supertypes.setdefault(otype, set()).add(supertype)
+                supertypes.setdefault(supertype, set())
+
+        subtypes = dict( (otype, set([otype])) for otype in supertypes )
+        for otype in supertypes:
+            seen = set([otype])
+            queue = list(supertypes[otype])
+            while queue:
+                supertype = queue.pop()
+                if supertype in seen:
+                    continue
+                seen.add(supertype)
+                subtypes[supertype].add(otype)
+                queue.extend(supertypes[supertype])
+        ret = dict( (otype, frozenset(subs))
+                    for otype, subs in subtypes.iteritems() )
+
+        if token is not None:
+            self._obsel_type_closure = (token, ret)
+        return ret
+
+    def expand_obsel_types(self, otypes):
+        """
+        I return the frozenset of the URIs of the given obsel types,
+        and of all their subtypes.
+
+        :param otypes: an iterable of obsel types or URIs
+          (relative to this model's URI)
+
+        Types that are unknown to this model are kept as is.
+        """
+        closure = self.get_obsel_type_closure()
+        ret = set()
+        for otype in otypes:
+            uri = coerce_to_uri(otype, self.uri)
+            ret.update(closure.get(uri, (uri,)))
+        return frozenset(ret)
+
     def add_supertype(self, element=None, element_type=None, super_type=None):
         """
         I add a super type to the element (obsel or relation) type in this 
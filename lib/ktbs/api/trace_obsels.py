@@ -21,9 +21,12 @@
 """
 I provide the pythonic interface to kTBS obsel collections.
 """
+from collections import OrderedDict
 from datetime import datetime
 from numbers import Real
+from threading import Lock
 from rdflib import RDF, URIRef
+from rdflib.plugins.sparql.processor import prepareQuery
 
 from rdfrest.cores import ICore
 from rdfrest.util import cache_result
@@ -127,16 +130,16 @@ class AbstractTraceObselsMixin(ICore):
             filters.append("?e <= %s" % end)
         if after is not None:
             if isinstance(after, URIRef):
-                bgp += "<{}> ktbs:hasBegin ?_ab;ktbs:hasEnd ?_ae. {}" \
+                bgp = "<{}> ktbs:hasBegin ?_ab;ktbs:hasEnd ?_ae. {}" \
                        .format(after, bgp)
                 after_values = (after, "?_ab", "?_ae")
             elif isinstance(after, ObselMixin):
                 after_values = (after.uri, after.begin, after.end)
             else:
                 raise ValueError("Invalid value for `after` (%r)" % after)
-            filters.append("?e > {2} || "
+            filters.append("(?e > {2} || "
                            "?e = {2} && ?b > {1} || "
-                           "?e = {2} && ?b = {1} && str(?obs) > \"{0}\""
+                           "?e = {2} && ?b = {1} && str(?obs) > \"{0}\")"
                            .format(*after_values))
         if before is not None:
             if isinstance(before, URIRef):
@@ -147,9 +150,9 @@ class AbstractTraceObselsMixin(ICore):
                 before_values = (before.uri, before.begin, before.end)
             else:
                 raise ValueError("Invalid value for `before` (%r)" % before)
-            filters.append("?e < {2} || "
+            filters.append("(?e < {2} || "
                            "?e = {2} && ?b < {1} || "
-                           "?e = {2} && ?b = {1} && str(?obs) < \"{0}\""
+                           "?e = {2} && ?b = {1} && str(?obs) < \"{0}\")"
                            .format(*before_values))
         if reverse:
             postface += "ORDER BY DESC(?e) DESC(?b) DESC(?obs)"
@@ -173,6 +176,65 @@ class AbstractTraceObselsMixin(ICore):
         ) % (selected, self.trace_uri, filters, bgp, postface)
         return query_str
 
+    def iter_bgp_matches(self, graph, bgp, model_prefix):
+        """
+        Iter over the obsels of `graph` matching the given BGP.
+
+        :param graph: the graph containing the obsels
+        :param bgp: a SPARQL Basic Graph Pattern, as in `build_select`:meth:
+        :param model_prefix: the namespace bound to the `m:` prefix in `bgp`
+
+        Contrarily to `build_select`:meth:, the query issued by this method
+        only depends on `bgp` and `model_prefix`: the trace is passed in
+        `initBindings`, and the obsels are neither sorted nor sliced
+        (this is left to the temporal index).
+        The parsed query can therefore be reused across calls
+        (see `get_prepared_query`:func:).
+
+        Each matching obsel is yielded only once, in no particular order.
+        """
+        query = get_prepared_query(_BGP_SELECT % bgp,
+                                   { "ktbs": KTBS, "m": model_prefix })
+        for obs, in graph.query(query,
+                                initBindings={ "_trace": self.trace_uri }):
+            yield obs
+
+
+def get_prepared_query(query_str, init_ns):
+    """
+    I return a prepared version of `query_str`.
+
+    Prepared queries are kept in a bounded LRU cache, so that frequently used
+    queries are only parsed once.
+
+    :param query_str: the text of a SPARQL query
+    :param init_ns: a dict of namespace prefixes used in the query
+    """
+    key = (query_str, tuple(sorted(init_ns.iteritems())))
+    with _PREPARED_QUERIES_LOCK:
+        ret = _PREPARED_QUERIES.pop(key, None)
+        if ret is not None:
+            _PREPARED_QUERIES[key] = ret # mark as most recently used
+            return ret
+    ret = prepareQuery(query_str, init_ns)
+    with _PREPARED_QUERIES_LOCK:
+        _PREPARED_QUERIES[key] = ret
+        while len(_PREPARED_QUERIES) > PREPARED_QUERIES_MAX:
+            _PREPARED_QUERIES.popitem(False)
+    return ret
+
+PREPARED_QUERIES_MAX = 128
+
+_PREPARED_QUERIES = OrderedDict()
+_PREPARED_QUERIES_LOCK = Lock()
+
+_BGP_SELECT = (
+    "SELECT DISTINCT ?obs WHERE {"
+        "?obs ktbs:hasTrace ?_trace;ktbs:hasBegin ?b;ktbs:hasEnd ?e."
+        "%s "
+    "}"
+)
+
 _TYPECONV = {
     KTBS.StoredTraceObsels: KTBS.StoredTrace,
     KTBS.ComputedTraceObsels: KTBS.ComputedTrace,
@@ -24,10 +24,13 @@ import sys
 from md5 import md5
 
 from logging import getLogger
-from threading import current_thread
+from threading import current_thread, Lock
 from contextlib import contextmanager
 
-from os import getpid, pathconf
+from errno import ENOENT, EPERM
+from os import getpid, kill, pathconf, remove, rename
+from os.path import join
+from tempfile import gettempdir
 
 from rdfrest.cores.local import _mark_as_deleted
 from rdfrest.cores.local import ILocalCore
@@ -109,7 +112,10 @@ class WithLockMixin(ILocalCore):
 
         # If the current thread wants to access the locked resource it is good to go.
         # This should only happen when the thread wants to lock the resource further down the call stack.
-        if self.__locking_thread_id == current_thread().ident:
+        # Resources of a staging service do not modify the store (see Service.make_staging),
+        # so they need no lock either.
+        if self.__locking_thread_id == current_thread().ident \
+        or self.service.staged_from is not None:
             yield
 
         # Else, either another thread wants to access the resource (and it will wait until the lock is released),
@@ -237,3 +243,183 @@ class WithLockMixin(ILocalCore):
                                         flags=posix_ipc.O_CREAT,
                                         initial_value=1) # if it doesn't exist
         return semaphore
+
+
+FLIGHT_DEFAULT_TIMEOUT = 60
+_FLIGHT_SEMAPHORES = {}
+_FLIGHT_SEMAPHORES_LOCK = Lock()
+_FLIGHTS = {} # uri -> id of the thread of this process running the flight
+
+def _get_flight_semaphore(uri):
+    """Return the semaphore used by `single_flight` for `uri`.
+
+    Contrarily to the semaphores of `WithLockMixin`, those semaphores are
+    kept open, as they are checked every time a computed trace is read.
+    """
+    with _FLIGHT_SEMAPHORES_LOCK:
+        semaphore = _FLIGHT_SEMAPHORES.get(uri)
+        if semaphore is None:
+            semaphore = posix_ipc.Semaphore(
+                name=get_semaphore_name(uri + "#flight"),
+                flags=posix_ipc.O_CREAT,
+                initial_value=1)
+            _FLIGHT_SEMAPHORES[uri] = semaphore
+        return semaphore
+
+@contextmanager
+def single_flight(uri, timeout=None):
+    """Ensure that only one thread (of any process) runs a "flight" for `uri`.
+
+    Other threads entering a flight for the same `uri` wait until the running
+    flight is over, and should then check whether their work is still needed
+    (typically, it has been done by the flight they waited for).
+    A thread can re-enter a flight it is running.
+
+    The pid of the process running the flight is recorded
+    (see `_get_flight_owner_path`:func:).
+    Every `timeout` seconds, waiting threads check that this process is
+    still alive; if it is, they keep waiting, however long the flight is.
+    If it is not (it crashed during the flight), the flight is considered
+    over, and one of the waiting threads takes it over.
+    If the owner of the flight can not be determined,
+    the waiting thread eventually proceeds without running the flight.
+
+    :param basestring uri: the URI of the resource concerned by the flight.
+    :param timeout: how many seconds to wait between two checks
+                    of the running flight
+                    (defaults to `FLIGHT_DEFAULT_TIMEOUT`).
+    :type timeout: int or float
+    """
+    if timeout is None:
+        timeout = FLIGHT_DEFAULT_TIMEOUT
+    thread_id = current_thread().ident
+    if _FLIGHTS.get(uri) == thread_id:
+        yield
+        return
+
+    semaphore = _get_flight_semaphore(uri)
+    acquired = _acquire_flight(uri, semaphore, timeout)
+    if acquired:
+        _FLIGHTS[uri] = thread_id
+        _write_flight_owner(uri)
+    try:
+        yield
+    finally:
+        if acquired:
+            del _FLIGHTS[uri]
+            _remove_file(_get_flight_owner_path(uri))
+            semaphore.release()
+
+def in_flight(uri):
+    """Return whether a thread (of any process) is running a flight for `uri`.
+
+    See `single_flight`.
+    """
+    if uri in _FLIGHTS:
+        return True
+    if posix_ipc.SEMAPHORE_VALUE_SUPPORTED:
+        return _get_flight_semaphore(uri).value == 0
+    return False
+
+def forget_flight(uri):
+    """Remove the semaphore used by `single_flight` for `uri`.
+
+    This should be called when the corresponding resource is deleted.
+    """
+    with _FLIGHT_SEMAPHORES_LOCK:
+        semaphore = _FLIGHT_SEMAPHORES.pop(uri, None)
+    if semaphore is not None:
+        semaphore.close()
+    try:
+        posix_ipc.unlink_semaphore(get_semaphore_name(uri + "#flight"))
+    except posix_ipc.ExistentialError:
+        pass # never created, or already removed by another process
+    _remove_file(_get_flight_owner_path(uri))
+
+def _acquire_flight(uri, semaphore, timeout):
+    """Acquire `semaphore` for `single_flight`, and return whether it was.
+
+    See `single_flight` for how crashed and slow flights are told apart.
+    """
+    owner_path = _get_flight_owner_path(uri)
+    unknown_owner = False
+    while True:
+        try:
+            semaphore.acquire(timeout)
+            return True
+        except posix_ipc.BusyError:
+            pass
+        owner = _read_flight_owner(owner_path)
+        if owner is None:
+            # the flight may have just ended, so give it another chance
+            if unknown_owner:
+                LOG.warning("flight for <%s> did not end after %ss, "
+                            "and its owner is unknown; proceeding",
+                            uri, 2*timeout)
+                return False
+            unknown_owner = True
+        elif _is_alive(owner):
+            LOG.info("flight for <%s> still running in process %s; waiting",
+                     uri, owner)
+            unknown_owner = False
+        else:
+            # only one of the waiting threads may give back the token
+            # held by the crashed process, so they compete for renaming
+            # the file recording it
+            taken_path = "%s.%s-%s" % (owner_path, getpid(),
+                                       current_thread().ident)
+            try:
+                rename(owner_path, taken_path)
+            except OSError, ex:
+                if ex.errno != ENOENT:
+                    raise
+            else:
+                if _read_flight_owner(taken_path) == owner:
+                    LOG.warning("flight for <%s> was left by crashed "
+                                "process %s; taking it over", uri, owner)
+                    _remove_file(taken_path)
+                    semaphore.release()
+                else: # another thread took it over, and a new flight began
+                    rename(taken_path, owner_path)
+            unknown_owner = False
+
+def _get_flight_owner_path(uri):
+    """Return the path of the file recording the owner of a flight.
+
+    The file contains the pid of the process running the flight for `uri`,
+    and only exists while the flight is running.
+    """
+    return join(gettempdir(), "ktbs-flight-%s" % md5(uri).hexdigest())
+
+def _write_flight_owner(uri):
+    """Record this process as the owner of the flight for `uri`.
+    """
+    with open(_get_flight_owner_path(uri), "w") as owner_file:
+        owner_file.write(str(getpid())) # PID may be that of a parent process
+
+def _read_flight_owner(owner_path):
+    """Return the pid recorded in `owner_path`, or None.
+    """
+    try:
+        with open(owner_path) as owner_file:
+            return int(owner_file.read())
+    except (IOError, ValueError):
+        return None
+
+def _is_alive(pid):
+    """Return whether process `pid` exists.
+    """
+    try:
+        kill(pid, 0)
+    except OSError, ex:
+        return ex.errno == EPERM # exists, but belongs to another user
+    return True
+
+def _remove_file(path):
+    """Remove the file at `path`, if it exists.
+    """
+    try:
+        remove(path)
+    except OSError, ex:
+        if ex.errno != ENOENT:
+            raise
@@ -19,9 +19,9 @@
 I provide the implementation of ktbs:Obsel .
 """
 import traceback
+from json import dumps as json_dumps, loads as json_loads
 
-from rdflib import Literal, URIRef, XSD
-from rdflib.plugins.sparql.processor import prepareQuery
+from rdflib import BNode, Graph, Literal, URIRef, XSD
 import re
 
 from datetime import datetime
@@ -30,7 +30,8 @@ from rdfrest.util.iso8601 import UTC
 from rdfrest.cores.local import ILocalCore
 from rdfrest.cores.mixins import WithCardinalityMixin, WithReservedNamespacesMixin, \
     WithTypedPropertiesMixin
-from rdfrest.util import bounded_description, Diagnosis, make_fresh_uri, parent_uri
+from rdfrest.util import bounded_description, check_new, Diagnosis, parent_uri
+from .resource import METADATA
 from ..api.obsel import ObselMixin
 from ..namespace import KTBS, RDF
 from ..utils import SKOS
@@ -263,13 +264,35 @@ class _ObselImpl(ILocalCore):
         """I implement :meth:`rdfrest.cores.local.ILocalCore.mint_uri`.
 
         I use the skos:prefLabel of the resource to mint a URI, else the
-        basename.
+        basename, followed by a sequence number (e.g. ``o-000123``).
+
+        Sequence numbers are kept per prefix in the metadata of the trace,
+        so that no candidate URI has to be generated and probed.
+        This relies on the caller holding the lock of the base
+        (as `.trace.StoredTrace.post_graph`:meth: does).
         """
         # Do NOT call super method, as this is the base implementation.
         label = (new_graph.value(created, SKOS.prefLabel)
                  or basename).lower()
-        prefix = "%s%s-" % (target.uri, _NON_ALPHA.sub("-", label))
-        return make_fresh_uri(target.obsel_collection.state, prefix, suffix)
+        prefix = "%s-" % _NON_ALPHA.sub("-", label)
+        metadata = target.metadata
+        stored = metadata.value(target.uri, METADATA.obsel_counters)
+        if stored is None:
+            counters = {}
+        else:
+            counters = json_loads(stored)
+        counter = counters.get(prefix, 0)
+        obsels_state = target.obsel_collection.state
+        while True:
+            counter += 1
+            ret = URIRef("%s%s%06d%s" % (target.uri, prefix, counter, suffix))
+            # only conflicts with client-provided identifiers are possible
+            if check_new(obsels_state, ret):
+                break
+        counters[prefix] = counter
+        metadata.set((target.uri, METADATA.obsel_counters,
+                      Literal(json_dumps(counters))))
+        return ret
 
     @classmethod
     def create(cls, service, uri, new_graph):
@@ -317,24 +340,67 @@ def get_obsel_bounded_description(node, graph, fill=None):
     :param graph: the graph from which to retrieve the description
     :param fill: if provided, fill this graph rather than a fresh one, and return it
     """
-    ret = bounded_description(node, graph, fill)
-    trace_uri = ret.value(node, KTBS.hasTrace)
+    return get_obsels_bounded_descriptions([node], graph, fill)
+
+def get_obsels_bounded_descriptions(nodes, graph, fill=None):
+    """I fill a graph with the bounded descriptions of several obsels.
+
+    This is equivalent to calling :func:`get_obsel_bounded_description` on
+    every node, but relies only on triple lookups, rather than running a
+    SPARQL query per obsel to find related obsels.
+
+    :param nodes: an iterable of nodes (uri or blank) to describe
+    :param graph: the graph from which to retrieve the descriptions
+    :param fill: if provided, fill this graph rather than a fresh one, and return it
+    """
+    if fill is None:
+        ret = Graph()
+    else:
+        ret = fill
     add = ret.add
-    for other, in graph.query(_RELATED_OBSELS, initBindings = { "obs": node }):
-        add((other, KTBS.hasTrace, trace_uri))
+    triples = graph.triples
+    has_trace = KTBS.hasTrace
+    seen = set()
+    for node in nodes:
+        trace_uri = None
+        neighbours = set()
+        waiting = set()
+        for t_in in triples((None, None, node)):
+            add(t_in)
+            neighbours.add(t_in[0])
+        for t_out in triples((node, None, None)):
+            add(t_out)
+            pred, obj = t_out[1:]
+            if pred == has_trace and trace_uri is None:
+                trace_uri = obj
+            elif not isinstance(obj, Literal):
+                neighbours.add(obj)
+        seen.add(node)
+
+        # related obsels
+        if trace_uri is not None:
+            for other in neighbours:
+                if (other, has_trace, trace_uri) in graph:
+                    add((other, has_trace, trace_uri))
+
+        # blank nodes, as in rdfrest.util.bounded_description
+        waiting.update( i for i in neighbours
+                        if isinstance(i, BNode) and i not in seen )
+        while waiting:
+            bnode = waiting.pop()
+            for t_in in triples((None, None, bnode)):
+                add(t_in)
+                subj = t_in[0]
+                if isinstance(subj, BNode) and subj not in seen:
+                    waiting.add(subj)
+            for t_out in triples((bnode, None, None)):
+                add(t_out)
+                obj = t_out[2]
+                if isinstance(obj, BNode) and obj not in seen:
+                    waiting.add(obj)
+            seen.add(bnode)
     return ret
 
 
-_RELATED_OBSELS = prepareQuery("""
-    SELECT DISTINCT ?other
-    {
-        { ?obs ?pred ?other . }
-        UNION
-        { ?other ?pred ?obs . }
-        ?obs <%s> ?trace .
-        ?other <%s> ?trace .
-    }
-    """ % (KTBS.hasTrace, KTBS.hasTrace))
-
 _NON_ALPHA = re.compile(r'[^\w]+')
 _NOW = datetime.now
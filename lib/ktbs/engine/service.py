@@ -121,6 +121,10 @@ class KtbsService(Service):
                     TraceStatistics,
                     ]
 
+        # temporal indexes of obsel collections, by URI
+        # (see ktbs.engine.trace_obsels.AbstractTraceObsels.get_temporal_index)
+        self.temporal_indexes = {}
+
         # self.init_ktbs : always give the initialization method
         Service.__init__(self, classes, service_config, self.init_ktbs)
 
@@ -150,6 +154,16 @@ class KtbsService(Service):
                 assert rdf_types is None or KTBS.Obsel in rdf_types, rdf_types
                 ret = Obsel(parent, uri)
         return ret
+
+    def make_staging(self):
+        """I override :meth:`rdfrest.cores.local.Service.make_staging`
+
+        The staging copy starts with the same temporal indexes,
+        but does not share the dict holding them.
+        """
+        ret = super(KtbsService, self).make_staging()
+        ret.temporal_indexes = dict(self.temporal_indexes)
+        return ret
             
     @classmethod
     def init_ktbs(cls, service):
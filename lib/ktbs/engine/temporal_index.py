@@ -0,0 +1,171 @@
+#    This file is part of KTBS <http://liris.cnrs.fr/sbt-dev/ktbs>
+#    Copyright (C) 2011-2012 Pierre-Antoine Champin <pchampin@liris.cnrs.fr> /
+#    Universite de Lyon <http://www.universite-lyon.fr>
+#
+#    KTBS is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    KTBS is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with KTBS.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+I provide a temporal index of the obsels of an obsel collection.
+
+The index keeps the obsels sorted by (end, begin, uri), which is the order
+used everywhere in kTBS, so that slices of obsel collections can be computed
+as range scans rather than by sorting the whole collection with SPARQL.
+"""
+from bisect import bisect_left, bisect_right, insort
+
+from rdflib import URIRef
+
+from ..namespace import KTBS
+
+_INF = float("inf")
+
+class TemporalIndex(object):
+    """I keep the obsels of a collection sorted by (end, begin, uri).
+
+    Each entry of the index is a *key*, i.e. an (end, begin, uri) tuple.
+
+    :param etag: the etag of the obsel collection this index is valid for
+    """
+
+    def __init__(self, etag=None):
+        self.etag = etag
+        self._keys = []
+        self._by_uri = {}
+
+    @classmethod
+    def build(cls, state, trace_uri, etag=None):
+        """I build an index from the obsels of `trace_uri` in `state`.
+        """
+        in_trace = set(state.subjects(KTBS.hasTrace, trace_uri))
+        begins = dict( (obs, int(begin))
+                       for obs, begin in state.subject_objects(KTBS.hasBegin)
+                       if obs in in_trace )
+        by_uri = {}
+        for obs, end in state.subject_objects(KTBS.hasEnd):
+            begin = begins.get(obs)
+            if begin is not None:
+                by_uri[obs] = (int(end), begin, obs)
+        ret = cls(etag)
+        ret._by_uri = by_uri
+        ret._keys = sorted(by_uri.itervalues())
+        return ret
+
+    def copy(self):
+        """I return a copy of this index, that can be modified independently.
+        """
+        ret = type(self)(self.etag)
+        ret._keys = list(self._keys)
+        ret._by_uri = dict(self._by_uri)
+        return ret
+
+    def __len__(self):
+        return len(self._keys)
+
+    def get_key(self, uri):
+        """I return the key of the given obsel, or None if it is not indexed.
+        """
+        return self._by_uri.get(uri)
+
+    def get_last_key(self):
+        """I return the key of the last obsel, or None if the index is empty.
+        """
+        keys = self._keys
+        if keys:
+            return keys[-1]
+        else:
+            return None
+
+    def add(self, uri, begin, end):
+        """I add (or move) obsel `uri` to the index.
+        """
+        key = (int(end), int(begin), URIRef(uri))
+        old_key = self._by_uri.get(uri)
+        if old_key == key:
+            return
+        if old_key is not None:
+            self._remove_key(old_key)
+        self._by_uri[key[2]] = key
+        keys = self._keys
+        if not keys or keys[-1] < key:
+            keys.append(key) # most common case
+        else:
+            insort(keys, key)
+
+    def discard(self, uri):
+        """I remove obsel `uri` from the index, if present.
+        """
+        key = self._by_uri.pop(uri, None)
+        if key is not None:
+            self._remove_key(key)
+
+    def iter_keys(self, begin=None, end=None, after=None, before=None,
+                  reverse=False, limit=None, offset=None,
+                  maxb=None, mine=None):
+        """I iter over the keys matching the given criteria.
+
+        * begin: minimum begin (included)
+        * end: maximum end (included)
+        * after: a key; only keys strictly greater will be yielded
+        * before: a key; only keys strictly lower will be yielded
+        * reverse: whether to yield keys in decreasing order
+        * limit: maximum number of keys to yield
+        * offset: number of matching keys to skip
+        * maxb: maximum begin (included)
+        * mine: minimum end (included)
+
+        NB: as begin <= end for every obsel, `begin` is used to narrow the
+        range of scanned keys, so only `maxb` requires filtering.
+        """
+        keys = self._keys
+        low = 0
+        high = len(keys)
+        if after is not None:
+            low = bisect_right(keys, after)
+        min_end = max(begin, mine) # None is lower than any number
+        if min_end is not None:
+            low = max(low, bisect_left(keys, (min_end,)))
+        if before is not None:
+            high = bisect_left(keys, before, low)
+        if end is not None:
+            high = min(high, bisect_left(keys, (end, _INF), low))
+        if low >= high or limit is not None and limit <= 0:
+            return
+
+        if reverse:
+            indexes = xrange(high-1, low-1, -1)
+        else:
+            indexes = xrange(low, high)
+        to_skip = offset or 0
+        to_yield = limit
+        for i in indexes:
+            key = keys[i]
+            if begin is not None and key[1] < begin \
+            or maxb is not None and key[1] > maxb:
+                continue
+            if to_skip:
+                to_skip -= 1
+                continue
+            yield key
+            if to_yield is not None:
+                to_yield -= 1
+                if to_yield == 0:
+                    return
+
+    def _remove_key(self, key):
+        """I remove `key` from the sorted list of keys.
+        """
+        keys = self._keys
+        i = bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            del keys[i]
@@ -20,6 +20,7 @@ I provide the implementation of ktbs:StoredTrace and ktbs:ComputedTrace .
 """
 import traceback
 from datetime import datetime
+from json import dumps as json_dumps, loads as json_loads
 from logging import getLogger
 
 from rdflib import BNode, Graph, Literal, URIRef, XSD
@@ -27,12 +28,12 @@ from rdflib.plugins.sparql.processor import prepareQuery
 
 from ktbs.engine.trace_stats import TraceStatistics
 from ktbs.time import lit2datetime, get_converter_to_unit
-from rdfrest.exceptions import InvalidDataError
+from rdfrest.exceptions import InvalidDataError, RdfRestException
 from rdfrest.cores.factory import factory as universal_factory
 from rdfrest.cores.local import compute_added_and_removed
 from rdfrest.cores.mixins import FolderishMixin
 from rdfrest.util import bounded_description, cache_result, random_token, replace_node_sparse, \
-    Diagnosis
+    replace_node_dense, Diagnosis
 from .base import InBase
 from .builtin_method import get_builtin_method_impl
 from .obsel import Obsel
@@ -40,6 +41,7 @@ from .resource import KtbsPostableMixin, METADATA
 from .trace_obsels import ComputedTraceObsels, StoredTraceObsels
 from ..api.trace import AbstractTraceMixin, StoredTraceMixin, ComputedTraceMixin
 from ..namespace import KTBS, KTBS_NS_URI
+from ..serpar.line_parsers import get_line_parser, iter_line_content_types
 from ..utils import extend_api, check_new
 
 
@@ -83,6 +85,33 @@ class AbstractTrace(AbstractTraceMixin, InBase):
         obsels_uri = self.state.value(self.uri, KTBS.hasObselCollection)
         return self.service.get(obsels_uri, [self._obsels_cls.RDF_MAIN_TYPE])
 
+    def iter_dependent_obsels_uris(self):
+        """I iter over the URIs of the obsel collections of all the traces
+        depending (directly or transitively) on this trace.
+
+        This is computed once, then cached in the metadata of this trace
+        until the sources of this trace or of one of its dependent traces
+        change (see `_notify_sources`:meth:).
+        Note also that this does not require to refresh the state of the
+        dependent traces.
+
+        The computation holds the lock of the base, as does any change of
+        sources, so that a closure invalidated by another thread (or process)
+        can not be stored afterwards.
+        """
+        stored = self.metadata.value(self.uri, METADATA.dependent_obsels)
+        if stored is None:
+            with self.get_base().lock(self):
+                # check again, in case a concurrent thread just computed it
+                stored = self.metadata.value(self.uri,
+                                             METADATA.dependent_obsels)
+                if stored is None:
+                    ret = self._compute_dependent_obsels_uris()
+                    self.metadata.set((self.uri, METADATA.dependent_obsels,
+                                       Literal(json_dumps(ret))))
+                    return ( URIRef(i) for i in ret )
+        return ( URIRef(i) for i in json_loads(stored) )
+
 
     ######## ILocalCore (and mixins) implementation  ########
 
@@ -193,6 +222,27 @@ class AbstractTrace(AbstractTraceMixin, InBase):
 
     ######## Private methods  ########
 
+    def _compute_dependent_obsels_uris(self):
+        """I implement `iter_dependent_obsels_uris`:meth:, without caching.
+
+        :return: a list of unicode URIs
+        """
+        store = self.service.store
+        ret = []
+        visited = set([self.uri])
+        queue = [self.uri]
+        while queue:
+            graph = Graph(store, queue.pop(0))
+            for ttr_uri in graph.subjects(KTBS.hasSource, graph.identifier):
+                if ttr_uri in visited:
+                    continue
+                visited.add(ttr_uri)
+                queue.append(ttr_uri)
+                obsels_uri = Graph(store, ttr_uri).value(
+                    ttr_uri, KTBS.hasObselCollection)
+                ret.append(unicode(obsels_uri))
+        return ret
+
     def _ack_source_change(self, old_source_uris, new_source_uris):
         """I record the fact that my sources have changed
         """
@@ -202,7 +252,13 @@ class AbstractTrace(AbstractTraceMixin, InBase):
     @classmethod
     def _notify_sources(cls, service, uri, new_source_uris, old_source_uris=()):
         """I inform sources that they are (or are no longer) sources of uri.
+
+        I also invalidate the dependent obsels cached by the old and new
+        sources, and by the traces they depend on
+        (see `iter_dependent_obsels_uris`:meth:).
         """
+        old_source_uris = list(old_source_uris) # may be generators
+        new_source_uris = list(new_source_uris)
         factory = service.get
         for old in old_source_uris:
             with factory(old).edit(_trust=True) as editable:
@@ -210,6 +266,19 @@ class AbstractTrace(AbstractTraceMixin, InBase):
         for new in new_source_uris:
             with factory(new).edit(_trust=True) as editable:
                 editable.add((uri, KTBS.hasSource, new))
+        store = service.store
+        get_metadata_graph = service.get_metadata_graph
+        visited = set()
+        queue = old_source_uris + new_source_uris
+        while queue:
+            src_uri = queue.pop(0)
+            if src_uri in visited:
+                continue
+            visited.add(src_uri)
+            get_metadata_graph(src_uri).remove(
+                (src_uri, METADATA.dependent_obsels, None))
+            queue.extend(Graph(store, src_uri).objects(src_uri,
+                                                       KTBS.hasSource))
 
 
 class StoredTrace(StoredTraceMixin, KtbsPostableMixin, AbstractTrace):
@@ -218,6 +287,63 @@ class StoredTrace(StoredTraceMixin, KtbsPostableMixin, AbstractTrace):
 
     _obsels_cls = StoredTraceObsels
 
+    ######## Extension to the abstract kTBS API  ########
+    # (only available on *local* objects)
+
+    def post_lines(self, lines, content_type, parameters=None):
+        """I create obsels from `lines`, in a line-oriented format.
+
+        :param lines: an iterable of lines
+        :param content_type: a content-type with a registered line parser
+          (see `ktbs.serpar.line_parsers`:mod:)
+        :param parameters: the query string parameters
+
+        :return: a pair (created, errors), where `created` is the list of the
+          URIs of created obsels, and `errors` a list of (line number, message)
+          pairs describing the obsels that could not be created
+
+        This is meant for bulk ingestion:
+        contrarily to `post_graph`:meth:, obsels are validated and created
+        one by one, as they are read, without building a graph of the whole
+        payload. All obsels are added with a single call to
+        `~.trace_obsels.AbstractTraceObsels.add_obsel_graphs`:meth:;
+        invalid obsels do not prevent the others to be created.
+        """
+        self.check_parameters(parameters, parameters, "post_graph")
+        parse = get_line_parser(content_type)
+        if parse is None:
+            raise InvalidDataError("Unsupported content-type %s" % content_type)
+
+        created = []
+        errors = []
+
+        def iter_obsel_graphs():
+            "yield the graphs of the valid obsels"
+            for lineno, node, graph, error in parse(lines, self):
+                if error is None:
+                    try:
+                        node, error = self._check_line_obsel(node, graph)
+                    except (RdfRestException, ValueError), ex:
+                        error = unicode(ex)
+                if error is None:
+                    created.append(node)
+                    yield graph
+                else:
+                    errors.append((lineno, error))
+
+        with self.get_base().lock(self):
+            # NB: each obsel is added before the next one is checked,
+            # so homonymic obsels in the same payload are detected
+            self.obsel_collection.add_obsel_graphs(iter_obsel_graphs())
+
+        return created, errors
+
+    @property
+    def line_content_types(self):
+        """The content-types accepted by `post_lines`:meth:.
+        """
+        return frozenset(iter_line_content_types())
+
     ######## ILocalCore (and mixins) implementation  ########
 
     RDF_MAIN_TYPE = KTBS.StoredTrace
@@ -348,11 +474,6 @@ class StoredTrace(StoredTraceMixin, KtbsPostableMixin, AbstractTrace):
         assert not bnode_candidates, bnode_candidates
         if not ret:
             raise InvalidDataError("No obsel found in posted graph")
-
-        stats = self.trace_statistics
-        if stats:
-            # Traces created before @stats was introduced have no trace_statistics
-            stats.metadata.set((stats.uri, METADATA.dirty, YES))
         return ret
                 
     def get_created_class(self, rdf_type):
@@ -364,6 +485,27 @@ class StoredTrace(StoredTraceMixin, KtbsPostableMixin, AbstractTrace):
         # self is not used #pylint: disable=R0201
         return Obsel
 
+    ######## Private methods ########
+
+    def _check_line_obsel(self, node, graph):
+        """I check and complete an obsel parsed by `post_lines`:meth:.
+
+        :return: the URI of the obsel (minted if `node` is a BNode),
+          and an error message (or None)
+        """
+        diag = self.check_posted_graph(None, node, graph)
+        if diag:
+            if isinstance(node, BNode):
+                new_node = Obsel.mint_uri(self, graph, node)
+                replace_node_dense(graph, node, new_node)
+                node = new_node
+            Obsel.complete_new_graph(self.service, node, None, graph)
+            diag = Obsel.check_new_graph(self.service, node, None, graph)
+        if diag:
+            return node, None
+        else:
+            return node, unicode(diag)
+
 # the following query gets all the candidate obsels in a POSTed graph,
 # and orders them correctly, guessing implicit values
 _SELECT_CANDIDATE_OBSELS = prepareQuery("""
@@ -441,6 +583,7 @@ class ComputedTrace(ComputedTraceMixin, FolderishMixin, AbstractTrace):
             self._ack_method_change(prepared.old_method, new_method)
         new_params = set(self.state.objects(self.uri, KTBS.hasParameter))
         if prepared.old_params != new_params:
+            self._method_impl.forget_computed_trace(self)
             self._mark_dirty()
 
     def ack_delete(self, parameters):
@@ -449,6 +592,7 @@ class ComputedTrace(ComputedTraceMixin, FolderishMixin, AbstractTrace):
         I notify my method that I'm no longer using it.
         """
         method_uri = self.state.value(self.uri, KTBS.hasMethod)
+        self._method_impl.forget_computed_trace(self)
         self._ack_method_change(method_uri, None)
         super(ComputedTrace, self).ack_delete(parameters)
 
@@ -507,6 +651,9 @@ class ComputedTrace(ComputedTraceMixin, FolderishMixin, AbstractTrace):
 
         I notify my old and my new method of the change;
         """
+        old_method_impl = self.__method_impl
+        if old_method_impl is not None and new_method_uri is not None:
+            old_method_impl.forget_computed_trace(self)
         old_method = self.service.get(old_method_uri)
         if old_method is not None: # it is not a built-in method
             with old_method.edit(_trust=True) as editable:
@@ -520,7 +667,8 @@ class ComputedTrace(ComputedTraceMixin, FolderishMixin, AbstractTrace):
         self._mark_dirty()
 
     def _mark_dirty(self):
-        """I force my computed data and obsels to be recomputed.
+        """I force my computed data and obsels to be recomputed,
+        as well as the obsels of all the traces depending on me.
 
         Note that the recomputation will only occur when my state (or the state
         of my obsel collection) is required.
@@ -528,6 +676,10 @@ class ComputedTrace(ComputedTraceMixin, FolderishMixin, AbstractTrace):
         self.metadata.add((self.uri, METADATA.dirty, YES))
         obsels = self.obsel_collection
         obsels.metadata.add((obsels.uri, METADATA.dirty, YES))
+        get_metadata_graph = self.service.get_metadata_graph
+        for obsels_uri in self.iter_dependent_obsels_uris():
+            get_metadata_graph(obsels_uri).set((obsels_uri, METADATA.dirty,
+                                                YES))
         stats = self.trace_statistics
         if stats:
             # Traces created before @stats was introduced have no trace_statistics
@@ -19,28 +19,51 @@
 I provide the implementation of kTBS obsel collections.
 """
 import traceback
+from contextlib import contextmanager
 from itertools import chain
+from json import dumps as json_dumps, loads as json_loads
 from logging import getLogger
+from multiprocessing.pool import ThreadPool
+from Queue import Queue
 import sys
+from threading import local, RLock
+
+from numbers import Real
 
 from rdflib import Graph, Literal, RDF, URIRef
-from rdflib.plugins.sparql.processor import prepareQuery
 
 from rdfrest.exceptions import CanNotProceedError, InvalidParametersError, \
     MethodNotAllowedError
 from rdfrest.cores.local import NS as RDFREST
-from rdfrest.util import Diagnosis, coerce_to_uri
+from rdfrest.util import Diagnosis, coerce_to_uri, ReadOnlyGraph
+from .lock import forget_flight, in_flight, single_flight
 from .resource import KtbsResource, METADATA
-from .obsel import get_obsel_bounded_description
+from .obsel import get_obsels_bounded_descriptions
+from .temporal_index import TemporalIndex
+from ..api.obsel import ObselMixin
 from ..api.trace_obsels import AbstractTraceObselsMixin
 from ..namespace import KTBS
 
 
 LOG = getLogger(__name__)
 
+# the number of edits remembered by `AbstractTraceObsels.get_earliest_change`
+CHANGE_LOG_SIZE = 64
+
+# how many times `ComputedTraceObsels._recompute` computes obsels
+# before giving up on concurrent modifications (see `_Recomputation`)
+RECOMPUTE_ATTEMPTS = 3
+
+# how many threads compute independent ancestors of a computed trace
+# concurrently (see `_recompute_concurrently`)
+RECOMPUTE_THREADS = 4
+
 class AbstractTraceObsels(AbstractTraceObselsMixin, KtbsResource):
     """I provide the implementation of ktbs:AbstractTraceObsels
     """
+    # (parameters, etag, keys) of the last slice looked up by precompute_etags
+    _precomputed_slice = None
+
     ######## Public methods ########
     # (only available in the local implementation)
 
@@ -127,8 +150,9 @@ class AbstractTraceObsels(AbstractTraceObselsMixin, KtbsResource):
         If you need to add only one obsel,
         you can use this method *without* using any `~rdfrest.cores.ICore.edit`:meth: context.
 
-        If you need to call this method multiple time,
-        it is more efficient to wrap all the calls to ``add_obsel_graph``
+        If you need to add several obsels,
+        it is more efficient to use `add_obsel_graphs`:meth:,
+        or at least to wrap all the calls to ``add_obsel_graph``
         inside a single `~rdfrest.cores.ICore.edit`:meth: context,
         which then *must* have the ``add_obsels_only`` parameter set.
 
@@ -138,18 +162,205 @@ class AbstractTraceObsels(AbstractTraceObselsMixin, KtbsResource):
         be removed, as it will not change the
         `log_mon_tag`:meth`.
         """
+        self.add_obsel_graphs((graph,), _trust)
+
+    def add_obsel_graphs(self, graphs, _trust=True):
+        """Add several obsels, each of them described in one graph of `graphs`.
+
+        The result is the same as calling `add_obsel_graph`:meth: on each
+        graph in turn, but monotonicity is checked in a single pass
+        over the whole batch.
+
+        `graphs` can be any iterable (e.g. a generator); each graph is added
+        to the obsel collection *before* the next one is pulled,
+        so a generator can rely on the obsels previously added
+        (e.g. to link the new obsel to them).
+        """
         ectx = self._edit_context
         assert ectx is None or ectx[0], \
-            "No point in calling add_obsel_graph inside an untrusted edit context"
+            "No point in calling add_obsel_graphs inside an untrusted edit context"
 
         with self.edit({"add_obsels_only": 1}, _trust=_trust) \
         as editable:
             prepared = self._edit_context[2]
-            # inner context is used to apply the changes and have them
-            # go through check_new_graph
-            editable.addN( (s, p, o, editable) for (s, p, o) in graph)
+            statistics = prepared.statistics
+            index = prepared.temporal_index
+            get_mon_keys = self._get_mon_keys
+            mon_keys = []
+            for graph in graphs:
+                if statistics is not None:
+                    # must be done *before* graph is added to self.state
+                    self._update_statistics(graph, statistics)
+                # inner context is used to apply the changes and have them
+                # go through check_new_graph
+                editable.addN( (s, p, o, editable) for (s, p, o) in graph)
+
+                mon_keys.append(get_mon_keys(graph))
+                if index is not None:
+                    self._update_temporal_index(graph, index)
+
+            self._detect_mon_change(mon_keys, prepared)
+
+    def get_last_obsel_key(self):
+        """I return the (end, begin, uri) key of the last obsel, or None.
+
+        This information is maintained as metadata by `ack_edit`:meth:,
+        so this method does not query the obsels themselves.
+        """
+        metadata_value = self.metadata.value
+        uri = self.uri
+        last_obsel = metadata_value(uri, METADATA.last_obsel)
+        if last_obsel is None:
+            return None
+        last_end = metadata_value(uri, METADATA.last_end)
+        last_begin = metadata_value(uri, METADATA.last_begin)
+        if last_end is None or last_begin is None:
+            # metadata stored by an older version of kTBS
+            state_value = self.state.value
+            last_end = state_value(last_obsel, KTBS.hasEnd)
+            last_begin = state_value(last_obsel, KTBS.hasBegin)
+        return (int(last_end), int(last_begin), last_obsel)
+
+    def get_earliest_change(self, str_mon_tag):
+        """I return the earliest end timestamp touched since `str_mon_tag`.
+
+        `str_mon_tag` is a value previously returned by
+        `get_str_mon_tag`:meth:. I return the minimum end of the obsels
+        added, modified or removed by all the edits that have changed the
+        str_mon_tag since then, so that obsels ending before that timestamp
+        are known to be unchanged.
+
+        I return None if that timestamp can not be determined, i.e. if
+        `str_mon_tag` is too old (see `CHANGE_LOG_SIZE`:data:), or if one of
+        those edits was not performed by `add_obsel_graphs`:meth: or
+        `remove_obsels_from`:meth:.
+        """
+        str_mon_tag = str(str_mon_tag)
+        if str_mon_tag == self.str_mon_tag:
+            return None # nothing changed
+        stored = self.metadata.value(self.uri, METADATA.change_log)
+        if stored is None:
+            return None
+        change_log = json_loads(stored)
+        for i, (old_tag, _) in enumerate(change_log):
+            if old_tag == str_mon_tag:
+                break
+        else:
+            return None
+        earliests = [ earliest for _, earliest in change_log[i:] ]
+        if None in earliests:
+            return None
+        return min(earliests)
+
+    def remove_obsels_from(self, end, _trust=True):
+        """Remove all the obsels ending at or after `end`.
+
+        Contrarily to a generic edit, this keeps the temporal index
+        (see `get_temporal_index`:meth:), and records `end` as the earliest
+        change (see `get_earliest_change`:meth:). This is typically used by
+        methods to recompute only the end of a computed trace.
+        """
+        ectx = self._edit_context
+        assert ectx is None, \
+            "remove_obsels_from can not be called inside an edit context"
+        index = self.get_temporal_index()
+        to_remove = [ key[2] for key in index.iter_keys(mine=end) ]
+        if not to_remove:
+            return
+        descriptions = get_obsels_bounded_descriptions(to_remove, self.state)
+        with self.edit(_trust=_trust) as editable:
+            prepared = self._edit_context[2]
+            for triple in descriptions:
+                editable.remove(triple)
+            for obs in to_remove:
+                index.discard(obs)
+            prepared.earliest_change = end
+            prepared.temporal_index = index
+        self.service.temporal_indexes[self.uri] = index
+
+    def get_temporal_index(self):
+        """I return the `.temporal_index.TemporalIndex`:class: of this collection.
+
+        The index is built on demand, and then kept by the service;
+        it is maintained by `add_obsel_graph`:meth:, and rebuilt whenever the
+        collection is modified in any other way (or by another process).
+
+        I return None inside an edit context that is not ``add_obsels_only``,
+        as the index can not be trusted before the edit is acknowledged.
+        """
+        ectx = self._edit_context
+        if ectx is not None:
+            if len(ectx) < 3:
+                return None
+            return ectx[2].temporal_index
+        indexes = self.service.temporal_indexes
+        etag = self.etag
+        index = indexes.get(self.uri)
+        if index is None or index.etag != etag:
+            index = TemporalIndex.build(self.state, self.trace_uri, etag)
+            indexes[self.uri] = index
+        return index
+
+    def get_statistics(self):
+        """I return statistics about the obsels of this collection.
+
+        The result is a dict with the following keys:
+
+        * count: the number of obsels
+        * types: a dict mapping obsel type URIs to their number of obsels
+        * minb: the minimum begin timestamp of all obsels (or None)
+        * maxe: the maximum end timestamp of all obsels (or None)
+
+        Those statistics are stored in the metadata graph, and maintained by
+        `add_obsel_graph`:meth:; they are only fully recomputed after the
+        collection has been modified in a non-monotonic way
+        (i.e. when `log_mon_tag` has changed).
+        """
+        ret = None
+        stored = self.metadata.value(self.uri, METADATA.statistics)
+        if stored is not None:
+            ret = json_loads(stored)
+            if ret.pop("log_mon_tag") != self.log_mon_tag:
+                ret = None
+        if ret is None:
+            ret = self._compute_statistics()
+            if self._edit_context is None:
+                self._store_statistics(ret)
+        return ret
+
+    def iter_obsel_keys(self, begin=None, end=None, after=None, before=None,
+                        reverse=False, limit=None, offset=None,
+                        maxb=None, mine=None):
+        """I iter over the (end, begin, uri) tuples of the matching obsels.
 
-            self._detect_mon_change(graph, prepared)
+        Parameters have the same meaning as in
+        `~.trace_obsels.AbstractTraceObselsMixin.build_select`:meth:,
+        plus `maxb` (maximum begin) and `mine` (minimum end).
+
+        Whenever possible, I use the temporal index of this collection
+        (see `get_temporal_index`:meth:), so that the cost is proportional to
+        the size of the slice rather than to the size of the collection.
+        """
+        index = None
+        if (begin is None or isinstance(begin, Real)) \
+        and (end is None or isinstance(end, Real)):
+            index = self.get_temporal_index()
+        if index is None:
+            return self._iter_obsel_keys_sparql(begin, end, after, before,
+                                                reverse, limit, offset,
+                                                maxb, mine)
+
+        after_key = before_key = None
+        if after is not None:
+            after_key = self._get_index_key(index, after, "after")
+            if after_key is None:
+                return iter(())
+        if before is not None:
+            before_key = self._get_index_key(index, before, "before")
+            if before_key is None:
+                return iter(())
+        return index.iter_keys(begin, end, after_key, before_key, reverse,
+                               limit, offset, maxb, mine)
 
 
     ######## ICore implementation  ########
@@ -174,92 +385,45 @@ class AbstractTraceObsels(AbstractTraceObselsMixin, KtbsResource):
             return super(AbstractTraceObsels, self).get_state(None)
         else:
             self.check_parameters(parameters, parameters, "get_state")
-            graph = Graph(identifier=self.uri)
-            graph_add = graph.add
-
-            # fill graph with data about the obsel collection
-            for triple in self.state.triples((self.uri, None, None)):
-                graph_add(triple)
-            for triple in self.state.triples((None, None, self.uri)):
-                graph_add(triple)
-
-            # build SPARQL query to retrieve matching obsels
-            # NB: not sure if caching the parsed query would be beneficial here
-            query_filter = []
-            minb = parameters.get("minb")
-            maxb = parameters.get("maxb")
-            if maxb is not None:
-                query_filter.append("?b <= %s" % maxb)
-            mine = parameters.get("mine")
-            if mine is not None:
-                query_filter.append("?e >= %s" % mine)
-            maxe = parameters.get("maxe")
-            after = parameters.get("after")
-            if after is not None:
-                after = coerce_to_uri(after)
-            before = parameters.get("before")
-            if before is not None:
-                before = coerce_to_uri(before)
-            if query_filter:
-                query_filter = "FILTER((%s))" % (") && (".join(query_filter))
-            else:
-                query_filter = ""
+            return self._get_slice(parameters)
 
-            reverse = (parameters.get("reverse", "no").lower()
-                       not in ("false", "no", "0"))
-            limit = parameters.get("limit")
-            offset = parameters.get("offset")
 
-            query_str = (
-                "PREFIX ktbs: <http://liris.cnrs.fr/silex/2009/ktbs#> %s"
-                % self.build_select(minb, maxe, after, before, reverse, query_filter,
-                                    limit, offset, "?obs ?e")
-            )
-
-            # add description of all matching obsels
-            self_state = self.state
-            obs = None
-            maxe = None
-            end = None
-            for obs, end in self.state.query(query_str):
-                if reverse and maxe is None:
-                    maxe = end.toPython()
-                get_obsel_bounded_description(obs, self_state, graph)
-            if maxe is None and end is not None:
-                maxe = end.toPython()
-
-            # canonical link
-            graph.links = links = [{
-                'uri': self.uri,
-                'rel': 'canonical',
-                'etag': iter(self.iter_etags()).next(),
-                'mstable-etag': self.get_str_mon_tag(),
-            }]
-            # link to next page
-            if limit and obs:
-                obs_id = obs.rsplit("/", 1)[1]
-                if reverse:
-                    qstr = "?reverse&limit=%s&before=%s" % (limit, obs_id)
-                else:
-                    qstr = "?limit=%s&after=%s" % (limit, obs_id)
-                if minb:
-                    qstr += "&minb=%s" % minb
-                if maxb:
-                    qstr += "&maxb=%s" % maxb
-                if mine:
-                    qstr += "&mine=%s" % mine
-                if maxe:
-                    qstr += "&maxe=%s" % maxe
-                graph.link = self.uri + qstr
-                links.append({'uri': self.uri + qstr, 'rel': 'next'})
-
-            # compute etags
-            graph.etags = list(self.iter_etags({'maxe': maxe, 'before': before}))
+    ######## ILocalCore (and mixins) implementation  ########
 
-            return graph
+    def precompute_etags(self, parameters=None):
+        """I override
+        :meth:`rdfrest.cores.mixins.BookkeepingMixin.precompute_etags`
 
+        I support the slicing parameters of `get_state`:meth:;
+        the matching obsels are looked up (in the temporal index)
+        in order to compute accurate etags, but no graph is built.
 
-    ######## ILocalCore (and mixins) implementation  ########
+        The keys of the matching obsels are kept,
+        so that `get_state`:meth: does not have to look them up again
+        (as long as the collection is not modified in between).
+        """
+        if not parameters:
+            return super(AbstractTraceObsels, self).precompute_etags(None)
+        if _REFRESH_VALUES.get(parameters.get("refresh"), 1) >= 2:
+            return None # forcing the refresh twice would be costly
+        # parameters are converted in place, but will be used again by get_state
+        self.force_state_refresh(dict(parameters))
+        parameters = dict(parameters)
+        self.check_parameters(parameters, parameters, "get_state")
+        if "refresh" in parameters and len(parameters) == 1:
+            return list(self.iter_etags(None))
+
+        before = parameters.get("before")
+        if before is not None:
+            before = coerce_to_uri(before)
+        keys = list(self._iter_slice_keys(parameters))
+        self._precomputed_slice = (frozenset(parameters.items()), self.etag,
+                                   keys)
+        maxe = None
+        for end, _, _ in keys:
+            if end > maxe:
+                maxe = end
+        return list(self.iter_etags({'maxe': maxe, 'before': before}))
 
     def check_parameters(self, to_check, parameters, method):
         """I implement :meth:`~rdfrest.cores.local.ILocalCore.check_parameters`
@@ -323,12 +487,42 @@ class AbstractTraceObsels(AbstractTraceObselsMixin, KtbsResource):
         change in :meth:`ack_edit`.
         """
         ret = super(AbstractTraceObsels, self).prepare_edit(parameters)
-        ret.last_obsel = obs = self.metadata.value(self.uri, METADATA.last_obsel)
-        if obs is not None:
-            ret.last_begin = int(self.state.value(obs, KTBS.hasBegin))
-            ret.last_end = int(self.state.value(obs, KTBS.hasEnd))
+        last_key = self.get_last_obsel_key()
+        if last_key is None:
+            ret.last_obsel = None
+        else:
+            ret.last_end, ret.last_begin, ret.last_obsel = last_key
         ret.str_mon = ret.pse_mon = ret.log_mon = (
             parameters and "add_obsels_only" in parameters)
+        # the earliest end touched by this edit, if known
+        # (see get_earliest_change)
+        ret.old_str_mon_tag = self.str_mon_tag
+        ret.earliest_change = None
+
+        # the temporal index is maintained by add-only edits,
+        # and must be rebuilt after any other edit;
+        # in both cases, it is invalid until the edit is acknowledged
+        indexes = self.service.temporal_indexes
+        if ret.log_mon:
+            index = indexes.get(self.uri)
+            if index is not None and index.etag != self.etag:
+                index = None
+        else:
+            indexes.pop(self.uri, None)
+            index = None
+        if index is not None:
+            index.etag = None
+        ret.temporal_index = index
+
+        # statistics are maintained by add-only edits,
+        # and will be recomputed on demand after any other edit
+        ret.statistics = None
+        if ret.log_mon:
+            stored = self.metadata.value(self.uri, METADATA.statistics)
+            if stored is not None:
+                statistics = json_loads(stored)
+                if statistics.pop("log_mon_tag") == self.log_mon_tag:
+                    ret.statistics = statistics
         return ret
 
     def ack_edit(self, parameters, prepared):
@@ -339,33 +533,45 @@ class AbstractTraceObsels(AbstractTraceObselsMixin, KtbsResource):
         # additional argument _query_cache #pylint: disable=W0221
         super(AbstractTraceObsels, self).ack_edit(parameters, prepared)
 
+        index = prepared.temporal_index
+        if index is not None:
+            index.etag = self.etag
+        elif not (parameters and "add_obsels_only" in parameters):
+            # rebuild the index right away, to find the new last obsel
+            index = TemporalIndex.build(self.state, self.trace_uri, self.etag)
+            self.service.temporal_indexes[self.uri] = index
+
         # find the last obsel and store it in metadata
+        metadata = self.metadata
+        uri = self.uri
         if parameters and "add_obsels_only" in parameters:
-            new_last_obsel = prepared.last_obsel
-        else:
-            init_bindings = {}
-            if prepared.last_obsel is not None:
-                last_end = self.state.value(prepared.last_obsel, KTBS.hasEnd)
-                # NB: last_end can still be None if last_obsel has been deleted
-                if last_end is not None:
-                    init_bindings['last_end'] = Literal(prepared.last_end)
-            results = list(self.state.query(FIND_LAST_OBSEL,
-                                            initBindings=init_bindings))
-            if results:
-                new_last_obsel = results[0][0]
+            if prepared.last_obsel is None:
+                last_key = None
             else:
-                new_last_obsel = None
-
-        if new_last_obsel is not None:
-            self.metadata.set((self.uri, METADATA.last_obsel, new_last_obsel))
+                last_key = (prepared.last_end, prepared.last_begin,
+                            prepared.last_obsel)
+        else:
+            last_key = index.get_last_key()
+        if last_key is not None:
+            last_end, last_begin, last_obsel = last_key
+            metadata.set((uri, METADATA.last_obsel, last_obsel))
+            metadata.set((uri, METADATA.last_begin, Literal(last_begin)))
+            metadata.set((uri, METADATA.last_end, Literal(last_end)))
         else:
-            self.metadata.remove((self.uri, METADATA.last_obsel, None))
+            metadata.remove((uri, METADATA.last_obsel, None))
+            metadata.remove((uri, METADATA.last_begin, None))
+            metadata.remove((uri, METADATA.last_end, None))
 
-        # force transformed traces to refresh
-        trace = self.trace
-        for ttr in trace.iter_transformed_traces():
-            obsels = ttr.obsel_collection
-            obsels.metadata.set((obsels.uri, METADATA.dirty, Literal("yes")))
+        if prepared.statistics is not None:
+            self._store_statistics(prepared.statistics)
+
+        if self.str_mon_tag != prepared.old_str_mon_tag:
+            self._log_change(prepared.old_str_mon_tag,
+                             prepared.earliest_change)
+
+        if self.service.staged_from is None:
+            # staged changes are propagated once written (see _Recomputation)
+            self._mark_dependents_dirty()
 
     def delete(self, parameters=None, _trust=False):
         """I override :meth:`.KtbsResource.delete`.
@@ -375,6 +581,7 @@ class AbstractTraceObsels(AbstractTraceObselsMixin, KtbsResource):
         """
         if _trust:
             # this should only be set of the owning trace
+            self.service.temporal_indexes.pop(self.uri, None)
             super(AbstractTraceObsels, self).delete(None, _trust)
         else:
             self.check_parameters(parameters, parameters, "delete")
@@ -400,9 +607,9 @@ class AbstractTraceObsels(AbstractTraceObselsMixin, KtbsResource):
         """
         yield self.etag
         if parameters is not None:
-            last_obsel = self.metadata.value(self.uri, METADATA.last_obsel)
-            if last_obsel is not None:
-                last_end = int(self.state.value(last_obsel, KTBS.hasEnd))
+            last_key = self.get_last_obsel_key()
+            if last_key is not None:
+                last_end, _, last_obsel = last_key
                 maxe = parameters.get("maxe")
                 before = parameters.get("before")
                 if before == last_obsel:
@@ -437,65 +644,370 @@ class AbstractTraceObsels(AbstractTraceObselsMixin, KtbsResource):
         if prepared is None  or  not prepared.log_mon:
             graph.set((uri, METADATA.log_mon_tag, Literal(token+"l")))
     
-    def _detect_mon_change(self, graph, prepared):
-        """Detect monotonicity changed induced by 'graph', and update `prepared` accordingly.
-        
+    def _get_mon_keys(self, graph):
+        """I extract from `graph` the values used by `_detect_mon_change`:meth:.
+
+        I return a pair (new_key, related), where `new_key` is the
+        (end, begin, uri) key of the obsel described by `graph`
+        (or None if it has no end), and `related` is a list of (end, uri)
+        pairs for the obsels of this trace related to the new obsel
+        (as the relation changes *both* obsels).
+
         Note that this is called after graph has been added to self.state,
         so all arcs from graph are also in state.
         """
         trace_uri = self.trace_uri
+        self_state_value = self.state.value
         new_obs = graph.value(None, KTBS.hasTrace, trace_uri)
-        if prepared.last_obsel is None:
-            prepared.last_obsel = new_obs
-            prepared.last_begin = int(graph.value(new_obs, KTBS.hasBegin))
-            prepared.last_end = int(graph.value(new_obs, KTBS.hasEnd))
-            return
-
-        old_last_obsel = prepared.last_obsel
-        old_last_begin = prepared.last_begin
-        old_last_end = prepared.last_end
-        pseudomon_range = self.trace.pseudomon_range
-        pse_mon_b_limit = old_last_begin - pseudomon_range
-        pse_mon_e_limit = old_last_end - pseudomon_range
+        end = self_state_value(new_obs, KTBS.hasEnd)
+        if end is None:
+            new_key = None
+        else:
+            begin = self_state_value(new_obs, KTBS.hasBegin)
+            new_key = (int(end), int(begin), new_obs)
 
-        str_mon = True
-        pse_mon = True
-        self_state_value = self.state.value
+        related = []
         # we used a SPARQL query before, but this seems to be more efficient...
-        # check all new obsels, but also their *related* obsels
-        # (as the relation changes *both* obsels)
-        for obs in chain( [new_obs],
-                          graph.objects(new_obs, None),
-                          graph.subjects(None, new_obs)):
+        for obs in chain(graph.objects(new_obs, None),
+                         graph.subjects(None, new_obs)):
             if not obs.startswith(trace_uri):
                 continue # not an obsel of this trace, skip it
             end = self_state_value(obs, KTBS.hasEnd)
             if end is None:
                 continue # not an obsel, skip it
-            end = int(end)
-            begin = None
-            if end < old_last_end:
-                str_mon = False
-                if end < pse_mon_e_limit:
-                    pse_mon = False
-            elif end == old_last_end:
-                begin = int(self_state_value(obs, KTBS.hasBegin))
-                if begin < old_last_begin:
+            related.append((int(end), obs))
+        return new_key, related
+
+    def _detect_mon_change(self, mon_keys, prepared):
+        """Detect monotonicity changes induced by new obsels, and update `prepared` accordingly.
+
+        :param mon_keys: a list of values returned by `_get_mon_keys`:meth:,
+          in the order in which the obsels were added
+
+        Each new obsel (and its related obsels) is compared to the last obsel
+        *before* it was added, so the last obsel is updated along the way.
+        """
+        str_mon = True
+        pse_mon = True
+        self_state_value = self.state.value
+        pseudomon_range = self.trace.pseudomon_range
+        if prepared.last_obsel is None:
+            last_key = None
+        else:
+            last_key = (prepared.last_end, prepared.last_begin,
+                        prepared.last_obsel)
+
+        earliest = prepared.earliest_change
+        for new_key, related in mon_keys:
+            if new_key is not None and \
+            (earliest is None or new_key[0] < earliest):
+                earliest = new_key[0]
+            for end, _ in related:
+                if earliest is None or end < earliest:
+                    earliest = end
+            if last_key is None:
+                last_key = new_key
+                continue
+            old_last_key = last_key
+            old_last_end, old_last_begin, _ = old_last_key
+            pse_mon_e_limit = old_last_end - pseudomon_range
+            pse_mon_b_limit = old_last_begin - pseudomon_range
+
+            if new_key is not None:
+                if new_key > old_last_key:
+                    last_key = new_key
+                else:
                     str_mon = False
-                    if begin < pse_mon_b_limit:
+                    end, begin, _ = new_key
+                    if end < pse_mon_e_limit  or  \
+                    end == old_last_end  and  begin < pse_mon_b_limit:
                         pse_mon = False
-                elif begin == old_last_begin:
-                    if obs <= old_last_obsel:
+
+            for end, obs in related:
+                if end > old_last_end:
+                    continue
+                elif end < old_last_end:
+                    str_mon = False
+                    if end < pse_mon_e_limit:
+                        pse_mon = False
+                else:
+                    begin = int(self_state_value(obs, KTBS.hasBegin))
+                    if (end, begin, obs) <= old_last_key:
                         str_mon = False
-            if obs is new_obs and str_mon:
-                prepared.last_obsel = new_obs
-                if begin is None:
-                    begin = int(graph.value(new_obs, KTBS.hasBegin))
-                prepared.last_begin = begin
-                prepared.last_end = end
+                        if begin < pse_mon_b_limit:
+                            pse_mon = False
 
+        if last_key is not None:
+            prepared.last_end, prepared.last_begin, prepared.last_obsel = \
+                last_key
         prepared.str_mon = prepared.str_mon and str_mon
         prepared.pse_mon = prepared.pse_mon and pse_mon
+        prepared.earliest_change = earliest
+
+    def _mark_dependents_dirty(self):
+        """I force trace statistics and (transitively) transformed traces
+        to refresh, after my obsels have changed.
+        """
+        trace = self.trace
+        stats = trace.trace_statistics
+        if stats:
+            # Traces created before @stats was introduced have no trace_statistics
+            stats.metadata.set((stats.uri, METADATA.dirty, Literal("yes")))
+        scheduler = _REFRESH_SCHEDULER
+        service = self.service
+        for obsels_uri in trace.iter_dependent_obsels_uris():
+            service.get_metadata_graph(obsels_uri).set(
+                (obsels_uri, METADATA.dirty, Literal("yes")))
+            if scheduler is not None:
+                scheduler.schedule(
+                    service.get(obsels_uri, [KTBS.ComputedTraceObsels]), True)
+
+    def _log_change(self, old_str_mon_tag, earliest):
+        """I record a change of the str_mon_tag in the change log.
+
+        :see-also: `get_earliest_change`:meth:
+        """
+        metadata = self.metadata
+        uri = self.uri
+        stored = metadata.value(uri, METADATA.change_log)
+        change_log = [] if stored is None else json_loads(stored)
+        change_log.append([old_str_mon_tag, earliest])
+        del change_log[:-CHANGE_LOG_SIZE]
+        metadata.set((uri, METADATA.change_log,
+                      Literal(json_dumps(change_log))))
+
+    def _compute_statistics(self):
+        """I compute the statistics returned by `get_statistics`:meth:
+        from scratch.
+        """
+        self_state_value = self.state.value
+        count = 0
+        types = {}
+        minb = maxe = None
+        for obs in self.state.subjects(KTBS.hasTrace, self.trace_uri):
+            count += 1
+            begin = self_state_value(obs, KTBS.hasBegin)
+            if begin is None:
+                continue
+            for typ in self.state.objects(obs, RDF.type):
+                typ = unicode(typ)
+                types[typ] = types.get(typ, 0) + 1
+            end = self_state_value(obs, KTBS.hasEnd)
+            if end is None:
+                continue
+            begin = int(begin)
+            end = int(end)
+            if minb is None or begin < minb:
+                minb = begin
+            if maxe is None or end > maxe:
+                maxe = end
+        return { "count": count, "types": types, "minb": minb, "maxe": maxe }
+
+    def _store_statistics(self, statistics):
+        """I store `statistics` in the metadata graph.
+
+        They are tagged with the current `log_mon_tag`.
+        """
+        stored = dict(statistics, log_mon_tag=self.log_mon_tag)
+        self.metadata.set((self.uri, METADATA.statistics,
+                           Literal(json_dumps(stored))))
+
+    def _update_statistics(self, graph, statistics):
+        """Update `statistics` with the new obsels described in `graph`.
+
+        Note that this is called *before* graph is added to self.state,
+        so that already existing obsels are not counted twice.
+        """
+        trace_uri = self.trace_uri
+        self_state = self.state
+        types = statistics["types"]
+        for obs in graph.subjects(KTBS.hasTrace, trace_uri):
+            if (obs, KTBS.hasTrace, trace_uri) in self_state:
+                continue
+            statistics["count"] += 1
+            begin = graph.value(obs, KTBS.hasBegin)
+            if begin is None:
+                continue
+            for typ in graph.objects(obs, RDF.type):
+                typ = unicode(typ)
+                types[typ] = types.get(typ, 0) + 1
+            end = graph.value(obs, KTBS.hasEnd)
+            if end is None:
+                continue
+            begin = int(begin)
+            end = int(end)
+            minb = statistics["minb"]
+            if minb is None or begin < minb:
+                statistics["minb"] = begin
+            maxe = statistics["maxe"]
+            if maxe is None or end > maxe:
+                statistics["maxe"] = end
+
+    def _update_temporal_index(self, graph, index):
+        """Add to `index` the obsels of this trace described in `graph`.
+
+        Note that this is called after graph has been added to self.state.
+        """
+        self_state_value = self.state.value
+        for obs in graph.subjects(KTBS.hasTrace, self.trace_uri):
+            begin = self_state_value(obs, KTBS.hasBegin)
+            end = self_state_value(obs, KTBS.hasEnd)
+            if begin is not None and end is not None:
+                index.add(obs, begin, end)
+
+    def _get_slice(self, parameters, source=None):
+        """I build the graph of the "slice" selected by `parameters`.
+
+        `parameters` must have been checked (and converted)
+        by `check_parameters`:meth:.
+
+        `source` is where obsels and etags are taken from;
+        it defaults to this collection, but can also be a
+        `_Snapshot`:class: of it.
+        """
+        keys = None
+        if source is None:
+            source = self
+            keys = self._pop_precomputed_slice(parameters)
+        if keys is None:
+            keys = self._iter_slice_keys(parameters, source)
+        graph = Graph(identifier=self.uri)
+        graph_add = graph.add
+
+        # fill graph with data about the obsel collection
+        for triple in source.state.triples((self.uri, None, None)):
+            graph_add(triple)
+        for triple in source.state.triples((None, None, self.uri)):
+            graph_add(triple)
+
+        minb = parameters.get("minb")
+        maxb = parameters.get("maxb")
+        mine = parameters.get("mine")
+        before = parameters.get("before")
+        if before is not None:
+            before = coerce_to_uri(before)
+        reverse = _is_reverse(parameters)
+        limit = parameters.get("limit")
+
+        # add description of all matching obsels
+        source_state = source.state
+        obs = None
+        maxe = None
+        end = None
+        selected = []
+        for end, _, obs in keys:
+            if reverse and maxe is None:
+                maxe = end
+            selected.append(obs)
+        get_obsels_bounded_descriptions(selected, source_state, graph)
+        if maxe is None and end is not None:
+            maxe = end
+
+        # canonical link
+        graph.links = links = [{
+            'uri': self.uri,
+            'rel': 'canonical',
+            'etag': iter(source.iter_etags()).next(),
+            'mstable-etag': source.get_str_mon_tag(),
+        }]
+        # link to next page
+        if limit and obs:
+            obs_id = obs.rsplit("/", 1)[1]
+            if reverse:
+                qstr = "?reverse&limit=%s&before=%s" % (limit, obs_id)
+            else:
+                qstr = "?limit=%s&after=%s" % (limit, obs_id)
+            if minb:
+                qstr += "&minb=%s" % minb
+            if maxb:
+                qstr += "&maxb=%s" % maxb
+            if mine:
+                qstr += "&mine=%s" % mine
+            if maxe:
+                qstr += "&maxe=%s" % maxe
+            graph.link = self.uri + qstr
+            links.append({'uri': self.uri + qstr, 'rel': 'next'})
+
+        # compute etags
+        graph.etags = list(source.iter_etags({'maxe': maxe, 'before': before}))
+
+        return graph
+
+    def _pop_precomputed_slice(self, parameters):
+        """I return the keys kept by `precompute_etags`:meth:, or None.
+
+        None is returned if they were computed for other `parameters`,
+        or if the collection has been modified since.
+        """
+        precomputed = self._precomputed_slice
+        if precomputed is None:
+            return None
+        self._precomputed_slice = None
+        frozen_params, etag, keys = precomputed
+        if frozen_params != frozenset(parameters.items()) \
+        or etag != self.etag:
+            return None
+        return keys
+
+    def _iter_slice_keys(self, parameters, source=None):
+        """I iter over the keys of the obsels selected by `parameters`.
+
+        `parameters` must have been checked (and converted)
+        by `check_parameters`:meth:.
+
+        `source` defaults to this collection (see `_get_slice`:meth:).
+        """
+        if source is None:
+            source = self
+        after = parameters.get("after")
+        if after is not None:
+            after = coerce_to_uri(after)
+        before = parameters.get("before")
+        if before is not None:
+            before = coerce_to_uri(before)
+        return source.iter_obsel_keys(parameters.get("minb"),
+                                      parameters.get("maxe"),
+                                      after, before,
+                                      _is_reverse(parameters),
+                                      parameters.get("limit"),
+                                      parameters.get("offset"),
+                                      parameters.get("maxb"),
+                                      parameters.get("mine"))
+
+    def _get_index_key(self, index, obsel, argname):
+        """I convert `obsel` (an URIRef or an obsel) to a key of `index`.
+
+        I return None if `obsel` is an URIRef that is not in `index`.
+        """
+        if isinstance(obsel, URIRef):
+            return index.get_key(obsel)
+        elif isinstance(obsel, ObselMixin):
+            return (obsel.end, obsel.begin, obsel.uri)
+        else:
+            raise ValueError("Invalid value for `%s` (%r)" % (argname, obsel))
+
+    def _iter_obsel_keys_sparql(self, begin, end, after, before, reverse,
+                                limit, offset, maxb, mine):
+        """I implement `iter_obsel_keys`:meth: with a SPARQL query.
+
+        This is used when the temporal index can not be trusted.
+        """
+        query_filter = []
+        if maxb is not None:
+            query_filter.append("?b <= %s" % maxb)
+        if mine is not None:
+            query_filter.append("?e >= %s" % mine)
+        if query_filter:
+            query_filter = "FILTER((%s))" % (") && (".join(query_filter))
+        else:
+            query_filter = ""
+        query_str = (
+            "PREFIX ktbs: <http://liris.cnrs.fr/silex/2009/ktbs#> %s"
+            % self.build_select(begin, end, after, before, reverse,
+                                query_filter, limit, offset, "?obs ?b ?e")
+        )
+        for obs, begin, end in self.state.query(query_str):
+            yield (end.toPython(), begin.toPython(), obs)
 
 
 
@@ -515,61 +1027,77 @@ class ComputedTraceObsels(AbstractTraceObsels):
 
     ######## ICore implementation  ########
 
-    __forcing_state_refresh = False
-
     def get_state(self, parameters=None):
         """I override `~rdfrest.cores.ICore.get_state`:meth:
 
         I support parameter 'refresh' to bypass the updating of the obsels,
         or force a recomputation of the trace.
+
+        If obsels are recomputed in the background
+        (see `set_refresh_scheduler`:func:) and need to be recomputed,
+        I return a snapshot of their current state instead,
+        with an attribute ``stale`` set to True.
         """
+        if self._refreshes_in_background(parameters):
+            return self._get_stale_state(parameters)
         self.force_state_refresh(parameters)
         return super(ComputedTraceObsels, self).get_state(parameters)
 
     def force_state_refresh(self, parameters=None):
         """I override `~rdfrest.cores.ICore.force_state_refresh`:meth:
 
-        I recompute the obsels if needed.
+        I recompute the obsels if needed
+        (or only schedule their recomputation,
+        if they are recomputed in the background).
+        Obsels of a staging service are never refreshed,
+        as they are being recomputed (see `_Recomputation`:class:).
         """
         refresh_param = (_REFRESH_VALUES[parameters.get("refresh")]
                          if parameters else 1)
-        if refresh_param == 0 or self.__forcing_state_refresh:
+        forcing = _get_forcing_state_refresh()
+        if refresh_param == 0 or self.uri in forcing \
+        or self.service.staged_from is not None:
+            return
+        if self._refreshes_in_background(parameters):
             return
-        self.__forcing_state_refresh = True
+        forcing.add(self.uri)
         try:
-            LOG.debug("forcing state refresh <%s>", self.uri)
             super(ComputedTraceObsels, self).force_state_refresh(parameters)
-            trace = self.trace
-            if refresh_param == 2:
-                parameters['refresh'] = 'default' # do not transmit 'force' to sources
-            for src in trace.iter_source_traces():
-                src.obsel_collection.force_state_refresh(parameters)
-            if (refresh_param >= 2 or
-                self.metadata.value(self.uri, METADATA.dirty, None) is not None):
-
-                with self.service: # start transaction if not already started
-                    LOG.info("recomputing <%s>", self.uri)
-                    # we *first* unset the dirty bit, so that recursive calls to
-                    # get_state do not result in an infinite recursion
-                    self.metadata.remove((self.uri, METADATA.dirty, None))
-                    trace.force_state_refresh()
-                    impl = trace._method_impl # friend #pylint: disable=W0212
-                    try:
-                        diag = impl.compute_obsels(trace, refresh_param >= 2)
-                    except BaseException, ex:
-                        LOG.warn(traceback.format_exc())
-                        diag = Diagnosis(
-                            "exception raised while computing obsels",
-                            [ex.message],
-                            sys.exc_traceback,
-                        )
-                    if not diag:
-                        self.metadata.set((self.uri, METADATA.dirty,
-                                              Literal("yes")))
-                        
-                        raise CanNotProceedError, unicode(diag), diag.traceback
+            # the dirty bit must be read *before* checking the flight:
+            # it is removed once the flight is taken,
+            # so the other order could miss an ongoing recomputation
+            if refresh_param == 1 and \
+            self.metadata.value(self.uri, METADATA.dirty, None) is None \
+            and not in_flight(self.uri):
+                # any change is propagated to all dependent traces
+                # (see ack_edit), so the traces I depend on are clean as well
+                return
+            LOG.debug("forcing state refresh <%s>", self.uri)
+            ancestors = list(self._iter_computed_ancestors())
         finally:
-            del self.__forcing_state_refresh
+            forcing.discard(self.uri)
+        # refresh the computed traces I depend on in topological order,
+        # so that each of them is visited (and recomputed) at most once,
+        # even if several of my sources depend on it
+        ancestor_refresh = 2 if refresh_param == 3 else 1
+        if len(ancestors) > 1 and RECOMPUTE_THREADS > 1:
+            _recompute_concurrently(ancestors, ancestor_refresh)
+        else:
+            for obsels in ancestors:
+                obsels._recompute_if_needed(ancestor_refresh) # friend #pylint: disable=W0212
+        self._recompute_if_needed(refresh_param)
+
+    ######## ILocalCore (and mixins) implementation  ########
+
+    def precompute_etags(self, parameters=None):
+        """I override `AbstractTraceObsels.precompute_etags`:meth:
+
+        Stale states must not be served from a cache,
+        so I return None if my obsels need to be recomputed in the background.
+        """
+        if self._refreshes_in_background(parameters):
+            return None
+        return super(ComputedTraceObsels, self).precompute_etags(parameters)
 
 
     def edit(self, parameters=None, clear=False, _trust=False):
@@ -589,12 +1117,160 @@ class ComputedTraceObsels(AbstractTraceObsels):
         """
         if _trust:
             # this should only be set of the owning trace
+            uri = self.uri
+            self.service.temporal_indexes.pop(uri, None)
             super(AbstractTraceObsels, self).delete(None, _trust)
+            forget_flight(uri)
         else:
             raise MethodNotAllowedError("Can not empty a computed trace.")
 
     ######## Protected methods ########
 
+    def _refreshes_in_background(self, parameters):
+        """I return True if my obsels are stale,
+        because they are to be recomputed in the background.
+
+        In that case, I also ensure that their recomputation is scheduled.
+        NB: explicitly forcing the refresh always recomputes the obsels
+        synchronously.
+        """
+        scheduler = _REFRESH_SCHEDULER
+        if scheduler is None or scheduler.in_worker() \
+        or self.service.staged_from is not None:
+            return False
+        if parameters and _REFRESH_VALUES[parameters.get("refresh")] != 1:
+            return False
+        return self._schedule_refresh(scheduler)
+
+    def _schedule_refresh(self, scheduler):
+        """I schedule the recomputation of my obsels if they are dirty.
+
+        I return True if my obsels are stale.
+
+        NB: any change is propagated to all dependent traces (see ack_edit),
+        so my obsels are dirty whenever those of my sources are.
+        """
+        if self.metadata.value(self.uri, METADATA.dirty, None) is None:
+            return scheduler.is_pending(self.uri)
+        scheduler.schedule(self, False)
+        return True
+
+    def _iter_computed_ancestors(self):
+        """I iter over the obsel collections of the computed traces
+        that my trace (transitively) depends on.
+
+        They are yielded in topological order,
+        i.e. every collection comes after those of its own sources.
+        """
+        visited = set([self.uri])
+        stack = [(self, self.trace.iter_source_traces())]
+        while stack:
+            obsels, sources = stack[-1]
+            for src in sources:
+                src_obsels = src.obsel_collection
+                if src_obsels.uri not in visited \
+                and isinstance(src_obsels, ComputedTraceObsels):
+                    visited.add(src_obsels.uri)
+                    stack.append((src_obsels, src.iter_source_traces()))
+                    break
+            else:
+                stack.pop()
+                if obsels is not self:
+                    yield obsels
+
+    def _recompute_if_needed(self, refresh_param):
+        """I recompute my obsels if they are dirty, or if `refresh_param`
+        (a value of `_REFRESH_VALUES`) forces it.
+
+        NB: I assume that the obsels of my sources are up to date.
+        """
+        with self._flight_if_needed(refresh_param) as needed:
+            if needed:
+                self._recompute(refresh_param)
+
+    @contextmanager
+    def _flight_if_needed(self, refresh_param):
+        """I yield whether my obsels must be recomputed
+        (see `_recompute_if_needed`:meth:).
+
+        Concurrent recomputations (by other threads or processes)
+        are coordinated with `.lock.single_flight`:func:,
+        so that only the first one actually recomputes the obsels,
+        while the others wait for it.
+        If I yield True, the flight is held until I exit.
+        """
+        uri = self.uri
+        forcing = _get_forcing_state_refresh()
+        if uri in forcing or (refresh_param < 2 and
+            self.metadata.value(uri, METADATA.dirty, None) is None and
+            not in_flight(uri)):
+            yield False
+            return
+        with single_flight(uri):
+            if (refresh_param < 2 and
+                self.metadata.value(uri, METADATA.dirty, None) is None):
+                LOG.debug("<%s> was recomputed by a concurrent flight", uri)
+                yield False
+                return
+            forcing.add(uri)
+            try:
+                yield True
+            finally:
+                forcing.discard(uri)
+
+    def _recompute(self, refresh_param):
+        """I recompute my obsels.
+
+        The obsels are computed by a `_Recomputation`:class:,
+        so that the store is only modified (and the base only locked)
+        once they are computed.
+        If my trace is modified in the meantime, the computation is retried,
+        the last attempt keeping the base locked all along.
+
+        I must only be invoked inside `_flight_if_needed`:meth:.
+        """
+        try:
+            for _ in xrange(RECOMPUTE_ATTEMPTS - 1):
+                recomputation = _Recomputation(self, refresh_param)
+                recomputation.run()
+                if recomputation.commit():
+                    return
+                LOG.info("<%s> was modified while being recomputed; "
+                         "retrying", self.uri)
+            trace = self.trace
+            with trace.get_base().lock(trace):
+                recomputation = _Recomputation(self, refresh_param)
+                recomputation.run()
+                committed = recomputation.commit()
+                assert committed
+        finally:
+            with _SNAPSHOTS_LOCK:
+                _SNAPSHOTS.pop(self.uri, None)
+
+    def _get_snapshot(self):
+        """I return the `_Snapshot`:class: of my obsels,
+        taking it if it does not exist yet.
+        """
+        with _SNAPSHOTS_LOCK:
+            snapshot = _SNAPSHOTS.get(self.uri)
+            if snapshot is None:
+                snapshot = _SNAPSHOTS[self.uri] = _Snapshot(self)
+            return snapshot
+
+    def _get_stale_state(self, parameters):
+        """I implement `get_state`:meth: when my obsels are stale.
+        """
+        snapshot = self._get_snapshot()
+        if (not parameters
+            or "refresh" in parameters and len(parameters) == 1):
+            graph = ReadOnlyGraph(snapshot.state)
+            graph.etags = list(snapshot.iter_etags())
+        else:
+            self.check_parameters(parameters, parameters, "get_state")
+            graph = self._get_slice(parameters, snapshot)
+        graph.stale = True
+        return graph
+
     def _empty(self):
         """I remove all obsels from this trace.
 
@@ -606,14 +1282,312 @@ class ComputedTraceObsels(AbstractTraceObsels):
             editable.remove((None, None, None))
             self.init_graph(editable, self.uri, trace_uri)
 
-FIND_LAST_OBSEL = prepareQuery("""
-    PREFIX : <http://liris.cnrs.fr/silex/2009/ktbs#>
-    SELECT ?o {
-        ?o :hasEnd ?e .
-        FILTER ( !BOUND(?last_end) || (?e >= ?last_end) )
-    }
-    ORDER BY DESC(?e) LIMIT 1
-""")
+class _Recomputation(object):
+    """I recompute the obsels of a computed trace in a staging service.
+
+    The computation (`run`:meth:) neither modifies the store
+    nor holds any lock; it can run in any thread.
+    Its result is then written (`commit`:meth:) in a short edit,
+    protected by the lock of the base.
+    Meanwhile, readers are served a snapshot of the obsels
+    (if they are recomputed in the background),
+    which the caller must discard once done.
+
+    NB: the obsels of the sources are assumed to be up to date.
+    """
+
+    def __init__(self, obsels, refresh_param):
+        self.obsels = obsels
+        self.from_scratch = refresh_param >= 2
+        self.diag = None
+        uri = obsels.uri
+        trace = obsels.trace
+        LOG.info("recomputing <%s>", uri)
+        with trace.get_base().lock(trace), obsels.service:
+            # we *first* unset the dirty bit, so that any change in the
+            # sources during the computation sets it again
+            obsels.metadata.remove((uri, METADATA.dirty, None))
+        trace.force_state_refresh()
+        if _REFRESH_SCHEDULER is not None:
+            # serve this snapshot to readers until we are done
+            obsels._get_snapshot() # friend #pylint: disable=W0212
+        self.etags = self._get_etags()
+        self.staging = staging = obsels.service.make_staging()
+        index = staging.temporal_indexes.get(uri)
+        if index is not None:
+            staging.temporal_indexes[uri] = index.copy()
+
+    def run(self):
+        """I compute the obsels in the staging service,
+        and return the diagnosis of the computation.
+        """
+        try:
+            staged_trace = self.staging.get(self.obsels.trace.uri)
+            impl = staged_trace._method_impl # friend #pylint: disable=W0212
+            self.diag = impl.compute_obsels(staged_trace, self.from_scratch)
+        except BaseException, ex:
+            LOG.warn(traceback.format_exc())
+            self.diag = Diagnosis(
+                "exception raised while computing obsels",
+                [ex.message],
+                sys.exc_info()[2], # thread-safe, unlike sys.exc_traceback
+            )
+        return self.diag
+
+    def commit(self):
+        """I write the computed obsels into the store, and return True.
+
+        If the trace or its obsels have been modified during the computation,
+        the computed obsels are discarded, and I return False.
+        If the computation failed, the obsels are marked as dirty again,
+        and I raise a `CanNotProceedError`.
+        """
+        obsels = self.obsels
+        uri = obsels.uri
+        trace = obsels.trace
+        service = obsels.service
+        diag = self.diag
+        with trace.get_base().lock(trace), service:
+            if not diag:
+                obsels.metadata.set((uri, METADATA.dirty, Literal("yes")))
+            elif self._get_etags() != self.etags:
+                return False
+            else:
+                with _SNAPSHOTS_LOCK:
+                    self.staging.store.apply()
+                    _SNAPSHOTS.pop(uri, None)
+                index = self.staging.temporal_indexes.get(uri)
+                if index is None:
+                    service.temporal_indexes.pop(uri, None)
+                else:
+                    service.temporal_indexes[uri] = index
+                if obsels.metadata.value(uri, RDFREST.etag) != self.etags[1]:
+                    obsels._mark_dependents_dirty() # friend #pylint: disable=W0212
+        if not diag:
+            raise CanNotProceedError, unicode(diag), diag.traceback
+        return True
+
+    def _get_etags(self):
+        """I return the current etags of the trace and of its obsels.
+        """
+        obsels = self.obsels
+        trace = obsels.trace
+        return (trace.metadata.value(trace.uri, RDFREST.etag),
+                obsels.metadata.value(obsels.uri, RDFREST.etag))
+
+
+class _Snapshot(object):
+    """I am a static copy of an obsel collection.
+
+    I provide the few attributes and methods required by
+    `AbstractTraceObsels._get_slice`:meth:.
+    """
+
+    def __init__(self, obsels):
+        self.uri = obsels.uri
+        self.state = state = Graph(identifier=obsels.uri)
+        state += obsels.state
+        self.etag = obsels.etag
+        self.str_mon_tag = obsels.str_mon_tag
+        self._index = TemporalIndex.build(state, obsels.trace_uri, self.etag)
+
+    def get_str_mon_tag(self):
+        """I return the strict monotonicity tag of the copied collection.
+        """
+        return self.str_mon_tag
+
+    def iter_etags(self, parameters=None):
+        """I only yield the etag of the copied collection;
+        monotonicity tags are not worth computing for a stale state.
+        """
+        # unused argument 'parameters' #pylint: disable=W0613
+        yield self.etag
+
+    def iter_obsel_keys(self, begin=None, end=None, after=None, before=None,
+                        reverse=False, limit=None, offset=None,
+                        maxb=None, mine=None):
+        """I implement `AbstractTraceObsels.iter_obsel_keys`:meth:
+        """
+        index = self._index
+        after_key = before_key = None
+        if after is not None:
+            after_key = index.get_key(after)
+            if after_key is None:
+                return iter(())
+        if before is not None:
+            before_key = index.get_key(before)
+            if before_key is None:
+                return iter(())
+        return index.iter_keys(begin, end, after_key, before_key, reverse,
+                               limit, offset, maxb, mine)
+
+
+_THREAD_LOCAL = local()
+
+def _get_forcing_state_refresh():
+    """I return the set of the URIs of the obsel collections
+    whose state is being refreshed by the current thread.
+
+    This is used to prevent infinite recursions,
+    as recomputing obsels usually involves reading them.
+    """
+    try:
+        return _THREAD_LOCAL.forcing_state_refresh
+    except AttributeError:
+        ret = _THREAD_LOCAL.forcing_state_refresh = set()
+        return ret
+
+
+def _recompute_concurrently(collections, refresh_param):
+    """I recompute (if needed) the obsel collections of computed traces
+    given in topological order (see `ComputedTraceObsels._recompute_if_needed`).
+
+    A collection is computed as soon as the collections of its sources are up
+    to date, so independent branches are computed concurrently, by a pool of
+    `RECOMPUTE_THREADS` threads. Each of them computes in its own staging
+    service (see `_Recomputation`:class:), while the current thread holds the
+    flights and commits the results, as they come and after those of the
+    sources (hence in topological order).
+
+    If a collection can not be recomputed, its dependents are skipped,
+    and the first error is raised once the other branches are done.
+    """
+    uris = set( obsels.uri for obsels in collections )
+    # getting the trace of a collection reads its state,
+    # which must not refresh it here
+    forcing = _get_forcing_state_refresh()
+    refreshed = uris - forcing
+    forcing.update(refreshed)
+    try:
+        sources = dict(
+            (obsels.uri,
+             set( src.obsel_collection.uri
+                  for src in obsels.trace.iter_source_traces() ) & uris)
+            for obsels in collections )
+    finally:
+        forcing.difference_update(refreshed)
+    pending = list(collections)
+    committed = set()
+    failed = set()
+    running = {} # uri -> (obsels, flight context) of running recomputations
+    finished = Queue()
+    pool = None
+    error = None
+    try:
+        while pending or running:
+            for obsels in list(pending):
+                srcs = sources[obsels.uri]
+                if srcs & failed:
+                    pending.remove(obsels)
+                    failed.add(obsels.uri)
+                elif srcs <= committed:
+                    pending.remove(obsels)
+                    try:
+                        flight = obsels._flight_if_needed(refresh_param) # friend #pylint: disable=W0212
+                        if not flight.__enter__():
+                            flight.__exit__(None, None, None)
+                            committed.add(obsels.uri)
+                            continue
+                    except Exception: # catch all #pylint: disable=W0703
+                        error = error or sys.exc_info()
+                        failed.add(obsels.uri)
+                        continue
+                    try:
+                        recomputation = _Recomputation(obsels, refresh_param)
+                    except Exception: # catch all #pylint: disable=W0703
+                        exc_info = sys.exc_info()
+                        error = error or exc_info
+                        failed.add(obsels.uri)
+                        _end_flight(obsels, flight, exc_info)
+                        continue
+                    running[obsels.uri] = (obsels, flight)
+                    if pool is None:
+                        pool = ThreadPool(min(RECOMPUTE_THREADS,
+                                              len(collections)))
+                    pool.apply_async(_run_recomputation,
+                                     (recomputation, finished))
+            if not running:
+                continue
+            recomputation = finished.get()
+            obsels, flight = running.pop(recomputation.obsels.uri)
+            try:
+                if not recomputation.commit():
+                    LOG.info("<%s> was modified while being recomputed; "
+                             "retrying", obsels.uri)
+                    obsels._recompute(refresh_param) # friend #pylint: disable=W0212
+            except Exception: # catch all #pylint: disable=W0703
+                exc_info = sys.exc_info()
+                error = error or exc_info
+                failed.add(obsels.uri)
+                _end_flight(obsels, flight, exc_info)
+            else:
+                committed.add(obsels.uri)
+                _end_flight(obsels, flight, None)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        exc_info = sys.exc_info()
+        for obsels, flight in running.values():
+            _end_flight(obsels, flight, exc_info)
+    if error is not None:
+        raise error[0], error[1], error[2]
+
+def _run_recomputation(recomputation, finished):
+    """I run `recomputation` in a thread of `_recompute_concurrently`,
+    then put it in the `finished` queue.
+    """
+    try:
+        recomputation.run()
+    finally:
+        finished.put(recomputation)
+
+def _end_flight(obsels, flight, exc_info):
+    """I exit `flight`, entered by `_recompute_concurrently` for `obsels`.
+    """
+    with _SNAPSHOTS_LOCK:
+        _SNAPSHOTS.pop(obsels.uri, None)
+    flight.__exit__(*(exc_info or (None, None, None)))
+
+
+_REFRESH_SCHEDULER = None
+_SNAPSHOTS = {}
+_SNAPSHOTS_LOCK = RLock()
+
+def set_refresh_scheduler(scheduler):
+    """I set the scheduler in charge of recomputing computed traces
+    in the background.
+
+    By default (or if `scheduler` is None), computed traces are recomputed
+    synchronously, when their obsels are requested after a change in their
+    sources. When a scheduler is set, such a request only ensures that the
+    recomputation is scheduled, and gets a snapshot of the current obsels,
+    flagged as stale (stale-while-revalidate). The snapshot is kept until the
+    recomputation is done, so that readers are isolated from it.
+
+    `scheduler` must provide the following methods:
+
+    * ``schedule(obsels, postpone)``: schedule the recomputation of `obsels`
+      (a `ComputedTraceObsels`:class:); if it is already scheduled,
+      it is only postponed if `postpone` is true
+      (this is the case when a source of `obsels` has just changed);
+    * ``is_pending(uri)``: return whether the recomputation of the obsel
+      collection identified by `uri` is scheduled or running;
+    * ``in_worker()``: return whether the current thread is the one
+      recomputing traces (where recomputation must happen synchronously).
+
+    See `ktbs.plugins.background_refresh`:mod: for an implementation.
+    """
+    global _REFRESH_SCHEDULER # using global statement #pylint: disable=W0603
+    with _SNAPSHOTS_LOCK:
+        _REFRESH_SCHEDULER = scheduler
+        _SNAPSHOTS.clear()
+
+def _is_reverse(parameters):
+    """I return whether `parameters` require obsels in reverse order.
+    """
+    return (parameters.get("reverse", "no").lower()
+            not in ("false", "no", "0"))
 
 _REFRESH_VALUES = {
     "no": 0,
@@ -114,6 +114,25 @@ class AbstractMonosourceMethod(IMethod):
         """
         raise NotImplemented
 
+    # the following methods may be overridden by subclasses
+
+    def do_recompute_obsels_from(self, computed_trace, cstate, earliest, diag):
+        """Recompute the obsels of the computed trace from timestamp `earliest`.
+
+        This is called instead of `do_compute_obsels`:meth: when the source
+        has changed in a non strictly monotonic way, but the source obsels
+        ending before `earliest` are known to be unchanged (see
+        `~.engine.trace_obsels.AbstractTraceObsels.get_earliest_change`:meth:).
+        This gives the opportunity to remove and recompute only the
+        corresponding part of the computed trace.
+
+        I must return True if I have recomputed the obsels; the default
+        implementation returns False, in which case `do_compute_obsels`:meth:
+        is called as usual.
+        """
+        # unused arguments #pylint: disable=W0613
+        return False
+
 
     # the following methods should not be changed by subclasses,
     # the constitute the common implementation of IMethod by all subclasses
@@ -181,7 +200,13 @@ class AbstractMonosourceMethod(IMethod):
         else:
             monotonicity = NOT_MON
 
-        self.do_compute_obsels(computed_trace, cstate['custom'], monotonicity, diag)
+        earliest = None
+        if monotonicity is not STRICT_MON  and  cstate["str_mon_tag"]:
+            earliest = source_obsels.get_earliest_change(cstate["str_mon_tag"])
+        if earliest is None  or  not self.do_recompute_obsels_from(
+                computed_trace, cstate['custom'], earliest, diag):
+            self.do_compute_obsels(computed_trace, cstate['custom'],
+                                   monotonicity, diag)
 
         cstate["log_mon_tag"] = source_obsels.log_mon_tag
         cstate["pse_mon_tag"] = source_obsels.pse_mon_tag
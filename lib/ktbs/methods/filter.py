@@ -23,8 +23,10 @@ import logging
 from rdflib import Literal, RDF, URIRef, Graph
 from rdfrest.util.iso8601 import parse_date
 from rdfrest.util import check_new
-from .abstract import AbstractMonosourceMethod, NOT_MON, PSEUDO_MON, STRICT_MON
-from .utils import copy_obsel, translate_node
+from .abstract import AbstractMonosourceMethod, LOGIC_MON, NOT_MON, \
+    PSEUDO_MON, STRICT_MON
+from .utils import boolean_parameter, copy_obsel, get_last_obsel_key, \
+    translate_node
 from ..engine.builtin_method import register_builtin_method_impl
 from ..namespace import KTBS
 from ..time import get_converter_to_unit, lit2datetime #pylint: disable=E0611
@@ -48,6 +50,7 @@ class _FilterMethod(AbstractMonosourceMethod):
         "bgp": unicode,
         "otypes":
             lambda txt: txt and [ URIRef(i) for i in txt.split(" ") ] or None,
+        "subtypes": boolean_parameter,
     }
 
     def init_state(self, computed_trace, params, cstate, diag):
@@ -58,6 +61,7 @@ class _FilterMethod(AbstractMonosourceMethod):
             ("mintime", None),
             ("otypes", None),
             ("bgp", None),
+            ("subtypes", False),
             ("passed_maxtime", False),
             ("last_seen_u", None),
             ("last_seen_b", None),
@@ -95,11 +99,17 @@ class _FilterMethod(AbstractMonosourceMethod):
         cstate["mintime"] = mintime
         cstate["otypes"] = params.get("otypes")
         cstate["bgp"] = params.get("bgp")
+        cstate["subtypes"] = params.get("subtypes", False)
 
 
-    def do_compute_obsels(self, computed_trace, cstate, monotonicity, diag):
+    def do_compute_obsels(self, computed_trace, cstate, monotonicity, diag,
+                          mine=None):
         """I implement :meth:`.abstract.AbstractMonosourceMethod.do_compute_obsels
+
+        If `mine` is provided, only the source obsels ending at or after `mine`
+        are considered.
         """
+        # additional argument mine #pylint: disable=W0221
         if cstate['passed_maxtime']  and  monotonicity is STRICT_MON:
             return
 
@@ -111,6 +121,10 @@ class _FilterMethod(AbstractMonosourceMethod):
         otypes = cstate["otypes"]
         if otypes:
             otypes = set( URIRef(i) for i in otypes )
+            if cstate.get("subtypes"):
+                model = source.model
+                if model is not None:
+                    otypes = model.expand_obsel_types(otypes)
         bgp = cstate["bgp"]
         passed_maxtime = cstate["passed_maxtime"]
         try:
@@ -143,41 +157,57 @@ class _FilterMethod(AbstractMonosourceMethod):
         else:
             LOG.debug("non-temporally monotonic %s", computed_trace)
 
-        if otypes:
-            filter_otypes = ', '.join( otype.n3() for otype in otypes )
-            bgp = (bgp or '') + '''?obs a ?_filter_otype_.
-            FILTER(?_filter_otype_ in (%s))''' % filter_otypes
-
         source_uri = source.uri
         target_uri = computed_trace.uri
         source_state = source_obsels.state
         target_contains = target_obsels.state.__contains__
-        target_add_graph = target_obsels.add_obsel_graph
         check_new_obs = lambda uri, g=target_obsels.state: check_new(g, uri)
-        source_obsels = source.iter_obsels(after=after, begin=begin,
-                                           end=maxtime, bgp=bgp, refresh="no")
 
-        with target_obsels.edit({"add_obsels_only":1}, _trust=True):
-            for obs in source_obsels:
-                new_obs_uri = translate_node(obs.uri, computed_trace,
+        if bgp is None:
+            # native path: scan the temporal index of the source,
+            # and check the obsel types directly
+            keys = source_obsels.iter_obsel_keys(begin=begin, end=maxtime,
+                                                 after=after, mine=mine)
+            if otypes:
+                source_objects = source_state.objects
+                keys = ( key for key in keys
+                         if not otypes.isdisjoint(source_objects(key[2],
+                                                                 RDF.type)) )
+            source_uris = ( key[2] for key in keys )
+        else:
+            if otypes:
+                filter_otypes = ', '.join( otype.n3() for otype in otypes )
+                bgp += '''?obs a ?_filter_otype_.
+                FILTER(?_filter_otype_ in (%s))''' % filter_otypes
+            source_uris = ( obs.uri for obs in
+                            source.iter_obsels(after=after, begin=begin,
+                                               end=maxtime, bgp=bgp,
+                                               refresh="no") )
+
+        def iter_new_obs_graphs():
+            "yield the graphs of the obsels to add to the computed trace"
+            for obs_uri in source_uris:
+                new_obs_uri = translate_node(obs_uri, computed_trace,
                                              source_uri, False)
                 if monotonicity is not STRICT_MON\
                 and target_contains((new_obs_uri, KTBS.hasTrace, target_uri)):
                     LOG.debug("--- already seen %s", new_obs_uri)
                     continue # already added
 
-                LOG.debug("--- keeping %s", obs)
-                new_obs_graph = copy_obsel(obs, computed_trace, source,
-                                           new_obs_uri=new_obs_uri,
-                                           check_new_obs=check_new_obs,
+                LOG.debug("--- keeping %s", obs_uri)
+                yield copy_obsel(obs_uri, computed_trace, source,
+                                 new_obs_uri=new_obs_uri,
+                                 check_new_obs=check_new_obs,
                 )
-                target_add_graph(new_obs_graph)
 
-        for obs in source.iter_obsels(begin=begin, reverse=True, limit=1):
-            # iter only once on the last obsel, if any
-            last_seen_u = obs.uri
-            last_seen_b = obs.begin
-            passed_maxtime = (maxtime is not None  and  obs.end > maxtime)
+        # NB: add_obsel_graphs adds each graph before pulling the next one,
+        # so copy_obsel can still see the previously copied obsels
+        target_obsels.add_obsel_graphs(iter_new_obs_graphs())
+
+        last_key = get_last_obsel_key(source, begin)
+        if last_key is not None:
+            last_seen_e, last_seen_b, last_seen_u = last_key
+            passed_maxtime = (maxtime is not None  and  last_seen_e > maxtime)
 
         cstate["passed_maxtime"] = passed_maxtime
         if last_seen_u is not None:
@@ -185,4 +215,20 @@ class _FilterMethod(AbstractMonosourceMethod):
         cstate["last_seen_u"] = last_seen_u
         cstate["last_seen_b"] = last_seen_b
 
+    def do_recompute_obsels_from(self, computed_trace, cstate, earliest, diag):
+        """I implement
+        :meth:`.abstract.AbstractMonosourceMethod.do_recompute_obsels_from`
+
+        Filtered obsels have the same end as their source obsel,
+        so only those ending at or after `earliest` have to be recomputed.
+        This is not possible with a ``bgp``, which may depend on any obsel.
+        """
+        if cstate["bgp"] is not None  or  "last_seen_u" not in cstate:
+            return False
+        LOG.debug("recomputing %s from %s", computed_trace, earliest)
+        computed_trace.obsel_collection.remove_obsels_from(earliest)
+        self.do_compute_obsels(computed_trace, cstate, LOGIC_MON, diag,
+                               mine=earliest)
+        return True
+
 register_builtin_method_impl(_FilterMethod())
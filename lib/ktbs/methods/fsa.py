@@ -24,9 +24,11 @@ from fsa4streams import FSA
 from fsa4streams.matcher import DIRECTORY as matcher_directory
 from fsa4streams.state import State
 from json import dumps
-from rdflib import Literal, RDF, URIRef, Graph
+from rdflib import Literal, RDF, URIRef, Graph, Variable
+from rdflib.plugins.sparql.processor import prepareQuery
 from .abstract import AbstractMonosourceMethod, NOT_MON, PSEUDO_MON, STRICT_MON
-from .utils import boolean_parameter, translate_node
+from .utils import AGGREGATE_FUNCTIONS, boolean_parameter, \
+    get_attribute_rows, translate_node
 from ..engine.builtin_method import register_builtin_method_impl
 from ..namespace import KTBS
 
@@ -56,20 +58,67 @@ def match_sparql_ask(transition, event, token, fsa):
     transition conditions are interpreted as the WHERE clause of a SPARQL Ask query,
     where variable ?obs is bound to the considered obsel,
     and prefix m: is bound to the source trace URI.
+
+    Conditions are compiled (see `compile_sparql_ask`:func:) the first time
+    they are used, and the result is kept in the `ask_matchers` dict of `fsa`.
     """
-    m_ns = fsa.source.model_uri
-    if m_ns[-1] != '/' and m_ns[-1] != '#':
-        m_ns += '#'
+    matchers = getattr(fsa, 'ask_matchers', None)
+    if matchers is None:
+        matchers = fsa.ask_matchers = {}
+    condition = transition['condition']
+    matcher = matchers.get(condition)
+    if matcher is None:
+        m_ns = fsa.source.model_uri
+        if m_ns[-1] != '/' and m_ns[-1] != '#':
+            m_ns += '#'
+        matcher = matchers[condition] = compile_sparql_ask(condition, m_ns)
     history = token and token.get('history_events')
     if history:
         pred = URIRef(history[-1])
     else:
         pred = None
-    return fsa.source_obsels_graph.query(
-        "ASK { %s }" % transition['condition'],
-        initNs={"": KTBS, "m": m_ns},
-        initBindings={"obs": URIRef(event), "pred": pred},
-    ).askAnswer
+    return matcher(fsa.source_obsels_graph, URIRef(event), pred)
+
+def compile_sparql_ask(condition, m_ns):
+    """
+    I compile the condition of a 'sparql-ask' transition.
+
+    I return a function accepting a graph, the considered obsel and the
+    previous obsel of the token (or None), and returning a boolean.
+
+    Conditions consisting of a single triple pattern are evaluated as a
+    direct triple lookup; other conditions are evaluated as a prepared ASK
+    query, where ?obs and ?pred are passed as initBindings.
+    """
+    query = prepareQuery("ASK { %s }" % condition, {"": KTBS, "m": m_ns})
+    part = query.algebra.p
+    if part.name == 'Project':
+        part = part.p
+    if part.name == 'BGP' and len(part.triples) == 1:
+        pattern = part.triples[0]
+        free_vars = [ term for term in pattern
+                      if isinstance(term, Variable)
+                      and term != _OBS and term != _PRED ]
+        if len(set(free_vars)) == len(free_vars):
+            def match_triple(graph, obs, pred):
+                "match a single triple pattern"
+                bindings = { _OBS: obs, _PRED: pred }
+                triple = tuple( bindings.get(term)
+                                if isinstance(term, Variable) else term
+                                for term in pattern )
+                for _ in graph.triples(triple):
+                    return True
+                return False
+            return match_triple
+
+    def match_query(graph, obs, pred):
+        "match a prepared ASK query"
+        return graph.query(query, initBindings={"obs": obs, "pred": pred},
+        ).askAnswer
+    return match_query
+
+_OBS = Variable("obs")
+_PRED = Variable("pred")
 
 matcher_directory['sparql-ask'] = match_sparql_ask
 
@@ -114,6 +163,7 @@ class _FSAMethod(AbstractMonosourceMethod):
         fsa.source = source
         fsa.target = computed_trace
         fsa.source_obsels_graph = source_obsels.state
+        fsa.ask_matchers = {} # see match_sparql_ask
 
         if monotonicity is STRICT_MON:
             LOG.debug("strictly temporally monotonic %s, reloading state", computed_trace)
@@ -132,63 +182,49 @@ class _FSAMethod(AbstractMonosourceMethod):
         source_value = source_state.value
         target_uri = computed_trace.uri
         target_model_uri = computed_trace.model_uri
-        target_add_graph = target_obsels.add_obsel_graph
+        new_obs_graphs = []
+        attr_values = {} # cache for get_attribute_rows
         after = last_seen and URIRef(last_seen)
 
-        with target_obsels.edit({"add_obsels_only":1}, _trust=True):
-            for obs in source.iter_obsels(after=after, refresh="no"):
-                last_seen = event = unicode(obs.uri)
-                matching_tokens = fsa.feed(event, obs.end)
-                for i, token in enumerate(matching_tokens):
-                    state = KtbsFsaState(fsa, token['state'],
-                                         source_model_uri, target_model_uri)
-                    source_obsels = [ URIRef(uri) for uri in token['history_events']]
-                    otype_uri = state.get_obsel_type()
-                    LOG.debug("matched {} -> {}".format(source_obsels[-1], otype_uri))
-
-                    new_obs_uri = translate_node(source_obsels[-1], computed_trace,
-                                                 source_uri, False)
-                    if i > 0:
-                        new_obs_uri = URIRef("{}-{}".format(new_obs_uri, i))
-                    new_obs_graph = Graph()
-                    new_obs_add = new_obs_graph.add
-                    new_obs_add((new_obs_uri, KTBS.hasTrace, target_uri))
-                    new_obs_add((new_obs_uri, RDF.type, otype_uri))
-                    new_obs_add((new_obs_uri, KTBS.hasBegin, source_value(source_obsels[0], KTBS.hasBegin)))
-                    new_obs_add((new_obs_uri, KTBS.hasEnd, source_value(source_obsels[-1], KTBS.hasEnd)))
-                    for source_obsel in source_obsels:
-                        new_obs_add((new_obs_uri, KTBS.hasSourceObsel, source_obsel))
-
-                    attributes = state.get_attributes()
-                    if attributes:
-                        qvars = []
-                        qwhere = [ '?obs <{}> ?end .'.format(KTBS.hasEnd) ]
-                        for i, triple in enumerate(attributes):
-                            var = '?v{}'.format(i)
-                            qvars.append(var)
-                            qwhere.append('OPTIONAL {{?obs <{}> {} .}}'
-                                          .format(triple[1], var))
-                        query = ('SELECT {} {{'
-                                 '\n{}\nVALUES (?obs) {{\n(<{}>)\n}}'
-                                 '}} ORDER BY ?end')\
-                            .format(
-                            ' '.join(qvars),
-                            '\n'.join(qwhere),
-                            '>)\n(<'.join(source_obsels),
-                            )
-                        results = source_state.query(query)
-                        for i, triple in enumerate(attributes):
-                            target_attr, _, aggr_func = triple
-                            try:
-                                val = aggr_func(results, i)
-                                if val is not None:
-                                    new_obs_add((new_obs_uri, target_attr, val))
-                            except Exception, ex:
-                                LOG.warn(ex.message)
-
-
-
-                    target_add_graph(new_obs_graph)
+        for obs in source.iter_obsels(after=after, refresh="no"):
+            last_seen = event = unicode(obs.uri)
+            matching_tokens = fsa.feed(event, obs.end)
+            for i, token in enumerate(matching_tokens):
+                state = KtbsFsaState(fsa, token['state'],
+                                     source_model_uri, target_model_uri)
+                source_obsels = [ URIRef(uri) for uri in token['history_events']]
+                otype_uri = state.get_obsel_type()
+                LOG.debug("matched {} -> {}".format(source_obsels[-1], otype_uri))
+
+                new_obs_uri = translate_node(source_obsels[-1], computed_trace,
+                                             source_uri, False)
+                if i > 0:
+                    new_obs_uri = URIRef("{}-{}".format(new_obs_uri, i))
+                new_obs_graph = Graph()
+                new_obs_add = new_obs_graph.add
+                new_obs_add((new_obs_uri, KTBS.hasTrace, target_uri))
+                new_obs_add((new_obs_uri, RDF.type, otype_uri))
+                new_obs_add((new_obs_uri, KTBS.hasBegin, source_value(source_obsels[0], KTBS.hasBegin)))
+                new_obs_add((new_obs_uri, KTBS.hasEnd, source_value(source_obsels[-1], KTBS.hasEnd)))
+                for source_obsel in source_obsels:
+                    new_obs_add((new_obs_uri, KTBS.hasSourceObsel, source_obsel))
+
+                attributes = state.get_attributes()
+                if attributes:
+                    rows = get_attribute_rows(source_state, source_obsels,
+                                              attributes, attr_values)
+                    for j, triple in enumerate(attributes):
+                        target_attr, _, aggr_func = triple
+                        try:
+                            val = aggr_func(rows, j)
+                            if val is not None:
+                                new_obs_add((new_obs_uri, target_attr, val))
+                        except Exception, ex:
+                            LOG.warn(ex.message)
+
+                new_obs_graphs.append(new_obs_graph)
+
+        target_obsels.add_obsel_graphs(new_obs_graphs)
 
         cstate["last_seen"] = last_seen
         cstate["tokens"] = fsa.export_tokens_as_dict()
@@ -220,105 +256,14 @@ class KtbsFsaState(State):
 
 
 def _split_source_attribute(source_attribute, source_model_uri):
-    global _FUNCTIONS
     splitted = source_attribute.split(' ')
     if len(splitted) == 1:
         splitted.insert(0, "last")
     assert len(splitted) == 2, splitted
     return (
         URIRef(splitted[1], source_model_uri),
-        _FUNCTIONS[splitted[0]],
+        AGGREGATE_FUNCTIONS[splitted[0]],
     )
 
 
-def _last(data, index):
-    lst = [ tpl[index] for tpl in data if tpl[index] is not None ]
-    if lst:
-        return lst[-1]
-    else:
-        return None
-
-def _first(data, index):
-    lst = [ tpl[index] for tpl in data if tpl[index] is not None ]
-    if lst:
-        return lst[0]
-    else:
-        return None
-
-def _count(data, index):
-    lst = [ tpl[index] for tpl in data if tpl[index] is not None ]
-    return Literal(len(lst))
-
-def _sum(data, index):
-    lst = [ tpl[index].toPython() for tpl in data if tpl[index] is not None ]
-    if lst:
-        try:
-            return Literal(sum(lst))
-        except TypeError:
-            return Literal(sum( float(i) for i in lst ))
-    else:
-        return None
-
-def _avg(data, index):
-    lst = [ tpl[index].toPython() for tpl in data if tpl[index] is not None ]
-    if lst:
-        try:
-            sumval = sum(lst)
-        except TypeError:
-            sumval = sum( float(i) for i in lst )
-        try:
-            return Literal(sumval/float(len(lst)))
-        except TypeError:
-            return Literal(float(sumval)/float(len(lst)))
-    else:
-        return None
-
-def _min(data, index):
-    lst = [ tpl[index] for tpl in data if tpl[index] is not None ]
-    if lst:
-        return min(lst)
-    else:
-        return None
-
-def _max(data, index):
-    lst = [ tpl[index] for tpl in data if tpl[index] is not None ]
-    if lst:
-        return max(lst)
-    else:
-        return None
-
-def _span(data, index):
-    lst = [ tpl[index] for tpl in data if tpl[index] is not None ]
-    if lst:
-        minval = min(lst).toPython()
-        maxval = max(lst).toPython()
-        try:
-            val = maxval - minval
-        except TypeError:
-            val = float(maxval) - float(minval)
-        return Literal(val)
-    else:
-        return None
-
-def _concat(data, index):
-    lst = [ unicode(tpl[index]) for tpl in data if tpl[index] is not None ]
-    if lst:
-        return Literal(" ".join(lst))
-    else:
-        return None
-
-_FUNCTIONS = {
-    'first':  _first,
-    'last':   _last,
-    'count':  _count,
-    'sum':    _sum,
-    'avg':    _avg,
-    'min':    _min,
-    'max':    _max,
-    'span':   _span,
-    'concat': _concat,
-}
-
-
-
 register_builtin_method_impl(_FSAMethod())
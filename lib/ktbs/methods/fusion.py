@@ -19,10 +19,11 @@
 Implementation of the fusion builtin methods.
 """
 import traceback
+from heapq import merge
 from json import dumps as json_dumps, loads as json_loads
 import logging
 
-from rdflib import Literal, URIRef
+from rdflib import Graph, Literal, URIRef
 
 from rdfrest.util.iso8601 import ParseError
 from rdfrest.util import Diagnosis
@@ -47,6 +48,8 @@ class _FusionMethod(IMethod):
         cstate = { "method": "fusion",
                    "last_seens": {},
                    "old_log_mon_tags": {},
+                   "old_pse_mon_tags": {},
+                   "old_str_mon_tags": {},
         }
 
         srcs, params =  self._prepare_source_and_params(computed_trace, diag)
@@ -98,70 +101,63 @@ class _FusionMethod(IMethod):
             computed_trace.metadata.value(computed_trace.uri,
                                           METADATA.computation_state))
         if from_scratch:
-            for key in ("last_seens", "old_log_mon_tags"):
+            for key in _CSTATE_DICTS:
                 cstate[key] = {}
         errors = cstate.get("errors")
         if errors:
             for i in errors:
                 diag.append(i)
                 return diag
+        for key in _CSTATE_DICTS:
+            cstate.setdefault(key, {}) # cstate of an older version of fusion
 
         # start anew if sources have changed or have been modified in a
         # non-monotonic way
         old_log_mon_tags = cstate["old_log_mon_tags"]
         target_obsels = computed_trace.obsel_collection
-        for src in computed_trace.source_traces:
-            old_tag = old_log_mon_tags.get(src.uri)
+        sources = computed_trace.source_traces
+        for src in sources:
+            # NB: keys of cstate dicts are unicode (as loaded from JSON),
+            # and do not match the URIRef of the source
+            old_tag = old_log_mon_tags.get(unicode(src.uri))
             if old_tag != src.obsel_collection.log_mon_tag:
                 target_obsels._empty() # friend #pylint: disable=W0212
                 LOG.debug("non-monotonic %s", computed_trace)
-                cstate["last_seens"] = {}
-                cstate["old_log_mon_tags"] = old_log_mon_tags = {}
+                for key in _CSTATE_DICTS:
+                    cstate[key] = {}
                 break
-        if not old_log_mon_tags:
-            cstate["old_log_mon_tags"] = old_log_mon_tags = dict(
-                (src.uri, src.obsel_collection.log_mon_tag)
-                for src in computed_trace.source_traces
-                )
-        
+
+        # merge the new obsels of all sources in (end, begin, uri) order
+        target_contains = target_obsels.state.__contains__
         last_seens = cstate["last_seens"]
-        target_uri = computed_trace.uri
-        with target_obsels.edit(_trust=True) as editable:
-            target_contains = editable.__contains__
-            target_add = editable.add
-            for src in computed_trace.source_traces:
-                src_uri = src.uri
-                src_triples = src.obsel_collection.get_state({"refresh":"no"}).triples
-                for obs in src.iter_obsels(begin=last_seens.get(src_uri), refresh="no"):
-                    last_seens[src_uri] = obs.begin
-
-                    new_obs_uri = translate_node(obs.uri, computed_trace,
-                                                 src_uri, True)
-                    if target_contains((new_obs_uri,
-                                        KTBS.hasTrace,
-                                        target_uri)):
-                        LOG.debug("--- skipping %s", new_obs_uri)
-                        continue # already added
-
-                    LOG.debug("--- keeping %s", obs)
-                    target_add((new_obs_uri, KTBS.hasTrace, target_uri))
-                    target_add((new_obs_uri, KTBS.hasSourceObsel, obs.uri))
-
-                    for _, pred, obj in src_triples((obs.uri, None, None)):
-                        if pred == KTBS.hasTrace \
-                        or pred == KTBS.hasSourceObsel:
-                            continue
-                        new_obj = translate_node(obj, computed_trace, src_uri,
-                                                 True)
-                        target_add((new_obs_uri, pred, new_obj))
-                    for subj, pred, _ in src_triples((None, None, obs.uri)):
-                        if pred == KTBS.hasTrace \
-                        or pred == KTBS.hasSourceObsel:
-                            continue
-                        new_subj = translate_node(subj, computed_trace, src_uri,
-                                                  True)
-                        target_add((new_subj, pred, new_obs_uri))
-        
+        streams = []
+        for src in sources:
+            keys, check = self._iter_new_keys(src, cstate)
+            streams.append(self._iter_candidates(src, keys, check,
+                                                 computed_trace,
+                                                 target_contains))
+
+        def iter_new_obs_graphs():
+            "yield the graphs of the obsels to add to the computed trace"
+            for _, _, new_obs_uri, obs_uri, src in merge(*streams):
+                LOG.debug("--- keeping %s", obs_uri)
+                yield _copy_obsel(obs_uri, new_obs_uri, src, computed_trace)
+
+        # NB: with add_obsel_graphs, the monotonicity of the computed trace
+        # is derived from the obsels actually added, so a fusion of
+        # (pseudo-)monotonic sources is still (pseudo-)monotonic
+        target_obsels.add_obsel_graphs(iter_new_obs_graphs())
+
+        for src in sources:
+            src_uri = unicode(src.uri)
+            src_obsels = src.obsel_collection
+            last_key = src_obsels.get_last_obsel_key()
+            if last_key is not None:
+                last_key = [last_key[0], last_key[1], unicode(last_key[2])]
+            last_seens[src_uri] = last_key
+            cstate["old_log_mon_tags"][src_uri] = src_obsels.log_mon_tag
+            cstate["old_pse_mon_tags"][src_uri] = src_obsels.pse_mon_tag
+            cstate["old_str_mon_tags"][src_uri] = src_obsels.str_mon_tag
 
         computed_trace.metadata.set((computed_trace.uri,
                                      METADATA.computation_state,
@@ -169,6 +165,44 @@ class _FusionMethod(IMethod):
                                      ))
         return diag
 
+    @staticmethod
+    def _iter_new_keys(src, cstate):
+        """I return the keys of the obsels of `src` that may be new.
+
+        I also return a boolean indicating whether those obsels may already
+        be in the computed trace (and must therefore be checked).
+        """
+        src_uri = unicode(src.uri)
+        src_obsels = src.obsel_collection
+        last_seen = cstate["last_seens"].get(src_uri)
+        if not isinstance(last_seen, list):
+            # first computation, or cstate of an older version of fusion
+            return src_obsels.iter_obsel_keys(), last_seen is not None
+        if cstate["old_str_mon_tags"].get(src_uri) == src_obsels.str_mon_tag:
+            return src_obsels.iter_obsel_keys(after=URIRef(last_seen[2])), \
+                False
+        if cstate["old_pse_mon_tags"].get(src_uri) == src_obsels.pse_mon_tag:
+            begin = last_seen[1] - src.get_pseudomon_range()
+            return src_obsels.iter_obsel_keys(begin=begin), True
+        return src_obsels.iter_obsel_keys(), True
+
+    @staticmethod
+    def _iter_candidates(src, keys, check, computed_trace, target_contains):
+        """I iter over the obsels of `src` to be added to the computed trace.
+
+        Each obsel is represented by a tuple starting with its key in the
+        computed trace, so that the outputs for all sources can be merged.
+        """
+        src_uri = src.uri
+        target_uri = computed_trace.uri
+        for end, begin, obs_uri in keys:
+            new_obs_uri = translate_node(obs_uri, computed_trace, src_uri, True)
+            if check and target_contains((new_obs_uri, KTBS.hasTrace,
+                                          target_uri)):
+                LOG.debug("--- skipping %s", new_obs_uri)
+                continue # already added
+            yield end, begin, new_obs_uri, obs_uri, src
+
     @staticmethod
     def _prepare_source_and_params(computed_trace, diag):
         """I check and prepare the data required by the method.
@@ -212,6 +246,32 @@ class _FusionMethod(IMethod):
             return sources, params
 
 
+def _copy_obsel(obs_uri, new_obs_uri, src, computed_trace):
+    """I return the graph of `new_obs_uri`, a copy of obsel `obs_uri`.
+    """
+    src_uri = src.uri
+    src_triples = src.obsel_collection.state.triples
+    graph = Graph()
+    add = graph.add
+    add((new_obs_uri, KTBS.hasTrace, computed_trace.uri))
+    add((new_obs_uri, KTBS.hasSourceObsel, obs_uri))
+    for _, pred, obj in src_triples((obs_uri, None, None)):
+        if pred == KTBS.hasTrace \
+        or pred == KTBS.hasSourceObsel:
+            continue
+        new_obj = translate_node(obj, computed_trace, src_uri, True)
+        add((new_obs_uri, pred, new_obj))
+    for subj, pred, _ in src_triples((None, None, obs_uri)):
+        if pred == KTBS.hasTrace \
+        or pred == KTBS.hasSourceObsel:
+            continue
+        new_subj = translate_node(subj, computed_trace, src_uri, True)
+        add((new_subj, pred, new_obs_uri))
+    return graph
+
+_CSTATE_DICTS = ("last_seens", "old_log_mon_tags", "old_pse_mon_tags",
+                 "old_str_mon_tags")
+
 _PARAMETERS_TYPE = {
     "origin": Literal,
     "model": URIRef,
@@ -50,3 +50,13 @@ class IMethod(object):
 
         """
         raise NotImplementedError
+
+    def forget_computed_trace(self, computed_trace):
+        """I release the resources I may hold for the given computed trace
+
+        :param computed_trace: a :class:`..engine.trace.ComputedTrace`
+
+        This is called when the computed trace is deleted, or when its
+        parameters or method change. The default implementation does nothing.
+        """
+        pass
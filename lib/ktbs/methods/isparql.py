@@ -23,7 +23,7 @@ import logging
 from rdflib import Literal, RDF, URIRef, Graph
 from rdfrest.util import check_new
 from .abstract import AbstractMonosourceMethod, NOT_MON, PSEUDO_MON, STRICT_MON
-from .utils import translate_node
+from .utils import get_last_obsel_key, translate_node
 from ..engine.builtin_method import register_builtin_method_impl
 from ..namespace import KTBS, KTBS_NS_URI
 
@@ -112,8 +112,9 @@ class _ISparqlMethod(AbstractMonosourceMethod):
         source_uri = source.uri
         target_uri = computed_trace.uri
         target_contains = target_obsels.state.__contains__
-        target_add_graph = target_obsels.add_obsel_graph
-        with target_obsels.edit({"add_obsels_only":1}, _trust=True):
+
+        def iter_new_obs_graphs():
+            "yield the graphs of the obsels to add to the computed trace"
             for row in rows:
                 sourceObsel = row[i_sourceObsel]
 
@@ -131,12 +132,13 @@ class _ISparqlMethod(AbstractMonosourceMethod):
                 for pred, obj in zip(columns, row):
                     if obj is not None:
                         add((new_obs_uri, pred, obj))
-                target_add_graph(new_obs_graph)
+                yield new_obs_graph
+
+        target_obsels.add_obsel_graphs(iter_new_obs_graphs())
 
-        for obs in source.iter_obsels(begin=begin, reverse=True, limit=1):
-            # iter only once on the last obsel, if any
-            last_seen_u = obs.uri
-            last_seen_b = obs.begin
+        last_key = get_last_obsel_key(source, begin)
+        if last_key is not None:
+            _, last_seen_b, last_seen_u = last_key
 
         cstate["last_seen_u"] = last_seen_u
         cstate["last_seen_b"] = last_seen_b
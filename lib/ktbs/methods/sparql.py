@@ -19,6 +19,7 @@
 Implementation of the sparql builtin methods.
 """
 import traceback
+from json import dumps as json_dumps, loads as json_loads
 
 from pyparsing import ParseException
 from rdfrest.exceptions import ParseError
@@ -29,9 +30,12 @@ import rdflib.plugins.sparql.algebra
 
 from rdfrest.util.prefix_conjunctive_view import PrefixConjunctiveView
 from .interface import IMethod
-from .utils import replace_obsels
+from .utils import append_obsels, boolean_parameter, get_new_source_keys, \
+    get_source_cstate, replace_obsels
 from ..namespace import KTBS
 from ..engine.builtin_method import register_builtin_method_impl
+from ..engine.obsel import get_obsels_bounded_descriptions
+from ..engine.resource import METADATA
 
 import logging
 
@@ -73,22 +77,64 @@ class _SparqlMethod(IMethod):
         parameters["__source__"] = source.uri
 
         scope = parameters.get('scope', 'trace')
+        incremental = boolean_parameter(parameters.get('incremental', 'false'))
+        source_obsels = source.obsel_collection
         try:
+            new_keys = None
+            if incremental and scope == 'trace':
+                new_keys = self._get_new_keys(computed_trace, source,
+                                              from_scratch)
             if scope == 'base':
                 data = PrefixConjunctiveView(source.base.uri,
                                              source.service.store)
+            elif new_keys is not None:
+                # only the obsels that are new since the last computation
+                data = get_obsels_bounded_descriptions(
+                    [ key[2] for key in new_keys ], source_obsels.state)
             else:
                 # scope == 'trace'
-                data = source.obsel_collection.get_state({"refresh":"no"})
+                data = source_obsels.get_state({"refresh":"no"})
             sparql = parameters["sparql"] % parameters
-            result = data.query(sparql, base=source.obsel_collection.uri).graph
-            replace_obsels(computed_trace, result, ("inherit" in parameters))
+            if new_keys is None:
+                result = data.query(sparql, base=source_obsels.uri).graph
+                replace_obsels(computed_trace, result, ("inherit" in parameters))
+            elif new_keys:
+                result = data.query(sparql, base=source_obsels.uri).graph
+                append_obsels(computed_trace, result, ("inherit" in parameters),
+                              [ key[2] for key in new_keys ])
+            if incremental:
+                self._store_cstate(computed_trace, source)
         except Exception, exc:
             LOG.warn(traceback.format_exc())
             diag.append(unicode(exc))
 
         return diag
 
+    @staticmethod
+    def _get_new_keys(computed_trace, source, from_scratch):
+        """I return the keys of the source obsels to consider in incremental mode.
+
+        If the source has changed in a strictly or pseudo-monotonic way since
+        the last computation, I return the (end, begin, uri) keys of the
+        obsels that may be new; else, I return None, meaning that the
+        computed trace must be computed anew from the whole source.
+        """
+        stored = computed_trace.metadata.value(computed_trace.uri,
+                                               METADATA.computation_state)
+        if from_scratch or stored is None:
+            return None
+        return get_new_source_keys(source, json_loads(stored))
+
+    @staticmethod
+    def _store_cstate(computed_trace, source):
+        """I store the state of the source, for the next incremental computation.
+        """
+        cstate = get_source_cstate(source)
+        computed_trace.metadata.set((computed_trace.uri,
+                                     METADATA.computation_state,
+                                     Literal(json_dumps(cstate))
+                                     ))
+
     @staticmethod
     def _prepare_source_and_params(computed_trace, diag):
         """I check and prepare the data required by the method.
@@ -133,6 +179,11 @@ class _SparqlMethod(IMethod):
                                 % (key, val))
                     critical = True
 
+        if boolean_parameter(str(params.get("incremental", "false"))) \
+        and params.get("scope", "trace") != "trace":
+            diag.append("Parameter incremental requires scope=trace")
+            critical = True
+
         if critical:
             return None, None
         else:
@@ -149,6 +200,7 @@ _PARAMETERS_TYPE = {
     "sparql": str,
     "inherit": str,
     "scope": _scope_datatype,
+    "incremental": str,
 }
 
 # monkeypatch to fix issue #381 in rdflib.plugins.sparql
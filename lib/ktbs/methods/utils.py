@@ -18,11 +18,17 @@
 """
 Utility functions for method implementations.
 """
-from rdflib import BNode, Graph, URIRef
-from rdfrest.util import check_new, make_fresh_uri
+import logging
+from itertools import product
 
+from rdflib import BNode, Graph, Literal, URIRef
+from rdfrest.util import bounded_description, check_new, make_fresh_uri
+
+from ..engine.obsel import get_obsels_bounded_descriptions
 from ..namespace import KTBS
 
+LOG = logging.getLogger(__name__)
+
 def replace_obsels(computed_trace, raw_graph, inherit=False):
     """
     Replace the @obsels graph of computed_trace with raw_graph.
@@ -36,17 +42,7 @@ def replace_obsels(computed_trace, raw_graph, inherit=False):
     ct_uri = computed_trace.uri
 
     if inherit:
-        rg_val = raw_graph.value
-        getobs = computed_trace.service.get
-        triples = raw_graph.triples((None, KTBS.hasSourceObsel, None))
-        for newnode, _, olduri in triples:
-            # if ktbs:hasTrace is not specified,
-            # it must be smartly set and *not* inherited:
-            rg_add((newnode, KTBS.hasTrace, ct_uri))
-            oldobs = getobs(olduri)
-            for _, prop, val in oldobs.state.triples((olduri, None, None)):
-                if rg_val(newnode, prop) is None:
-                    rg_add((newnode, prop, val))
+        _inherit_source_properties(computed_trace, raw_graph)
 
     bnodes = [ i for i in raw_graph.subjects(KTBS.hasBegin, None)
                if isinstance(i, BNode) ]
@@ -67,6 +63,94 @@ def replace_obsels(computed_trace, raw_graph, inherit=False):
             triples = iter(raw_graph)
         editable.addN( (s, p, o, editable) for s, p, o in triples )
 
+def append_obsels(computed_trace, raw_graph, inherit=False, replaced=()):
+    """
+    Add the obsels of raw_graph to the @obsels graph of computed_trace.
+
+    This works like `replace_obsels`, except that the computed trace is not
+    emptied, and that obsels whose URI is already in the computed trace are
+    ignored. Obsels are added in temporal order, with
+    `~.engine.trace_obsels.AbstractTraceObsels.add_obsel_graphs`:meth:,
+    so that the monotonicity of the computed trace is preserved whenever
+    possible.
+
+    `replaced` is an iterable of source obsels from which raw_graph has been
+    (re)computed. The obsels of computed_trace derived from them (through
+    ktbs:hasSourceObsel) are removed first, so that obsels computed again
+    (e.g. after a pseudo-monotonic change of the source) are not duplicated.
+    """
+    obsels = computed_trace.obsel_collection
+    obsels_state = obsels.state
+    ct_uri = computed_trace.uri
+
+    to_remove = set()
+    for src in replaced:
+        to_remove.update(obsels_state.subjects(KTBS.hasSourceObsel, src))
+    if to_remove:
+        descriptions = get_obsels_bounded_descriptions(to_remove,
+                                                       obsels_state)
+        with obsels.edit(_trust=True) as editable:
+            for triple in descriptions:
+                editable.remove(triple)
+
+    if inherit:
+        _inherit_source_properties(computed_trace, raw_graph)
+
+    rg_val = raw_graph.value
+    keys = []
+    for node, begin in raw_graph.subject_objects(KTBS.hasBegin):
+        end = rg_val(node, KTBS.hasEnd, default=begin)
+        keys.append((int(end), int(begin), node))
+    keys.sort()
+
+    bnode_map = {}
+    for _, _, node in keys:
+        if isinstance(node, BNode):
+            while True:
+                new_uri = make_fresh_uri(obsels_state, ct_uri + "o-")
+                if check_new(raw_graph, new_uri) \
+                and new_uri not in bnode_map.values():
+                    break
+            bnode_map[node] = new_uri
+
+    def iter_obs_graphs():
+        "yield the graph of each new obsel"
+        bm_get = bnode_map.get
+        for _, _, node in keys:
+            new_node = bm_get(node, node)
+            if new_node is node \
+            and (node, KTBS.hasTrace, ct_uri) in obsels_state:
+                continue # already there
+            graph = Graph()
+            add = graph.add
+            description = bounded_description(node, raw_graph,
+                                              prune=bnode_map)
+            for triple in description:
+                add(tuple( bm_get(x, x) for x in triple ))
+            add((new_node, KTBS.hasTrace, ct_uri))
+            yield graph
+
+    obsels.add_obsel_graphs(iter_obs_graphs())
+
+def _inherit_source_properties(computed_trace, raw_graph):
+    """
+    Copy into raw_graph the properties that its obsels inherit from their
+    source obsel.
+    """
+    rg_add = raw_graph.add
+    rg_val = raw_graph.value
+    ct_uri = computed_trace.uri
+    getobs = computed_trace.service.get
+    triples = list(raw_graph.triples((None, KTBS.hasSourceObsel, None)))
+    for newnode, _, olduri in triples:
+        # if ktbs:hasTrace is not specified,
+        # it must be smartly set and *not* inherited:
+        rg_add((newnode, KTBS.hasTrace, ct_uri))
+        oldobs = getobs(olduri)
+        for _, prop, val in oldobs.state.triples((olduri, None, None)):
+            if rg_val(newnode, prop) is None:
+                rg_add((newnode, prop, val))
+
 def translate_node(node, transformed_trace, src_uri, multiple_sources, prevent=None):
     """
     If node is a URI, translate its URI to put it in transfored_trace. Else,
@@ -89,7 +173,13 @@ def translate_node(node, transformed_trace, src_uri, multiple_sources, prevent=N
 def copy_obsel(obsel, computed_trace, source_trace, new_obs_uri=None, check_new_obs=None):
     """
     I prepare a graph for an transformed obsel being a copy of ``obsel``.
+
+    ``obsel`` can be an obsel, or the URI of an obsel of ``source_trace``.
     """
+    if isinstance(obsel, URIRef):
+        obs_uri = obsel
+    else:
+        obs_uri = obsel.uri
     new_obs_graph = Graph()
     new_obs_add = new_obs_graph.add
 
@@ -101,12 +191,12 @@ def copy_obsel(obsel, computed_trace, source_trace, new_obs_uri=None, check_new_
     source_uri = source_trace.uri
     source_triples = source_trace.obsel_collection.state.triples
     if new_obs_uri is None:
-        new_obs_uri = translate_node(obsel.uri, computed_trace, source_uri, False)
+        new_obs_uri = translate_node(obs_uri, computed_trace, source_uri, False)
 
     new_obs_add((new_obs_uri, KTBS.hasTrace, computed_trace.uri))
-    new_obs_add((new_obs_uri, KTBS.hasSourceObsel, obsel.uri))
+    new_obs_add((new_obs_uri, KTBS.hasSourceObsel, obs_uri))
 
-    for _, pred, obj in source_triples((obsel.uri, None, None)):
+    for _, pred, obj in source_triples((obs_uri, None, None)):
         if pred == KTBS.hasTrace  or  pred == KTBS.hasSourceObsel:
             continue
         new_obj = translate_node(obj, computed_trace, source_uri,
@@ -115,7 +205,7 @@ def copy_obsel(obsel, computed_trace, source_trace, new_obs_uri=None, check_new_
             continue # skip relations to nodes that are filtered out or not created yet
         new_obs_add((new_obs_uri, pred, new_obj))
 
-    for subj, pred, _ in source_triples((None, None, obsel.uri)):
+    for subj, pred, _ in source_triples((None, None, obs_uri)):
         if pred == KTBS.hasTrace  or  pred == KTBS.hasSourceObsel:
             continue
         new_subj = translate_node(subj, computed_trace, source_uri,
@@ -127,6 +217,186 @@ def copy_obsel(obsel, computed_trace, source_trace, new_obs_uri=None, check_new_
     return new_obs_graph
 
 
+def get_last_obsel_key(source_trace, begin=None):
+    """
+    I return the (end, begin, uri) key of the last obsel of ``source_trace``
+    with a begin greater or equal to ``begin``, or None.
+
+    I rely on the bookkeeping of the obsel collection, and only query the
+    obsels if the last obsel of the trace begins before ``begin``.
+    """
+    ret = source_trace.obsel_collection.get_last_obsel_key()
+    if ret is not None and begin is not None and ret[1] < begin:
+        ret = None
+        for obs in source_trace.iter_obsels(begin=begin, reverse=True,
+                                            limit=1, refresh="no"):
+            ret = (obs.end, obs.begin, obs.uri)
+    return ret
+
+def get_source_cstate(source_trace):
+    """
+    I return a JSON-serializable description of the current state of
+    ``source_trace``, to be passed later to `get_new_source_keys`.
+    """
+    source_obsels = source_trace.obsel_collection
+    last_seen = source_obsels.get_last_obsel_key()
+    if last_seen is not None:
+        last_seen = [last_seen[0], last_seen[1], unicode(last_seen[2])]
+    return {
+        "str_mon_tag": source_obsels.str_mon_tag,
+        "pse_mon_tag": source_obsels.pse_mon_tag,
+        "last_seen": last_seen,
+    }
+
+def get_new_source_keys(source_trace, cstate):
+    """
+    I return the keys of the obsels of ``source_trace`` that may be new since
+    ``cstate`` was produced by `get_source_cstate`.
+
+    If the source has changed in a strictly or pseudo-monotonic way since
+    then, I return the list of (end, begin, uri) keys of the obsels that may
+    be new; else, I return None, meaning that the computation must start anew
+    from the whole source.
+
+    NB: in the pseudo-monotonic case, some of the returned obsels may
+    not be new.
+    """
+    source_obsels = source_trace.obsel_collection
+    last_seen = cstate.get("last_seen")
+    if cstate.get("str_mon_tag") == source_obsels.str_mon_tag:
+        LOG.debug("strictly temporally monotonic %s", source_trace)
+        if last_seen is None:
+            return list(source_obsels.iter_obsel_keys())
+        return list(source_obsels.iter_obsel_keys(
+            after=URIRef(last_seen[2])))
+    elif cstate.get("pse_mon_tag") == source_obsels.pse_mon_tag:
+        LOG.debug("pseudo temporally monotonic %s", source_trace)
+        if last_seen is None:
+            return list(source_obsels.iter_obsel_keys())
+        begin = last_seen[1] - source_trace.get_pseudomon_range()
+        return list(source_obsels.iter_obsel_keys(begin=begin))
+    else:
+        LOG.debug("non-monotonic %s", source_trace)
+        return None
+
+def get_attribute_rows(source_state, source_obsels, attributes, cache):
+    """
+    I return the values of the source attributes of the matched obsels,
+    as expected by the functions of `AGGREGATE_FUNCTIONS`.
+
+    Each row contains, for one of the source obsels (in temporal order),
+    one value (or None) for each source attribute in `attributes`.
+    Multi-valued attributes yield several rows for the same obsel
+    (one per combination of values).
+
+    The values are read directly from `source_state`, and kept in `cache`
+    (a dict), as the same obsel often appears in several matches.
+    """
+    rows = []
+    preds = [ triple[1] for triple in attributes ]
+    for obs in source_obsels:
+        values = []
+        for pred in preds:
+            key = (obs, pred)
+            vals = cache.get(key)
+            if vals is None:
+                vals = cache[key] = list(source_state.objects(obs, pred)) \
+                       or [None]
+            values.append(vals)
+        rows.extend(product(*values))
+    return rows
+
+# aggregate functions, used by fsa and window to compute attribute values;
+# each of them takes a list of rows (see get_attribute_rows) and an index
+
+def _last(data, index):
+    lst = [ tpl[index] for tpl in data if tpl[index] is not None ]
+    if lst:
+        return lst[-1]
+    else:
+        return None
+
+def _first(data, index):
+    lst = [ tpl[index] for tpl in data if tpl[index] is not None ]
+    if lst:
+        return lst[0]
+    else:
+        return None
+
+def _count(data, index):
+    lst = [ tpl[index] for tpl in data if tpl[index] is not None ]
+    return Literal(len(lst))
+
+def _sum(data, index):
+    lst = [ tpl[index].toPython() for tpl in data if tpl[index] is not None ]
+    if lst:
+        try:
+            return Literal(sum(lst))
+        except TypeError:
+            return Literal(sum( float(i) for i in lst ))
+    else:
+        return None
+
+def _avg(data, index):
+    lst = [ tpl[index].toPython() for tpl in data if tpl[index] is not None ]
+    if lst:
+        try:
+            sumval = sum(lst)
+        except TypeError:
+            sumval = sum( float(i) for i in lst )
+        try:
+            return Literal(sumval/float(len(lst)))
+        except TypeError:
+            return Literal(float(sumval)/float(len(lst)))
+    else:
+        return None
+
+def _min(data, index):
+    lst = [ tpl[index] for tpl in data if tpl[index] is not None ]
+    if lst:
+        return min(lst)
+    else:
+        return None
+
+def _max(data, index):
+    lst = [ tpl[index] for tpl in data if tpl[index] is not None ]
+    if lst:
+        return max(lst)
+    else:
+        return None
+
+def _span(data, index):
+    lst = [ tpl[index] for tpl in data if tpl[index] is not None ]
+    if lst:
+        minval = min(lst).toPython()
+        maxval = max(lst).toPython()
+        try:
+            val = maxval - minval
+        except TypeError:
+            val = float(maxval) - float(minval)
+        return Literal(val)
+    else:
+        return None
+
+def _concat(data, index):
+    lst = [ unicode(tpl[index]) for tpl in data if tpl[index] is not None ]
+    if lst:
+        return Literal(" ".join(lst))
+    else:
+        return None
+
+AGGREGATE_FUNCTIONS = {
+    'first':  _first,
+    'last':   _last,
+    'count':  _count,
+    'sum':    _sum,
+    'avg':    _avg,
+    'min':    _min,
+    'max':    _max,
+    'span':   _span,
+    'concat': _concat,
+}
+
 def boolean_parameter(value):
     return value.strip().lower() not in { "false", "no", "0" }
 
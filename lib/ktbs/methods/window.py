@@ -0,0 +1,247 @@
+#    This file is part of KTBS <http://liris.cnrs.fr/sbt-dev/ktbs>
+#    Copyright (C) 2011-2012 Pierre-Antoine Champin <pchampin@liris.cnrs.fr> /
+#    Universite de Lyon <http://www.universite-lyon.fr>
+#
+#    KTBS is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    KTBS is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with KTBS.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Implementation of the window builtin method.
+
+Window ``k`` covers the timestamps from ``k*step`` to ``k*step + width - 1``
+(both included), and contains the source obsels whose *end* is in that range.
+Tumbling windows have ``step == width``; sliding windows have a smaller step.
+
+A window is *closed* when no new obsel can end in it anymore, i.e. when it
+ends before the last obsel of the source, minus the pseudo-monotonicity range
+of the source. Only closed windows are produced, unless parameter ``partial``
+is set; then open windows are also produced, and replaced as new obsels
+arrive (which makes the computed trace non-monotonic).
+"""
+import logging
+
+from rdflib import Graph, Literal, RDF, URIRef
+
+from .abstract import AbstractMonosourceMethod, PSEUDO_MON, STRICT_MON
+from .utils import AGGREGATE_FUNCTIONS, boolean_parameter, \
+    get_attribute_rows
+from ..engine.builtin_method import register_builtin_method_impl
+from ..namespace import KTBS
+
+LOG = logging.getLogger(__name__)
+
+class _WindowMethod(AbstractMonosourceMethod):
+    """I implement the window builtin method.
+    """
+    uri = KTBS.window
+
+    parameter_types = {
+        "origin": Literal,
+        "model": URIRef,
+        "width": int,
+        "step": int,
+        "otype": unicode,
+        "aggregates": unicode,
+        "partial": boolean_parameter,
+    }
+    required_parameters = ("width",)
+
+    def init_state(self, computed_trace, params, cstate, diag):
+        """I implement :meth:`.abstract.AbstractMonosourceMethod.init_state
+        """
+        width = params.get("width")
+        step = params.get("step", width)
+        if width <= 0:
+            diag.append("Parameter width must be strictly positive")
+        if step <= 0:
+            diag.append("Parameter step must be strictly positive")
+        target_model_uri = computed_trace.model_uri
+        source_model_uri = computed_trace.source_traces[0].model_uri
+        otype = URIRef(params.get("otype", "#Window"), target_model_uri)
+        aggregates = []
+        for line in params.get("aggregates", "").splitlines():
+            splitted = line.split()
+            if not splitted:
+                continue
+            if len(splitted) == 2 and splitted[1] == "count":
+                splitted.append(None) # count obsels
+            if len(splitted) != 3 or splitted[1] not in AGGREGATE_FUNCTIONS:
+                diag.append("Invalid aggregate: %s" % line.strip())
+                continue
+            target_attr, func, source_attr = splitted
+            aggregates.append([
+                unicode(URIRef(target_attr, target_model_uri)),
+                func,
+                source_attr and unicode(URIRef(source_attr, source_model_uri)),
+            ])
+
+        cstate.update([
+            ("width", width),
+            ("step", step),
+            ("otype", unicode(otype)),
+            ("aggregates", aggregates),
+            ("partial", params.get("partial", False)),
+            ("last_seen", None),
+            ("closed", None),
+            ("pending", []),
+        ])
+
+    def do_compute_obsels(self, computed_trace, cstate, monotonicity, diag,
+                          mine=None):
+        """I implement :meth:`.abstract.AbstractMonosourceMethod.do_compute_obsels
+
+        If `mine` is provided, only the source obsels ending at or after `mine`
+        are considered.
+        """
+        # additional argument mine #pylint: disable=W0221
+        source = computed_trace.source_traces[0]
+        source_obsels = source.obsel_collection
+        target_obsels = computed_trace.obsel_collection
+        width = cstate["width"]
+        step = cstate["step"]
+        partial = cstate["partial"]
+        last_seen = cstate["last_seen"]
+        closed = cstate["closed"]
+        pending = set(cstate["pending"])
+        pseudomon_range = source.get_pseudomon_range()
+
+        if last_seen is None:
+            monotonicity = None # nothing computed yet
+        if mine is not None:
+            new_keys = source_obsels.iter_obsel_keys(mine=mine)
+        elif monotonicity is STRICT_MON:
+            LOG.debug("strictly temporally monotonic %s", computed_trace)
+            new_keys = source_obsels.iter_obsel_keys(after=URIRef(last_seen[2]))
+        elif monotonicity is PSEUDO_MON:
+            LOG.debug("pseudo temporally monotonic %s", computed_trace)
+            new_keys = source_obsels.iter_obsel_keys(
+                mine=last_seen[0] - pseudomon_range)
+        else:
+            LOG.debug("non-monotonic %s", computed_trace)
+            target_obsels._empty() # friend #pylint: disable=W0212
+            closed = None
+            pending = set()
+            new_keys = source_obsels.iter_obsel_keys()
+
+        # windows in `pending` contain obsels, and are not produced as closed yet
+        emitted = set(pending) if partial else set()
+        touched = set()
+        for end, _, _ in new_keys:
+            touched.update(_iter_windows(end, width, step))
+        if closed is not None:
+            touched = set( k for k in touched if k >= closed )
+        pending.update(touched)
+
+        last_key = source_obsels.get_last_obsel_key()
+        if last_key is not None:
+            # no new obsel can end before the watermark
+            watermark = last_key[0] - pseudomon_range
+            new_closed = -((width - 1 - watermark) // step) # ceil division
+            if closed is None or new_closed > closed:
+                closed = new_closed
+        to_produce = sorted( k for k in pending if k < closed )
+        pending.difference_update(to_produce)
+        if partial:
+            to_produce.extend(sorted(pending))
+        to_replace = emitted & touched
+        to_produce = [ k for k in to_produce
+                       if k not in emitted or k in to_replace ]
+
+        graphs = [ self._make_window_graph(computed_trace, source_obsels, k,
+                                           cstate)
+                   for k in to_produce ]
+        if to_replace:
+            LOG.debug("replacing windows %s", sorted(to_replace))
+            with target_obsels.edit(_trust=True) as editable:
+                for k in to_replace:
+                    editable.remove((_window_uri(computed_trace, k),
+                                     None, None))
+                for graph in graphs:
+                    for triple in graph:
+                        editable.add(triple)
+        else:
+            target_obsels.add_obsel_graphs(graphs)
+
+        if last_key is not None:
+            last_key = [last_key[0], last_key[1], unicode(last_key[2])]
+        cstate["last_seen"] = last_key
+        cstate["closed"] = closed
+        cstate["pending"] = sorted(pending)
+
+    def do_recompute_obsels_from(self, computed_trace, cstate, earliest, diag):
+        """I implement
+        :meth:`.abstract.AbstractMonosourceMethod.do_recompute_obsels_from`
+
+        Only the windows ending at or after `earliest` are recomputed.
+        """
+        if cstate["last_seen"] is None:
+            return False
+        width = cstate["width"]
+        step = cstate["step"]
+        first = -((width - 1 - earliest) // step) # first window to recompute
+        LOG.debug("recomputing %s from window %s", computed_trace, first)
+        computed_trace.obsel_collection.remove_obsels_from(earliest)
+        if cstate["closed"] is not None:
+            cstate["closed"] = min(cstate["closed"], first)
+        cstate["pending"] = [ k for k in cstate["pending"] if k < first ]
+        self.do_compute_obsels(computed_trace, cstate, PSEUDO_MON, diag,
+                               mine=first*step)
+        return True
+
+    @staticmethod
+    def _make_window_graph(computed_trace, source_obsels, k, cstate):
+        """I return the graph of the obsel representing window `k`.
+        """
+        width = cstate["width"]
+        start = k * cstate["step"]
+        stop = start + width - 1
+        source_state = source_obsels.state
+        obsels = [ key[2] for key in
+                   source_obsels.iter_obsel_keys(mine=start, end=stop) ]
+
+        uri = _window_uri(computed_trace, k)
+        graph = Graph()
+        add = graph.add
+        add((uri, KTBS.hasTrace, computed_trace.uri))
+        add((uri, RDF.type, URIRef(cstate["otype"])))
+        add((uri, KTBS.hasBegin, Literal(start)))
+        add((uri, KTBS.hasEnd, Literal(stop)))
+        for obs in obsels:
+            add((uri, KTBS.hasSourceObsel, obs))
+        cache = {}
+        for target_attr, func, source_attr in cstate["aggregates"]:
+            if source_attr is None:
+                source_attr = KTBS.hasTrace # exactly one per obsel
+            rows = get_attribute_rows(source_state, obsels,
+                                       [(None, URIRef(source_attr))], cache)
+            try:
+                val = AGGREGATE_FUNCTIONS[func](rows, 0)
+                if val is not None:
+                    add((uri, URIRef(target_attr), val))
+            except Exception, ex:
+                LOG.warn(ex.message)
+        return graph
+
+def _iter_windows(end, width, step):
+    """I iter over the indexes of the windows containing timestamp `end`.
+    """
+    first = -((width - 1 - end) // step) # ceil((end-width+1)/step)
+    last = end // step
+    return xrange(first, last+1)
+
+def _window_uri(computed_trace, k):
+    """I return the URI of the obsel representing window `k`.
+    """
+    return URIRef("%sw%s" % (computed_trace.uri, k))
+
+register_builtin_method_impl(_WindowMethod())
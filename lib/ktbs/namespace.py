@@ -499,6 +499,8 @@ KTBS_NS_TTL = """
                                         "SPARQL incrémental"@fr .
 :fsa      a :BuiltinMethod ; rdfs:label "Finite-state automaton"@en,
                                         "Automate à états fini"@fr .
+:window   a :BuiltinMethod ; rdfs:label "window"@en,
+                                        "fenêtre"@fr .
 
 :sequence    a :Unit ; rdfs:label "sequence"@en,    "séquence"@fr .
 :second      a :Unit ; rdfs:label "second"@en,      "seconde"@fr .
@@ -0,0 +1,218 @@
+#    This file is part of KTBS <http://liris.cnrs.fr/sbt-dev/ktbs>
+#    Copyright (C) 2011-2012 Pierre-Antoine Champin <pchampin@liris.cnrs.fr> /
+#    Universite de Lyon <http://www.universite-lyon.fr>
+#
+#    KTBS is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    KTBS is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with KTBS.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This kTBS plugin recomputes computed traces in the background.
+
+Without this plugin, computed traces are recomputed when their obsels are
+requested after a change in their sources, so the request has to wait for the
+recomputation. With this plugin, any change in a trace *schedules* the
+recomputation of the traces computed from it, which is then performed by a
+dedicated thread. Meanwhile, the obsels of those traces are served from a
+snapshot of their last computed state, and HTTP responses carry a
+``Warning: 110 - "Response is Stale"`` header. Requesting the obsels with
+``refresh=force`` still recomputes them synchronously.
+
+Recomputations are debounced: a trace is recomputed when its sources have not
+changed for ``debounce`` seconds, so that a burst of new obsels results in a
+single recomputation; ``max-delay`` bounds the time a continuous flow of
+changes can postpone it::
+
+    [plugins]
+    background_refresh = true
+
+    [background_refresh]
+    debounce = 1
+    max-delay = 10
+
+NB: traces are recomputed by a thread rather than by a pool of processes,
+as recomputation needs the RDF store of the kTBS process.
+That thread only locks the base of a trace to write the recomputed obsels,
+so requests are not delayed by the computation itself.
+"""
+import logging
+from threading import Condition, current_thread, Thread
+from time import time
+import traceback
+
+from ktbs.engine.trace_obsels import set_refresh_scheduler
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_DEBOUNCE = 1.0
+DEFAULT_MAX_DELAY = 10.0
+
+_SCHEDULER = None
+
+class RefreshScheduler(object):
+    """I recompute computed traces in a dedicated thread.
+
+    :param debounce: the time (in seconds) to wait after the last change
+                     of a trace before recomputing it
+    :param max_delay: the maximum time (in seconds) between the first change
+                      of a trace and its recomputation
+
+    See `ktbs.engine.trace_obsels.set_refresh_scheduler`:func:
+    for how I interact with obsel collections.
+    """
+
+    def __init__(self, debounce=DEFAULT_DEBOUNCE, max_delay=DEFAULT_MAX_DELAY):
+        self.debounce = debounce
+        self.max_delay = max(debounce, max_delay)
+        self._cond = Condition()
+        self._scheduled = {} # uri -> [obsels, due time, deadline]
+        self._running = set()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        """I start the recomputing thread.
+        """
+        self._stopping = False
+        self._thread = thread = Thread(target=self._run,
+                                       name="ktbs-background-refresh")
+        thread.daemon = True
+        thread.start()
+
+    def stop(self, timeout=None):
+        """I stop the recomputing thread, dropping scheduled recomputations.
+
+        The obsels of the dropped traces will be recomputed
+        the next time they are requested.
+        """
+        with self._cond:
+            self._stopping = True
+            self._scheduled.clear()
+            self._cond.notify_all()
+        thread = self._thread
+        if thread is not None and thread is not current_thread():
+            thread.join(timeout)
+        self._thread = None
+
+    def schedule(self, obsels, postpone=True):
+        """I schedule the recomputation of `obsels`.
+
+        If it is already scheduled, it is postponed by `debounce` seconds
+        (within the limit of `max_delay`) if `postpone` is true.
+        """
+        now = time()
+        with self._cond:
+            if self._stopping:
+                return
+            entry = self._scheduled.get(obsels.uri)
+            if entry is None:
+                due = now + self.debounce if postpone else now
+                self._scheduled[obsels.uri] = [obsels, due,
+                                               now + self.max_delay]
+                self._cond.notify_all()
+            elif postpone:
+                entry[1] = min(now + self.debounce, entry[2])
+
+    def is_pending(self, uri):
+        """I return whether the recomputation of `uri` is scheduled or running.
+        """
+        with self._cond:
+            return uri in self._scheduled or uri in self._running
+
+    def in_worker(self):
+        """I return whether the current thread is the recomputing thread.
+        """
+        return current_thread() is self._thread
+
+    def wait_idle(self, timeout=None):
+        """I wait until no recomputation is scheduled nor running.
+
+        :return: False if `timeout` expired before, else True
+        """
+        deadline = None if timeout is None else time() + timeout
+        with self._cond:
+            while self._scheduled or self._running:
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            return True
+
+    def _run(self):
+        """I am the main loop of the recomputing thread.
+        """
+        while True:
+            with self._cond:
+                obsels = self._pop_due()
+                if obsels is None:
+                    return
+                uri = obsels.uri
+                self._running.add(uri)
+            try:
+                LOG.debug("recomputing <%s> in the background", uri)
+                obsels.force_state_refresh()
+            except Exception: # catch all #pylint: disable=W0703
+                LOG.warn("background recomputation of <%s> failed:\n%s",
+                         uri, traceback.format_exc())
+            finally:
+                with self._cond:
+                    self._running.discard(uri)
+                    self._cond.notify_all()
+
+    def _pop_due(self):
+        """I wait for the next due recomputation, and return its obsels.
+
+        I return None if the scheduler is stopping.
+        NB: the condition must be held when calling this method.
+        """
+        cond = self._cond
+        scheduled = self._scheduled
+        while not self._stopping:
+            if scheduled:
+                uri, entry = min(scheduled.iteritems(),
+                                 key=lambda item: item[1][1])
+                delay = entry[1] - time()
+                if delay <= 0:
+                    del scheduled[uri]
+                    return entry[0]
+                cond.wait(delay)
+            else:
+                cond.wait()
+        return None
+
+
+def start_plugin(config):
+    """I start the background recomputation of computed traces.
+    """
+    global _SCHEDULER # using global statement #pylint: disable=W0603
+    debounce = DEFAULT_DEBOUNCE
+    max_delay = DEFAULT_MAX_DELAY
+    if config.has_section('background_refresh'):
+        if config.has_option('background_refresh', 'debounce'):
+            debounce = config.getfloat('background_refresh', 'debounce')
+        if config.has_option('background_refresh', 'max-delay'):
+            max_delay = config.getfloat('background_refresh', 'max-delay')
+    _SCHEDULER = RefreshScheduler(debounce, max_delay)
+    _SCHEDULER.start()
+    set_refresh_scheduler(_SCHEDULER)
+
+def stop_plugin():
+    """I stop the background recomputation of computed traces.
+    """
+    global _SCHEDULER # using global statement #pylint: disable=W0603
+    set_refresh_scheduler(None)
+    if _SCHEDULER is not None:
+        _SCHEDULER.stop()
+        _SCHEDULER = None
@@ -21,23 +21,55 @@ Implementation of the external builtin methods.
 IMPORTANT: this method allows kTBS users to run arbitrary commands
 on the server, with the priviledges of the user running kTBS.
 Therefore, it is mostly intended for single-user localhost instances of kTBS.
+
+In persistent mode (parameter ``persistent``), the command is started once,
+and kept running between computations. It then communicates with kTBS
+through the following line-based protocol:
+
+* for each computation, kTBS writes on the standard input of the worker
+  a header line (``#reset``, ``#strict`` or ``#pseudo``),
+  then the new source obsels in N-Triples, then a line ``#end``;
+* the worker answers on its standard output with the obsels to add to
+  the computed trace, in N-Triples, followed by a line ``#end``.
+
+``#reset`` means that the computed trace has been emptied, and that the batch
+contains all the source obsels; ``#strict`` means that the batch only contains
+obsels that were added after the ones previously sent; ``#pseudo`` means that
+the batch contains the obsels that may have been added (as allowed by the
+pseudo-monotonicity range of the source), some of which may have been sent
+before; the obsels previously derived from them (through ``ktbs:hasSourceObsel``)
+are then replaced by the answer of the worker.
 """
 import logging
 import traceback
 
-from os import getenv
+from os import getenv, read as os_read
 from rdflib import Literal, Graph, URIRef
 from rdfrest.util import Diagnosis
 from rdfrest.exceptions import ParseError
+from select import select
 from subprocess import Popen, PIPE
+from threading import RLock, Thread
+from time import time
+
+try:
+    from resource import setrlimit, RLIMIT_AS
+except ImportError:
+    # not available on this platform; max-memory will be ignored
+    setrlimit = None
 
 from ktbs.methods.interface import IMethod
-from ktbs.methods.utils import replace_obsels
-from ktbs.engine.builtin_method import register_builtin_method_impl
+from ktbs.methods.utils import append_obsels, boolean_parameter, \
+    get_new_source_keys, get_source_cstate, replace_obsels
+from ktbs.engine.builtin_method import register_builtin_method_impl, \
+    unregister_builtin_method_impl
+from ktbs.engine.obsel import get_obsels_bounded_descriptions
 from ktbs.namespace import KTBS
 
 LOG = logging.getLogger(__name__)
 
+DEFAULT_TIMEOUT = 60 # in seconds
+
 class _ExternalMethod(IMethod):
     """I implement the external builtin method.
     """
@@ -92,6 +124,16 @@ class _ExternalMethod(IMethod):
         rdfformat = parameters.get("format", "n3")
 
         command_line = parameters["command-line"] % parameters
+        if boolean_parameter(str(parameters.get("persistent", "false"))):
+            try:
+                self._compute_with_worker(computed_trace, sources[0],
+                                          command_line, parameters,
+                                          from_scratch)
+            except Exception, exc:
+                LOG.warn(traceback.format_exc())
+                diag.append(unicode(exc))
+            return diag
+
         if parameters.get("feed-to-stdin"):
             stdin = PIPE
             stdin_data = (sources[0].obsel_collection
@@ -101,13 +143,9 @@ class _ExternalMethod(IMethod):
             stdin = None
             stdin_data = None
 
-        popen_env = {
-            "PATH": getenv("PATH", ""),
-            "PYTHONPATH": getenv("PYTHONPATH", ""),
-            }
         LOG.info("Running: %s" % command_line)
         child = Popen(command_line, shell=True, stdin=stdin, stdout=PIPE,
-                      close_fds=True, env=popen_env)
+                      close_fds=True, env=_get_popen_env())
         rdfdata, _ = child.communicate(stdin_data)
         if child.returncode != 0:
             diag.append("command-line ended with error: %s" % child.returncode)
@@ -122,6 +160,74 @@ class _ExternalMethod(IMethod):
 
         return diag
 
+    def forget_computed_trace(self, computed_trace):
+        """I implement :meth:`.interface.IMethod.forget_computed_trace`.
+
+        I stop the persistent worker of `computed_trace`, if any.
+        """
+        with _WORKERS_LOCK:
+            worker = _WORKERS.pop(computed_trace.uri, None)
+        if worker is not None:
+            worker.kill()
+
+    @staticmethod
+    def _compute_with_worker(computed_trace, source, command_line, parameters,
+                             from_scratch):
+        """I feed the new obsels of `source` to the persistent worker
+        of `computed_trace`, and add its answer to the computed trace.
+        """
+        timeout = float(parameters.get("timeout", DEFAULT_TIMEOUT))
+        max_memory = parameters.get("max-memory")
+        if max_memory is not None:
+            max_memory = int(max_memory)
+
+        with _WORKERS_LOCK:
+            worker = _WORKERS.get(computed_trace.uri)
+            if worker is not None and (not worker.is_alive()
+                    or worker.command_line != command_line
+                    or worker.max_memory != max_memory):
+                worker.kill()
+                worker = None
+            if worker is None:
+                worker = _Worker(command_line, max_memory)
+                _WORKERS[computed_trace.uri] = worker
+
+        source_obsels = source.obsel_collection
+        new_keys = None
+        if not from_scratch and worker.source_cstate is not None:
+            new_keys = get_new_source_keys(source, worker.source_cstate)
+        if new_keys is None:
+            header = "reset"
+            new_keys = source_obsels.iter_obsel_keys()
+        elif worker.source_cstate["str_mon_tag"] == source_obsels.str_mon_tag:
+            header = "strict"
+        else:
+            header = "pseudo"
+        source_cstate = get_source_cstate(source)
+
+        if header != "reset" and not new_keys:
+            return
+        batch = get_obsels_bounded_descriptions(
+            [ key[2] for key in new_keys ], source_obsels.state)
+        try:
+            lines = worker.process_batch(header, batch.serialize(format="nt"),
+                                         timeout)
+        except:
+            # the state of the worker is now unknown
+            with _WORKERS_LOCK:
+                if _WORKERS.get(computed_trace.uri) is worker:
+                    del _WORKERS[computed_trace.uri]
+            worker.kill()
+            raise
+        raw_graph = Graph()
+        raw_graph.parse(data="\n".join(lines), format="nt")
+        if header == "reset":
+            replace_obsels(computed_trace, raw_graph)
+        else:
+            append_obsels(computed_trace, raw_graph,
+                          replaced=[ key[2] for key in new_keys ])
+        worker.source_cstate = source_cstate
+
     @staticmethod
     def _prepare_sources_and_params(computed_trace, diag):
         """I check and prepare the data required by the method.
@@ -172,12 +278,115 @@ class _ExternalMethod(IMethod):
             diag.append("Too many sources (%s, max is %s)" % (nsrc, maxsrc))
             critical = True
 
+        if params.get("persistent") and nsrc != 1:
+            diag.append("Persistent mode requires exactly one source")
+            critical = True
+
         if critical:
             return None, None
         else:
             return sources, params
 
 
+class _Worker(object):
+    """I manage a long-lived process, used by the persistent mode.
+
+    :param command_line: the command line to run
+    :param max_memory: if not None, the maximum size (in MB) of the virtual
+      memory of the process
+    """
+
+    def __init__(self, command_line, max_memory=None):
+        self.command_line = command_line
+        self.max_memory = max_memory
+        self.source_cstate = None # the source state after the last batch
+        self._buffer = ""
+        preexec_fn = None
+        if max_memory is not None and setrlimit is not None:
+            limit = max_memory * 1024 * 1024
+            preexec_fn = lambda: setrlimit(RLIMIT_AS, (limit, limit))
+        LOG.info("Starting worker: %s" % command_line)
+        self.process = Popen(command_line, shell=True, stdin=PIPE,
+                             stdout=PIPE, close_fds=True,
+                             env=_get_popen_env(), preexec_fn=preexec_fn)
+
+    def is_alive(self):
+        """I return whether the process is still running.
+        """
+        return self.process.poll() is None
+
+    def kill(self):
+        """I kill the process (if still running).
+        """
+        if self.process.poll() is None:
+            LOG.info("Killing worker: %s" % self.command_line)
+            self.process.kill()
+            self.process.wait()
+
+    def process_batch(self, header, ntriples, timeout):
+        """I send a batch to the process, and return the lines it answers.
+
+        :param header: "reset", "strict" or "pseudo"
+        :param ntriples: the obsels of the batch, in N-Triples
+        :param timeout: the maximum time (in seconds) to wait for the answer
+
+        :raise: `WorkerError`:class: if the process does not answer in time,
+          or exits before answering
+        """
+        process = self.process
+        def write_batch():
+            "write the batch to the standard input of the process"
+            try:
+                process.stdin.write("#%s\n" % header)
+                process.stdin.write(ntriples)
+                process.stdin.write("#end\n")
+                process.stdin.flush()
+            except IOError:
+                pass # the process has died, which will be detected below
+        # writing in a separate thread prevents a dead-lock
+        # if the process starts answering before reading the whole batch
+        writer = Thread(target=write_batch)
+        writer.daemon = True
+        writer.start()
+
+        stdout = process.stdout.fileno()
+        deadline = time() + timeout
+        buf = self._buffer
+        lines = []
+        while True:
+            while "\n" in buf:
+                line, buf = buf.split("\n", 1)
+                if line.rstrip() == "#end":
+                    self._buffer = buf
+                    writer.join()
+                    return lines
+                lines.append(line)
+            remaining = deadline - time()
+            if remaining <= 0:
+                raise WorkerError("Worker did not answer within %ss"
+                                  % timeout)
+            ready, _, _ = select([stdout], [], [], remaining)
+            if ready:
+                chunk = os_read(stdout, 65536)
+                if not chunk:
+                    raise WorkerError("Worker exited with code %s"
+                                      % process.wait())
+                buf += chunk
+
+class WorkerError(Exception):
+    """Raised when a persistent worker fails to process a batch.
+    """
+    pass
+
+def _get_popen_env():
+    """I return the environment passed to external commands.
+    """
+    return {
+        "PATH": getenv("PATH", ""),
+        "PYTHONPATH": getenv("PYTHONPATH", ""),
+        }
+
+
 _PARAMETERS_TYPE = {
     "origin": Literal,
     "model": URIRef,
@@ -186,12 +395,32 @@ _PARAMETERS_TYPE = {
     "max-sources": int,
     "feed-to-stdin": bool, # for the moment assume 1st source
     "format": str,
+    "persistent": lambda val: boolean_parameter(str(val)),
+    "timeout": float,
+    "max-memory": int,
 }
 
+_WORKERS = {}
+_WORKERS_LOCK = RLock()
+_IMPL = None
+
 def start_plugin(_config):
     """I get the configuration values from the main kTBS configuration.
 
     .. note:: This function is called automatically by the kTBS.
               It is called once when the kTBS starts, not at each request.
     """
-    register_builtin_method_impl(_ExternalMethod())
+    global _IMPL #pylint: disable=W0603
+    _IMPL = _ExternalMethod()
+    register_builtin_method_impl(_IMPL)
+
+def stop_plugin():
+    """I unregister the method, and stop all the persistent workers.
+    """
+    global _IMPL #pylint: disable=W0603
+    unregister_builtin_method_impl(_IMPL)
+    _IMPL = None
+    with _WORKERS_LOCK:
+        for worker in _WORKERS.values():
+            worker.kill()
+        _WORKERS.clear()
@@ -23,3 +23,4 @@ import jsonld_parser
 import jsonld_serializers
 import csv_serializers
 import geojson_serializers
+import line_parsers
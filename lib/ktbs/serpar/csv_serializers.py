@@ -20,12 +20,12 @@ I provide kTBS CSV serializer, this is a serialization with information loss.
 """
 from cStringIO import StringIO
 from csv import writer as csv_writer
-from itertools import groupby
 from rdflib import RDF
 from rdfrest.serializers import register_serializer, SerializeError
 from rdfrest.util import wrap_exceptions
 from re import compile as Regexp
 
+from ..engine.temporal_index import TemporalIndex
 from ..namespace import KTBS, KTBS_NS_URI
 
 LEN_KTBS = len(KTBS_NS_URI)+1
@@ -46,41 +46,29 @@ def serialize_csv_trace_obsels(graph, resource, bindings=None):
         sio.reset()
         sio.truncate()
 
-def iter_csv_rows(trace_uri, graph, sep=u' | '):
+def iter_csv_rows(trace_uri, graph, sep=u' | ', columns=None):
     """
     Convert obsels in graph to a tabular form, an iterable of unicode strings.
 
     NB: the first yielded table contains column names.
-    """
 
-    results0 = graph.query("""
-        PREFIX : <{0}#>
-        SELECT DISTINCT ?attr
-        {{
-            ?obs :hasTrace <{1}> ; ?attr [].
-        }}
-    """.format(KTBS_NS_URI, trace_uri))
-
-    if len(results0) == 0:
-        # no obsel, yield minimal column header and stop
-        yield [u'id', u'type', u'begin', u'end']
-        return
-
-    ktbs_props = [ i[0] for i in results0 if i[0].startswith(KTBS.uri) ]
-    other_props = [ i[0] for i in results0 if not i[0].startswith(KTBS.uri) ]
-    ktbs_props.sort()
-    other_props.sort()
-
-    ktbs_props.remove(KTBS.hasTrace)
-    if KTBS.hasSourceObsel in ktbs_props:
-        ktbs_props.remove(KTBS.hasSourceObsel)
-        src_obs = [ KTBS.hasSourceObsel ]
-    else:
-        src_obs = []
+    :param columns: an optional list of property URIs to use as columns
+        (after the id column); if omitted, the columns are discovered from
+        the obsels, which requires an additional pass over the graph.
 
-    other_props.remove(RDF.type)
+    Obsels are yielded in the usual (end, begin, id) order, each row being
+    built directly from the triples of the corresponding obsel.
+    """
+    index = TemporalIndex.build(graph, trace_uri)
+
+    if columns is None:
+        if len(index) == 0:
+            # no obsel, yield minimal column header and stop
+            yield [u'id', u'type', u'begin', u'end']
+            return
+        columns = _discover_columns(graph, index)
 
-    props = [RDF.type] + ktbs_props + other_props + src_obs
+    props = list(columns)
     vars = []
     for prop in props:
         vars.append(make_var_name(prop, vars))
@@ -88,32 +76,38 @@ def iter_csv_rows(trace_uri, graph, sep=u' | '):
     # yielding column headers
     yield ['id'] + vars
 
-    select_parts = []
-    where_parts = []
-    for var, prop in zip(vars, props):
-        select_parts.append(u'?{0}'
-                         .format(var))
-        where_parts.append(u'OPTIONAL {{ ?id <{0}> ?{1} }}'
-                         .format(prop, var))
-
-    obs_query = u"""SELECT ?id {0}
-            WHERE {{
-                ?id <http://liris.cnrs.fr/silex/2009/ktbs#hasTrace> <{1}> .
-                {2}
-            }}
-            ORDER BY ?end ?begin ?id
-    """.format(' '.join(select_parts),
-               trace_uri,
-               '\n'.join(where_parts))
-
-    results = graph.query(obs_query)
-    for obsel_id, tuples in groupby(results, lambda tpl: tpl[0]):
-        sets = [ set() for i in vars ]
-        for tuple in tuples:
-            for val, valset in zip(tuple[1:], sets):
-                if val is not None:
-                    valset.add(val)
-        yield [obsel_id] + [ sep.join(valset) for valset in sets ]
+    col_of = dict( (prop, i) for i, prop in enumerate(props) )
+    get_col = col_of.get
+    predicate_objects = graph.predicate_objects
+    for _, _, obsel_id in index.iter_keys():
+        cells = [ [] for _ in props ]
+        for prop, val in predicate_objects(obsel_id):
+            i = get_col(prop)
+            if i is not None:
+                cells[i].append(val)
+        yield [obsel_id] + [ sep.join(cell) for cell in cells ]
+
+def _discover_columns(graph, index):
+    """
+    List the properties used by the indexed obsels, in column order.
+
+    The order is: rdf:type, then kTBS properties (except ktbs:hasTrace),
+    then other properties, then ktbs:hasSourceObsel.
+    """
+    props = set()
+    for _, _, obs in index.iter_keys():
+        props.update(graph.predicates(obs))
+    props.discard(KTBS.hasTrace)
+    props.discard(RDF.type)
+    if KTBS.hasSourceObsel in props:
+        props.remove(KTBS.hasSourceObsel)
+        src_obs = [ KTBS.hasSourceObsel ]
+    else:
+        src_obs = []
+
+    ktbs_props = sorted( i for i in props if i.startswith(KTBS.uri) )
+    other_props = sorted( i for i in props if not i.startswith(KTBS.uri) )
+    return [RDF.type] + ktbs_props + other_props + src_obs
 
 
 def make_var_name(uri, vars):
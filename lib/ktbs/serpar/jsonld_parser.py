@@ -220,6 +220,7 @@ CONTEXT_JSON = """{"@context":{
     "fusion": "k:fusion",
     "sparql": "k:sparql",
     "isparql": "k:isparql",
+    "window": "k:window",
 
     "sequence": "k:sequence",
     "second": "k:second",
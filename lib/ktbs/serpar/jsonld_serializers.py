@@ -19,7 +19,6 @@
 I provide kTBS JSON-LD serializers.
 """
 from collections import OrderedDict
-from copy import deepcopy
 from itertools import chain, groupby
 from json import dumps
 from rdflib import BNode, Literal, RDF, RDFS, URIRef, XSD
@@ -652,14 +651,21 @@ def trace_obsels_to_json(graph, tobsels, bindings=None):
     :param bindings: ?
     :return: The dictionnary created.
     """
+    tobsels_dict, valconv = _trace_obsels_envelope(graph, tobsels)
+    tobsels_dict['obsels'] = list(iter_obsels_to_json(graph, valconv))
+    return tobsels_dict
+
+def _trace_obsels_envelope(graph, tobsels):
+    """
+    I create the Ordered dictionary describing the obsel collection,
+    with an empty list of obsels, and the ValueConverter to use for obsels.
+    """
     tobsels_dict = OrderedDict()
 
     model_uri = tobsels.trace.model_uri
     if model_uri[-1] not in { "/", "#" }:
         model_uri += "#"
     valconv = ValueConverter(tobsels.uri, { model_uri: "m" })
-    valconv_uri = valconv.uri
-    val2jsonobj = valconv.val2jsonobj
 
     if (tobsels.uri, RDF.type, KTBS.StoredTraceObsels) in graph:
         tobsels_type = "StoredTraceObsels"
@@ -676,90 +682,129 @@ def trace_obsels_to_json(graph, tobsels, bindings=None):
         '@id': '',
         '@type': tobsels_type
     }
-    tobsels_dict['obsels'] = obsel_list = []
+    tobsels_dict['obsels'] = []
+    return tobsels_dict, valconv
 
-    obsels = graph.query("""
-        PREFIX : <%s#>
-        SELECT ?obs ?pred ?other ?rev ?trc
-        {
-            ?obs :hasBegin ?begin ;
-                 :hasEnd ?end .
-            {
-                ?obs ?pred ?other .
-                BIND (0 as ?rev)
-            }
-            UNION
-            {
-                ?other ?pred ?obs .
-                BIND (1 as ?rev)
-            }
-            OPTIONAL { ?other :hasTrace ?trc } .
-        } ORDER BY ?end ?begin ?obs ?rev ?pred ?other
-    """ % (KTBS_NS_URI))
-
-
-    for obs, tuples in groupby(obsels, lambda tpl: tpl[0]):
-        obs_dict = deepcopy(_OBSEL_TEMPLATE)
-        obs_dict['@id'] = valconv_uri(obs)
-        rev_dict = OrderedDict()
-
-        for _, pred, other, rev, trc in tuples:
-
-            # handle special predicates
-            if pred == _RDF_TYPE and not rev:
-                at_type = obs_dict['@type']
-                if at_type is None:
-                    obs_dict['@type'] = valconv_uri(other)
-                else:
-                    if not type(at_type) is list:
-                        obs_dict['@type'] = at_type = [at_type]
-                    at_type.append(valconv_uri(other))
-                continue
-            if pred == _KTBS_HAS_TRACE:
-                # ignored here, implied by the 'obsels' key in the parent dict
-                continue
-            if pred == _KTBS_HAS_SOURCE_OBSEL:
-                # '@id' is implied by hasSourceObsel
-                obs_dict['hasSourceObsel'].append(valconv_uri(other))
-                continue
-
-
-            if rev:
-                the_dict = rev_dict
-            else:
-                the_dict = obs_dict
-
-            pred_key = KTBS_SPECIAL_KEYS.get(pred) or valconv_uri(pred)
-            new_val = val2jsonobj(other)
-            if pred_key == 'subject' and type(new_val) is OrderedDict:
-                # nicer representation of URI subject
-                pred_key = 'hasSubject'
-                new_val = new_val['@id']
-            elif trc:
-                # other is a related obsel URI, so new_val must be a dict
-                new_val['hasTrace'] = valconv_uri(trc)
-
-            old_val = the_dict.get(pred_key)
-            if old_val is None:
-                the_dict[pred_key] = new_val
-            elif type(old_val) == list:
-                old_val.append(new_val)
-            else:
-                the_dict[pred_key] = [old_val, new_val]
+def iter_obsels_to_json(graph, valconv):
+    """
+    I iter over the obsels of graph, in temporal order,
+    and yield an Ordered dictionary for each of them.
 
-        if rev_dict:
-            obs_dict['@reverse'] = rev_dict
+    Only the (end, begin, uri) keys of all obsels are held in memory;
+    the arcs of each obsel are retrieved when it is yielded.
+    """
+    # NB: we used to retrieve all arcs with a single SPARQL query,
+    # but rdflib builds and sorts the whole result before returning it;
+    # arcs are still sorted the same way (see _sparql_order_key)
+    begins = dict(graph.subject_objects(KTBS.hasBegin))
+    keys = []
+    for obs, end in graph.subject_objects(KTBS.hasEnd):
+        begin = begins.get(obs)
+        if begin is not None:
+            keys.append((int(end), int(begin), obs))
+    del begins
+    keys.sort()
+
+    graph_value = graph.value
+    for _, _, obs in keys:
+        rows = [ (obs, pred, other, 0)
+                 for pred, other in graph.predicate_objects(obs) ]
+        rows.extend( (obs, pred, other, 1)
+                     for other, pred in graph.subject_predicates(obs) )
+        rows.sort(key=lambda row: _sparql_order_key(row[2]))
+        rows.sort(key=lambda row: _sparql_order_key(row[1]))
+        rows.sort(key=lambda row: row[3])
+        yield _obsel_to_json(
+            obs,
+            ( (obs, pred, other, rev,
+               None if isinstance(other, Literal)
+               else graph_value(other, _KTBS_HAS_TRACE))
+              for obs, pred, other, rev in rows ),
+            valconv)
+
+def _sparql_order_key(node):
+    """
+    I return a key for sorting nodes the same way as SPARQL ORDER BY
+    (as implemented by rdflib).
+    """
+    if isinstance(node, BNode):
+        return (1, node)
+    elif isinstance(node, URIRef):
+        return (2, node)
+    else:
+        return (3, node)
 
-        todel = []
-        for key, val in obs_dict.items():
-            if val is None or val == []:
-                todel.append(key)
-        for key in todel:
-            del obs_dict[key]
+def _obsel_to_json(obs, tuples, valconv):
+    """
+    I create an Ordered dictionary representing an obsel.
 
-        obsel_list.append(obs_dict)
+    :param tuples: the (obs, pred, other, rev, trc) tuples describing the
+      arcs of the obsel, where rev indicates whether the arc is reversed
+      (other, pred, obs), and trc is the trace of other (if any)
+    """
+    valconv_uri = valconv.uri
+    val2jsonobj = valconv.val2jsonobj
 
-    return tobsels_dict
+    obs_dict = OrderedDict(_OBSEL_TEMPLATE)
+    obs_dict['@id'] = valconv_uri(obs)
+    obs_dict['hasSourceObsel'] = []
+    rev_dict = OrderedDict()
+
+    for _, pred, other, rev, trc in tuples:
+
+        # handle special predicates
+        if pred == _RDF_TYPE and not rev:
+            at_type = obs_dict['@type']
+            if at_type is None:
+                obs_dict['@type'] = valconv_uri(other)
+            else:
+                if not type(at_type) is list:
+                    obs_dict['@type'] = at_type = [at_type]
+                at_type.append(valconv_uri(other))
+            continue
+        if pred == _KTBS_HAS_TRACE:
+            # ignored here, implied by the 'obsels' key in the parent dict
+            continue
+        if pred == _KTBS_HAS_SOURCE_OBSEL:
+            # '@id' is implied by hasSourceObsel
+            obs_dict['hasSourceObsel'].append(valconv_uri(other))
+            continue
+
+
+        if rev:
+            the_dict = rev_dict
+        else:
+            the_dict = obs_dict
+
+        pred_key = KTBS_SPECIAL_KEYS.get(pred) or valconv_uri(pred)
+        new_val = val2jsonobj(other)
+        if pred_key == 'subject' and type(new_val) is OrderedDict:
+            # nicer representation of URI subject
+            pred_key = 'hasSubject'
+            new_val = new_val['@id']
+        elif trc:
+            # other is a related obsel URI, so new_val must be a dict
+            new_val['hasTrace'] = valconv_uri(trc)
+
+        old_val = the_dict.get(pred_key)
+        if old_val is None:
+            the_dict[pred_key] = new_val
+        elif type(old_val) == list:
+            old_val.append(new_val)
+        else:
+            the_dict[pred_key] = [old_val, new_val]
+
+    if rev_dict:
+        obs_dict['@reverse'] = rev_dict
+
+    todel = []
+    for key, val in obs_dict.items():
+        if val is None or val == []:
+            todel.append(key)
+    for key in todel:
+        del obs_dict[key]
+
+    return obs_dict
 
 _OBSEL_TEMPLATE = OrderedDict([
     ('@id', None),
@@ -770,7 +815,7 @@ _OBSEL_TEMPLATE = OrderedDict([
     ('endDT', None),
     ('subject', None),
     ('hasSubject', None),
-    ('hasSourceObsel', []),
+    ('hasSourceObsel', None), # replaced by a new list for each obsel
 ])
 
 _RDF_TYPE = RDF.type
@@ -788,14 +833,34 @@ def serialize_json_trace_obsels(graph, tobsels, bindings=None):
     """
     I serialize the trace obsels to a json-ld string.
 
+    The output is the same as ``dumps(trace_obsels_to_json(...), indent=4)``,
+    but obsels are serialized (and yielded) one at a time,
+    so that the whole document is never held in memory.
+
     :param graph:
     :param tobsels:
     :param bindings:
     :return:
     """
-    tobsels_dict = trace_obsels_to_json(graph, tobsels, bindings)
+    tobsels_dict, valconv = _trace_obsels_envelope(graph, tobsels)
+    envelope = dumps(tobsels_dict, ensure_ascii=False, indent=4)
+    # 'obsels' is the last key of the envelope, and is empty
+    assert envelope.endswith(_EMPTY_OBSELS_END)
+    head = envelope[:-len(_EMPTY_OBSELS_END)]
+
+    separator = u"[\n        "
+    for obs_dict in iter_obsels_to_json(graph, valconv):
+        obs_json = dumps(obs_dict, ensure_ascii=False, indent=4)
+        yield u"%s%s%s" % (head, separator,
+                           obs_json.replace(u"\n", u"\n        "))
+        head = u""
+        separator = u", \n        "
+    if head:
+        yield envelope # no obsel
+    else:
+        yield u"\n    ]\n}"
 
-    yield dumps(tobsels_dict, ensure_ascii=False, indent=4)
+_EMPTY_OBSELS_END = u"[]\n}"
 
 def trace_stats_to_json(graph, tstats, bindings=None):
     """
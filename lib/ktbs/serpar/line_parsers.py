@@ -0,0 +1,295 @@
+#    This file is part of KTBS <http://liris.cnrs.fr/sbt-dev/ktbs>
+#    Copyright (C) 2011-2012 Pierre-Antoine Champin <pchampin@liris.cnrs.fr> /
+#    Universite de Lyon <http://www.universite-lyon.fr>
+#
+#    KTBS is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    KTBS is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with KTBS.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Line-oriented obsel parsers, used for bulk ingestion in stored traces.
+
+Each parser accepts an iterable of lines and a trace,
+and yields ``(lineno, node, graph, error)`` tuples, where `lineno` is the
+(1-based) number of the first line describing an obsel, `node` is the node
+representing that obsel in `graph`, and `error` is None,
+or a message explaining why the line(s) could not be parsed
+(in which case `node` and `graph` are None).
+
+Two formats are supported:
+
+* NDJSON (``application/x-ndjson``): one obsel per line,
+  in the kTBS JSON-LD shape (as produced by the JSON serializer);
+* N-Triples (``application/n-triples``): consecutive triples with the same
+  subject describe one obsel.
+"""
+from json import loads
+from urlparse import urljoin
+
+from rdflib import BNode, Graph, Literal, RDF, URIRef, XSD
+from rdflib.plugins.parsers.ntriples import NTriplesParser, \
+    ParseError as NTriplesParseError
+
+from rdfrest.exceptions import ParseError
+from .jsonld_parser import parse_json
+from ..namespace import KTBS
+from ..utils import SKOS
+
+
+_LINE_PARSERS = {}
+
+def register_line_parser(content_type):
+    """I return a decorator for registering a line parser.
+    """
+    def decorator(func):
+        "the decorator returned by register_line_parser"
+        _LINE_PARSERS[content_type] = func
+        return func
+    return decorator
+
+def get_line_parser(content_type):
+    """I return the line parser for the given content-type, or None.
+    """
+    return _LINE_PARSERS.get(content_type)
+
+def iter_line_content_types():
+    """I iter over the content-types having a registered line parser.
+    """
+    return iter(_LINE_PARSERS)
+
+
+@register_line_parser("application/x-ndjson")
+def parse_ndjson_obsels(lines, trace):
+    """I parse obsels in the kTBS JSON-LD shape, one per line.
+
+    Obsels in the usual (flat) shape are converted directly to RDF;
+    lines that use less common JSON-LD features (e.g. a local ``@context``)
+    fall back to the full JSON-LD parser.
+    """
+    trace_uri = trace.uri
+    prefixes = dict(_PREFIXES)
+    model_uri = unicode(trace.model_uri)
+    if model_uri[-1] not in { "/", "#" }:
+        model_uri += "#"
+    prefixes["m"] = model_uri
+
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            json_data = loads(line)
+        except ValueError, ex:
+            yield lineno, None, None, "invalid JSON: %s" % ex
+            continue
+        if not isinstance(json_data, dict):
+            yield lineno, None, None, "obsel must be a JSON object"
+            continue
+        try:
+            node, graph = _json_to_graph(json_data, trace_uri, prefixes)
+        except _UnsupportedShape:
+            try:
+                graph = parse_json(line, trace_uri)
+            except ParseError, ex:
+                yield lineno, None, None, ex.message
+                continue
+            nodes = list(graph.subjects(KTBS.hasTrace, trace_uri))
+            if len(nodes) != 1:
+                yield lineno, None, None, "line must describe exactly one obsel"
+                continue
+            node = nodes[0]
+        yield lineno, node, graph, None
+
+@register_line_parser("application/n-triples")
+def parse_ntriples_obsels(lines, trace):
+    """I parse obsels in N-Triples, grouping consecutive triples by subject.
+
+    NB: blank nodes are only supported as the subject of the obsels;
+    in particular, obsels can not be described by several non-consecutive
+    groups of lines.
+    """
+    # unused argument 'trace' #pylint: disable=W0613
+    sink = _Sink()
+    parser = NTriplesParser(sink)
+    parser._bnode_ids = {} # do not share bnode ids with other parses
+    subject = graph = None
+    first_lineno = None
+    for lineno, line in enumerate(lines, 1):
+        parser.line = line.strip()
+        if isinstance(parser.line, unicode):
+            parser.line = parser.line.encode("utf-8")
+        try:
+            parser.parseline()
+        except NTriplesParseError, ex:
+            if graph is not None:
+                yield first_lineno, subject, graph, None
+            subject = graph = None
+            yield lineno, None, None, "invalid N-Triples: %s" % ex
+            continue
+        triple = sink.last
+        if triple is None:
+            continue # empty or comment line
+        sink.last = None
+        if triple[0] != subject:
+            if graph is not None:
+                yield first_lineno, subject, graph, None
+            subject = triple[0]
+            graph = Graph()
+            first_lineno = lineno
+        graph.add(triple)
+    if graph is not None:
+        yield first_lineno, subject, graph, None
+
+
+class _Sink(object):
+    """A sink for NTriplesParser, keeping only the last parsed triple.
+    """
+    #pylint: disable=R0903
+    #  too few public methods
+    last = None
+    def triple(self, s, p, o):
+        "I store the parsed triple"
+        self.last = (s, p, o)
+
+class _UnsupportedShape(Exception):
+    """Raised by _json_to_graph when the fallback parser is required.
+    """
+    pass
+
+def _json_to_graph(json_data, trace_uri, prefixes):
+    """I convert a JSON obsel to an RDF graph.
+
+    :return: the node representing the obsel, and the graph
+    :raise: _UnsupportedShape if json_data does not have the expected shape
+    """
+    graph = Graph()
+    add = graph.add
+    obs_id = json_data.get("@id")
+    if obs_id is None:
+        node = BNode()
+    elif isinstance(obs_id, basestring):
+        node = _make_node(obs_id, trace_uri, prefixes)
+    else:
+        raise _UnsupportedShape()
+
+    for key, val in json_data.iteritems():
+        if key == "@id":
+            continue
+        elif key == "@type":
+            for typ in (val if isinstance(val, list) else [val]):
+                if not isinstance(typ, basestring):
+                    raise _UnsupportedShape()
+                add((node, RDF.type, _expand_type(typ, prefixes)))
+            continue
+
+        term = _OBSEL_TERMS.get(key)
+        if term is not None:
+            prop, coercion = term
+        elif key[0] != "@" and ":" in key:
+            prop = _expand_iri(key, prefixes)
+            coercion = None
+        else:
+            raise _UnsupportedShape()
+
+        for item in (val if isinstance(val, list) else [val]):
+            if item is None:
+                continue
+            add((node, prop, _make_value(item, coercion, trace_uri, prefixes)))
+
+    if (node, KTBS.hasTrace, None) not in graph:
+        add((node, KTBS.hasTrace, trace_uri))
+    return node, graph
+
+def _make_node(val, trace_uri, prefixes):
+    """I convert an @id value to a node.
+    """
+    if val.startswith("_:"):
+        return BNode(val[2:])
+    if ":" in val:
+        prefix, suffix = val.split(":", 1)
+        namespace = prefixes.get(prefix)
+        if namespace is not None:
+            return URIRef(namespace + suffix)
+    return URIRef(urljoin(trace_uri, val))
+
+def _expand_iri(val, prefixes):
+    """I expand a compact IRI (if its prefix is known).
+    """
+    prefix, suffix = val.split(":", 1)
+    namespace = prefixes.get(prefix)
+    if namespace is not None:
+        return URIRef(namespace + suffix)
+    return URIRef(val)
+
+def _expand_type(val, prefixes):
+    """I expand the value of @type.
+    """
+    ret = _TYPE_TERMS.get(val)
+    if ret is not None:
+        return ret
+    if ":" not in val:
+        raise _UnsupportedShape()
+    return _expand_iri(val, prefixes)
+
+def _make_value(item, coercion, trace_uri, prefixes):
+    """I convert a JSON value to an RDF term.
+    """
+    if isinstance(item, dict):
+        if "@id" in item and len(item) == 1:
+            return _make_node(item["@id"], trace_uri, prefixes)
+        if "@value" in item and set(item) <= { "@value", "@type", "@language" }:
+            datatype = item.get("@type")
+            if datatype is not None:
+                datatype = _expand_iri(datatype, prefixes)
+            return Literal(item["@value"], item.get("@language"), datatype)
+        raise _UnsupportedShape()
+    if coercion == "@id":
+        if not isinstance(item, basestring):
+            raise _UnsupportedShape()
+        return _make_node(item, trace_uri, prefixes)
+    if coercion is not None:
+        if isinstance(item, bool) or not isinstance(item, (basestring, int, long)):
+            raise _UnsupportedShape()
+        return Literal(unicode(item), datatype=coercion)
+    if isinstance(item, basestring):
+        return Literal(item)
+    if isinstance(item, bool):
+        return Literal(item)
+    if isinstance(item, (int, long)):
+        return Literal(unicode(item), datatype=XSD.integer)
+    # floats have a canonical form in JSON-LD that we do not reproduce here
+    raise _UnsupportedShape()
+
+
+_PREFIXES = {
+    "k": unicode(KTBS.uri),
+    "rdfs": u"http://www.w3.org/2000/01/rdf-schema#",
+    "skos": unicode(SKOS),
+    "xsd": unicode(XSD),
+}
+
+_OBSEL_TERMS = {
+    "begin": (KTBS.hasBegin, XSD.integer),
+    "beginDT": (KTBS.hasBeginDT, XSD.dateTime),
+    "end": (KTBS.hasEnd, XSD.integer),
+    "endDT": (KTBS.hasEndDT, XSD.dateTime),
+    "hasSourceObsel": (KTBS.hasSourceObsel, "@id"),
+    "hasSubject": (KTBS.hasSubject, "@id"),
+    "hasTrace": (KTBS.hasTrace, "@id"),
+    "subject": (KTBS.hasSubject, None),
+    "label": (SKOS.prefLabel, None),
+    "additionalType": (RDF.type, "@id"),
+}
+
+_TYPE_TERMS = {
+    "Obsel": KTBS.Obsel,
+}
@@ -44,10 +44,6 @@ def main():
     # or command line configuration OPTIONS
     ktbs_config = parse_configuration_options(cmdline_options)
 
-    # TODO : remove this option ?
-    if ktbs_config.getboolean('server', 'resource-cache'):
-        LOG.warning("option --resource-cache is deprecated; it has no effect")
-
     apply_global_config(ktbs_config)
 
     LOG.info("KTBS pid: %d" % getpid())
@@ -136,8 +132,7 @@ def parse_configuration_options(options=None):
             config.set('rdf_database', 'force-init', 'true')
 
         if options.resource_cache is not None:
-            #config.set('server', 'resource-cache', options.resource_cache)
-            config.set('server', 'resource-cache', 'true')
+            config.set('server', 'resource-cache', options.resource_cache)
 
         if options.loggers is not None:
             config.set('logging', 'loggers', ' '.join(options.loggers))
@@ -188,11 +183,9 @@ def build_cmdline_options():
                    help="space separated list of allowed origins (requires the cors plugin)")
     ogr.add_option("--force-init", action="store_true",
                    help="Force initialization of repository (assumes -r)")
-    opt.add_option_group(ogr)
-
-    ogr = OptionGroup(opt, "Deprecated options")
     ogr.add_option("--resource-cache", action="store",
-                   help="not used anymore")
+                   help="keep serialized responses in a cache: "
+                   "'true', 'false' or a maximum number of bytes")
     opt.add_option_group(ogr)
     
     ogr = OptionGroup(opt, "Logging options")
@@ -41,6 +41,7 @@ implement the concerns of the server.
   classes provided in the `~rdfrest.cores.mixins`:mod: module.
 """
 from contextlib import contextmanager
+from copy import copy
 import traceback
 from weakref import WeakValueDictionary
 
@@ -59,6 +60,7 @@ from ..util import coerce_to_uri, Diagnosis, make_fresh_uri, ReadOnlyGraph, \
     urisplit
 from ..util.config import get_service_configuration, build_service_root_uri
 from ..util.config import apply_logging_config
+from ..util.staging_store import StagingStore
 
 
 NS = Namespace("tag:silex.liris.cnrs.fr.2012.08.06.rdfrest:")
@@ -83,6 +85,8 @@ class Service(object):
 
     root_uri (str), the URI of the root resource of this service
     store (rdflib.store.Store), the RDF store containing the data of this service
+    staged_from (Service), the service this one is a staging copy of, or None
+    (see `make_staging`:meth:)
     init_with, a callable to initialize the store if necessary (i.e. at
     least populate the root resource); it will be passed this service as
     its sole argument.
@@ -93,6 +97,8 @@ class Service(object):
     """
     # too few public methods (1/2) #pylint: disable=R0903
 
+    staged_from = None
+
     def __init__(self, classes, service_config=None, init_with=None):
         """I create a local RDF-REST service around the given store.
         """
@@ -153,11 +159,33 @@ class Service(object):
         register_service(self)
 
     def __del__(self):
+        if self.staged_from is not None:
+            return # staging copies are not registered
         try:
             unregister_service(self)
         except BaseException:
             pass
 
+    def make_staging(self):
+        """Return a staging copy of this service.
+
+        Resources obtained from the staging copy read the same data as
+        the resources of this service, but their changes are kept in a
+        `~rdfrest.util.staging_store.StagingStore`:class:
+        until ``staging.store.apply()`` is called.
+
+        This allows to prepare long-running changes
+        without modifying the store in the meantime,
+        then to write them all at once.
+        """
+        ret = copy(self)
+        ret.store = StagingStore(self.store)
+        ret.staged_from = self
+        # access to protected members #pylint: disable=W0212
+        ret._resource_cache = WeakValueDictionary()
+        ret._context_level = 0
+        return ret
+
     @HostedCore.handle_fragments
     def get(self, uri, rdf_types=None, _no_spawn=False):
         """Get a resource from this service.
@@ -563,7 +591,9 @@ class LocalCore(ILocalCore):
         I will first invoke :meth:`check_parameters`.
 
         The returned graph may have an attribute `redirected_to`, which is
-        used to inform :mod:`http_server` that it should perform a redirection.
+        used to inform :mod:`http_server` that it should perform a redirection,
+        and an attribute `stale`, which is used to inform :mod:`http_server`
+        that the state is known to be outdated.
         """
         self.check_parameters(parameters, parameters, "get_state")
         if __debug__:
@@ -63,6 +63,21 @@ class BookkeepingMixin(ILocalCore):
         # unused arg `parameter` #pylint: disable=W0613
         yield str(self.metadata.value(self.uri, RDFREST.etag))
 
+    def precompute_etags(self, parameters=None):
+        """I return the etags that `get_state`:meth: would produce, or None.
+
+        This is used by :mod:`rdfrest.http_server` to answer conditional
+        requests without building (nor serializing) the state.
+        None means that etags can not be known in advance.
+
+        This implementation only supports requests without parameters
+        (as some parameters may have side effects on `get_state`:meth:).
+        """
+        if parameters:
+            return None
+        self.force_state_refresh(None)
+        return list(self.iter_etags(None))
+
     @property
     def last_modified(self):
         """I return the time when this resource was last modified.
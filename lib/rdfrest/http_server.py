@@ -20,7 +20,10 @@ I implement a WSGI-based HTTP server
 wrapping a given :class:`.cores.local.Service`.
 """
 from bisect import insort
+from collections import OrderedDict
+from threading import Lock
 from time import time
+from urllib import quote
 
 from pyparsing import ParseException
 from rdflib import URIRef
@@ -44,6 +47,9 @@ import traceback
 
 LOG = getLogger(__name__)
 
+# characters that must not be percent-encoded when converting IRIs to URIs
+_URI_RESERVED = ":/?#[]@!$&'()*+,;=%~"
+
 class MyRequest(Request):
     """I override webob.Request by allowing weak etags.
     """
@@ -98,6 +104,9 @@ class HttpFrontend(object):
           accepts to serve or to consume.
         - max_triples (int): the maximum number of triples that this server
           accepts to serve or to consume.
+        - resource_cache: either a boolean, or the maximum number of bytes
+          of serialized responses to keep in a `ResponseCache`:class:
+          (see `parse_resource_cache`:func:).
         """
         # __init__ not called in mixin #pylint: disable=W0231
         # NB: strange, pylint should recognized it is a mixin...
@@ -120,6 +129,13 @@ class HttpFrontend(object):
         else:
             self.max_triples = None
 
+        cache_size = parse_resource_cache(
+            service_config.get('server', 'resource-cache'))
+        if cache_size:
+            self.response_cache = ResponseCache(cache_size)
+        else:
+            self.response_cache = None
+
         # HttpFrondend does not receive a dictionary any more
         # Other options should be explicitely set
         #self._options = options or {}
@@ -219,14 +235,6 @@ class HttpFrontend(object):
             # else we can be certain that the serializer exists, so:
             serializer, ext = get_serializer_by_content_type(ctype, rdf_type)
 
-        # get graph and redirect if needed
-        cache_bypass = params.pop("_", None) # dummy param used by JQuery to invalidate cache
-        graph = resource.get_state(params or None)
-        redirect = getattr(graph, "redirect_to", None)
-        if redirect is not None:
-            return self.issue_error(303, request, None,
-                                    location=redirect)
-
         # populate response header according to serializer
         if ctype[:5] == "text/":
             headerlist.append(("content-type", ctype+";charset=utf-8"))
@@ -236,6 +244,50 @@ class HttpFrontend(object):
             headerlist.append(("content-location",
                                str("%s.%s" % (resource.uri, ext))))
 
+        # check etags *before* building the graph, if possible
+        cache_bypass = params.pop("_", None) # dummy param used by JQuery to invalidate cache
+        response_cache = self.response_cache
+        precomputed = None
+        if (request.if_none_match or response_cache is not None) \
+        and not cache_bypass:
+            precompute_etags = getattr(resource, "precompute_etags", None)
+            if precompute_etags is not None:
+                precomputed = precompute_etags(params or None)
+                if precomputed:
+                    precomputed = [ taint_etag(i, ctype) for i in precomputed ]
+        if precomputed:
+            response = None
+            if any( i in request.if_none_match for i in precomputed ):
+                self._add_etag_headers(headerlist, precomputed)
+                self._add_last_modified_header(headerlist, resource)
+                response = MyResponse(status=304, headerlist=headerlist,
+                                      request=request) # Not Modified
+            elif response_cache is not None:
+                cache_key = (resource.uri, request.query_string, ctype)
+                cached = response_cache.get(cache_key, precomputed)
+                LOG.debug("response cache %s for <%s> %s",
+                          "miss" if cached is None else "hit",
+                          resource.uri, response_cache.stats())
+                if cached is not None:
+                    payload, cached_headers = cached
+                    self._add_etag_headers(headerlist, precomputed)
+                    self._add_last_modified_header(headerlist, resource)
+                    headerlist.extend(cached_headers)
+                    response = MyResponse(headerlist=headerlist,
+                                          app_iter=[payload])
+            if response is not None:
+                cache_control = self.cache_control(resource)
+                if cache_control:
+                    response.cache_control = cache_control
+                return response
+
+        # get graph and redirect if needed
+        graph = resource.get_state(params or None)
+        redirect = getattr(graph, "redirect_to", None)
+        if redirect is not None:
+            return self.issue_error(303, request, None,
+                                    location=redirect)
+
         # also insert etags, if available
         etag_list = getattr(graph, "etags", None)
         if etag_list is None:
@@ -243,24 +295,26 @@ class HttpFrontend(object):
             if iter_etags is not None:
                 etag_list = list(iter_etags(params or None))
         if etag_list:
-            etag_list = [ 'W/"%s"' % taint_etag(i, ctype)
-                          for i in etag_list ]
-            headerlist.append(("etag", etag_list[-1]))
-            headerlist.append(("x-etags", " ".join(etag_list)))
+            etag_list = [ taint_etag(i, ctype) for i in etag_list ]
+            self._add_etag_headers(headerlist, etag_list)
+
+        # warn the client if the state is known to be outdated
+        stale = getattr(graph, "stale", False)
+        if stale:
+            headerlist.append(("warning", '110 - "Response is Stale"'))
 
         # also insert last-modified, if available
-        last_modified = getattr(resource, "last_modified", None)
-        if last_modified is not None:
-            last_modified = datetime.fromtimestamp(last_modified, UTC)
-            headerlist.append(("last-modified", last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')))
+        self._add_last_modified_header(headerlist, resource)
 
         # also insert links (navigation and other) if available
         links = getattr(graph, "links", ())
+        link_headers = []
         for link in links:
             uri = link.pop('uri')
             link_props = ';'.join( '%s="%s"' % item for item in link.items() )
             link_val = ('<%s>;%s' % (uri, link_props)).encode('utf8')
-            headerlist.append(("link", link_val))
+            link_headers.append(("link", link_val))
+        headerlist.extend(link_headers)
 
         # check triples & bytes limitations and serialize
         if self.max_triples is not None  and  len(graph) > self.max_triples:
@@ -268,14 +322,20 @@ class HttpFrontend(object):
                                     "max_triple (%s) was exceeded"
                                     % self.max_triples )
         app_iter = serializer(graph, resource)
-        if self.max_bytes is not None:
+        # only cache the response if the precomputed etags were accurate
+        to_cache = (precomputed and response_cache is not None
+                    and precomputed == etag_list and not stale)
+        if self.max_bytes is not None or to_cache:
             # TODO LATER find a better way to guess the number of bytes?
             payload = "".join(app_iter)
-            if len(payload) >  self.max_bytes:
+            if self.max_bytes is not None and len(payload) >  self.max_bytes:
                 return self.issue_error(403, request, resource,
                                         "max_bytes (%s) was exceeded"
                                         % self.max_bytes )
             app_iter = [payload]
+            if to_cache:
+                response_cache.put((resource.uri, request.query_string, ctype),
+                                   precomputed, payload, link_headers)
 
         response = MyResponse(headerlist=headerlist, app_iter=app_iter)
 
@@ -289,6 +349,26 @@ class HttpFrontend(object):
         return response
 
 
+    @staticmethod
+    def _add_etag_headers(headerlist, etag_list):
+        """I add the etag and x-etags headers to `headerlist`.
+
+        :param etag_list: a non-empty list of (tainted) etags,
+          ordered by increasing stability
+        """
+        etag_list = [ 'W/"%s"' % i for i in etag_list ]
+        headerlist.append(("etag", etag_list[-1]))
+        headerlist.append(("x-etags", " ".join(etag_list)))
+
+    @staticmethod
+    def _add_last_modified_header(headerlist, resource):
+        """I add the last-modified header to `headerlist`, if available.
+        """
+        last_modified = getattr(resource, "last_modified", None)
+        if last_modified is not None:
+            last_modified = datetime.fromtimestamp(last_modified, UTC)
+            headerlist.append(("last-modified", last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')))
+
     def http_head(self, request, resource):
         """Process a HEAD request on the given resource.
         """
@@ -307,10 +387,17 @@ class HttpFrontend(object):
 
     def http_post(self, request, resource):
         """Process a POST request on the given resource.
+
+        If no RDF parser is available for the content-type of the request,
+        but `resource` has a ``post_lines`` method and lists the content-type
+        in its ``line_content_types`` attribute, the payload is passed to
+        ``post_lines`` line by line (see :meth:`_http_post_lines`).
         """
-        parser, _ = get_parser_by_content_type(request.content_type
-                                               or "text/turtle")
+        ctype = request.content_type or "text/turtle"
+        parser, _ = get_parser_by_content_type(ctype)
         if parser is None:
+            if ctype in getattr(resource, "line_content_types", ()):
+                return self._http_post_lines(request, resource, ctype)
             return self.issue_error(415, request, resource)
         if self.max_bytes is not None:
             length = request.content_length
@@ -340,6 +427,44 @@ class HttpFrontend(object):
             return MyResponse(content, status=201, headerlist=headerlist,
                                request=request) # Created
 
+    def _http_post_lines(self, request, resource, ctype):
+        """Process a POST request with a line-oriented payload.
+
+        The payload is not parsed as a whole, but streamed to the
+        ``post_lines`` method of `resource`, which must return a pair
+        (created, errors) -- see
+        :meth:`ktbs.engine.trace.StoredTrace.post_lines` for an example.
+
+        The response is a ``text/uri-list`` of the created resources,
+        where errors are reported as comment lines.
+        """
+        if self.max_bytes is not None:
+            length = request.content_length
+            if length is None:
+                return self.issue_error(411, request, resource) #length required
+            elif length > self.max_bytes:
+                return self.issue_error(413, request, resource,
+                                        "max_bytes (%s) was exceeded"
+                                        % self.max_bytes)
+        params = request.environ['rdfrest.parameters']
+        with self._service:
+            created, errors = resource.post_lines(request.body_file, ctype,
+                                                  params or None)
+        lines = [ unicode(r) for r in created ]
+        lines.extend( u"# line {}: {}".format(lineno, msg.replace("\n", " "))
+                      for lineno, msg in errors )
+        content = (u"\r\n".join(lines) + u"\r\n").encode("utf-8")
+        if not created:
+            return MyResponse(content, status=400, request=request)
+        headerlist = [
+            # header values must be ASCII, so the IRI is converted to a URI
+            ("location", quote(unicode(created[0]).encode("utf-8"),
+                               safe=_URI_RESERVED)),
+            ("content-type", "text/uri-list"),
+            ]
+        return MyResponse(content, status=201, headerlist=headerlist,
+                          request=request) # Created
+
     def http_put(self, request, resource):
         """Process a PUT request on the given resource.
 
@@ -458,6 +583,97 @@ def taint_etag(etag, ctype):
     return "%s/%s" % (ctype, etag)
     # TODO LATER make a more opaque (unreversible?) tainting operation?
 
+def parse_resource_cache(value):
+    """I parse the value of the ``resource-cache`` configuration option.
+
+    :return: the maximum number of bytes of the cache, or 0 if disabled
+
+    The value can be a boolean (``true`` uses a default size of 64 MiB)
+    or a number of bytes.
+    """
+    value = (value or "").strip().lower()
+    if value in ("", "0", "false", "no", "off"):
+        return 0
+    elif value in ("1", "true", "yes", "on"):
+        return 64 * 1024 * 1024
+    else:
+        return int(value)
+
+class ResponseCache(object):
+    """I keep serialized responses, within a maximum number of bytes.
+
+    Entries are keyed by (URI, query-string, content-type), and are only
+    valid as long as the (tainted) etags of the resource are unchanged.
+    Least recently used entries are evicted first.
+
+    I also count hits, misses and evictions (see `stats`:meth:).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, etags):
+        """I return the (payload, headers) cached for `key`, or None.
+
+        :param etags: the current etags of the resource; a cached response
+          with different etags is considered stale, and discarded
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                if entry[0] == etags:
+                    self._entries[key] = entry # now most recently used
+                    self.hits += 1
+                    return entry[1], entry[2]
+                self.size -= len(entry[1])
+            self.misses += 1
+            return None
+
+    def put(self, key, etags, payload, headers):
+        """I store `payload` and `headers` for `key`, with the given `etags`.
+        """
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            entries = self._entries
+            old = entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            entries[key] = (etags, payload, list(headers))
+            self.size += len(payload)
+            while self.size > self.max_bytes:
+                _, evicted = entries.popitem(last=False)
+                self.size -= len(evicted[1])
+                self.evictions += 1
+
+    def stats(self):
+        """I return a dict with my counters, size and number of entries.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": self.size,
+                "entries": len(self._entries),
+            }
+
+    def clear(self):
+        """I remove all entries (but keep the counters).
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
 class _TooManyTriples(Exception):
     """This exception class is used to abort edit context during PUT.
     """
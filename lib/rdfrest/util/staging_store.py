@@ -0,0 +1,155 @@
+#    This file is part of RDF-REST <http://champin.net/2012/rdfrest>
+#    Copyright (C) 2011-2012 Pierre-Antoine Champin <pchampin@liris.cnrs.fr> /
+#    Universite de Lyon <http://www.universite-lyon.fr>
+#
+#    RDF-REST is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Lesser General Public License as published
+#    by the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    RDF-REST is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU Lesser General Public License
+#    along with RDF-REST.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+I implement StagingStore,
+an rdflib store keeping the changes made to another store
+until they are applied.
+"""
+
+from rdflib import Graph
+from rdflib.store import Store
+
+class StagingStore(Store):
+    """
+    A store staging the changes made to an underlying store.
+
+    Reading this store returns the content of the underlying store,
+    altered by the changes staged so far.
+    Those changes only reach the underlying store when `apply` is called.
+
+    Only named graphs are supported (every operation requires a context).
+    """
+
+    context_aware = True
+    formula_aware = False
+    transaction_aware = False
+
+    def __init__(self, base):
+        Store.__init__(self)
+        self.base = base
+        self._added = {}    # context identifier -> Graph of added triples
+        self._removed = {}  # context identifier -> set of removed triples
+        self._base_graphs = {}
+
+    def apply(self):
+        """Write the staged changes into the underlying store.
+
+        Note that the changes are applied as they were staged,
+        regardless of any change made in the meantime to the underlying store.
+        """
+        for cid, removed in self._removed.iteritems():
+            graph = self._get_base_graph(cid)
+            for triple in removed:
+                graph.remove(triple)
+        for cid, added in self._added.iteritems():
+            graph = self._get_base_graph(cid)
+            graph.addN( (s, p, o, graph) for s, p, o in added )
+        self._added.clear()
+        self._removed.clear()
+
+    def add(self, triple, context, quoted=False):
+        """Stage the addition of a triple.
+        """
+        assert not quoted, "StagingStore is not formula-aware"
+        Store.add(self, triple, context, quoted)
+        cid = context.identifier
+        removed = self._removed.get(cid)
+        if removed and triple in removed:
+            removed.discard(triple)
+        elif triple not in self._get_base_graph(cid):
+            added = self._added.get(cid)
+            if added is None:
+                added = self._added[cid] = Graph(identifier=cid)
+            added.add(triple)
+
+    def remove(self, triple, context=None):
+        """Stage the removal of the triples matching a pattern.
+        """
+        # signature differs from overriden method #pylint: disable=W0221
+        assert context is not None, "StagingStore requires a context"
+        Store.remove(self, triple, context)
+        cid = context.identifier
+        added = self._added.get(cid)
+        if added is not None:
+            added.remove(triple)
+        matching = list(self._get_base_graph(cid).triples(triple))
+        if matching:
+            self._removed.setdefault(cid, set()).update(matching)
+
+    def triples(self, triple, context=None):
+        """Iter over the triples of a context matching a pattern.
+        """
+        assert context is not None, "StagingStore requires a context"
+        cid = context.identifier
+        contexts = (context,)
+        removed = self._removed.get(cid, ())
+        for i, _ in self.base.triples(triple, self._get_base_graph(cid)):
+            if i not in removed:
+                yield i, iter(contexts)
+        added = self._added.get(cid)
+        if added is not None:
+            for i in added.triples(triple):
+                yield i, iter(contexts)
+
+    def __len__(self, context=None):
+        """Number of statements in a context.
+        """
+        assert context is not None, "StagingStore requires a context"
+        cid = context.identifier
+        return (len(self._get_base_graph(cid))
+                - len(self._removed.get(cid, ()))
+                + len(self._added.get(cid, ())))
+
+    def contexts(self, triple=None):
+        """Iter over the contexts (containing `triple`, if provided).
+        """
+        if triple is not None:
+            return ( Graph(self, cid) for cid in self._iter_context_ids()
+                     if triple in Graph(self, cid) )
+        return ( Graph(self, cid) for cid in self._iter_context_ids() )
+
+    def bind(self, prefix, namespace):
+        self.base.bind(prefix, namespace)
+
+    def namespace(self, prefix):
+        return self.base.namespace(prefix)
+
+    def prefix(self, namespace):
+        return self.base.prefix(namespace)
+
+    def namespaces(self):
+        return self.base.namespaces()
+
+    def _get_base_graph(self, cid):
+        """Return the graph `cid` of the underlying store.
+        """
+        ret = self._base_graphs.get(cid)
+        if ret is None:
+            ret = self._base_graphs[cid] = Graph(self.base, cid)
+        return ret
+
+    def _iter_context_ids(self):
+        """Iter over the identifiers of all the contexts of this store.
+        """
+        seen = set()
+        for ctx in self.base.contexts():
+            seen.add(ctx.identifier)
+            yield ctx.identifier
+        for cid, added in self._added.items():
+            if cid not in seen and len(added):
+                yield cid
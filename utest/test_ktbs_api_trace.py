@@ -29,6 +29,7 @@ from rdflib import URIRef, XSD
 
 from rdfrest.exceptions import InvalidDataError
 
+from ktbs.api import trace_obsels
 from ktbs.engine.service import make_ktbs
 from ktbs.namespace import KTBS
 
@@ -100,6 +101,28 @@ class _TestIterObselsMixin(object):
         assert [self.o4, self.o2] == \
             self.t.list_obsels(begin=5, end=45, reverse=True, bgp=bgp)
 
+    def test_otypes(self):
+        ot2_obsels = [ i for i in self.obsels if i in (self.o0, self.o2, self.o4) ]
+        assert ot2_obsels == self.t.list_obsels(otypes=[self.ot2])
+        assert ot2_obsels == self.t.list_obsels(otypes=[self.ot2.uri])
+        # OT2 is a subtype of OT1
+        assert self.obsels == self.t.list_obsels(otypes=[self.ot1])
+        assert ot2_obsels[1:2] == \
+            self.t.list_obsels(otypes=[self.ot2], limit=1, offset=1)
+
+    def test_bgp_prepared_once(self):
+        bgp = """
+            ?obs a m:OT2.
+        """
+        self.t.list_obsels(bgp=bgp)
+        query_str = trace_obsels._BGP_SELECT % bgp
+        cached = [ key for key in trace_obsels._PREPARED_QUERIES
+                   if key[0] == query_str ]
+        assert len(cached) == 1
+        query = trace_obsels._PREPARED_QUERIES[cached[0]]
+        self.t.list_obsels(begin=5, bgp=bgp)
+        assert trace_obsels._PREPARED_QUERIES[cached[0]] is query
+
 class TestIterObsels(_TestIterObselsMixin, KtbsTestCase):
 
     def setup(self):
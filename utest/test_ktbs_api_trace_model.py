@@ -278,6 +278,26 @@ class TestKtbsTraceModel(RelAndAttTypeMixin, KtbsTestCase):
         self.model.remove_parent(parent_model.uri)
         assert self.model.parents == []
 
+    def test_obsel_type_closure(self):
+        parent_model = self.base.create_model()
+        self.model.add_parent(parent_model)
+        ot1 = parent_model.create_obsel_type("#OT1")
+        ot2 = self.model.create_obsel_type("#OT2", [ot1])
+        ot3 = self.model.create_obsel_type("#OT3", [ot2])
+        closure = self.model.obsel_type_closure
+        assert closure[ot1.uri] == {ot1.uri, ot2.uri, ot3.uri}
+        assert closure[ot2.uri] == {ot2.uri, ot3.uri}
+        assert closure[ot3.uri] == {ot3.uri}
+        assert self.model.obsel_type_closure is closure # cached
+        assert self.model.expand_obsel_types(["#OT2", "#OTHER"]) == \
+            {ot2.uri, ot3.uri, self.model.uri + "#OTHER"}
+
+        # changing the parent model must invalidate the cache
+        ot0 = parent_model.create_obsel_type("#OT0")
+        ot1.add_supertype(ot0)
+        closure = self.model.obsel_type_closure
+        assert closure[ot0.uri] == {ot0.uri, ot1.uri, ot2.uri, ot3.uri}
+
     ######## add obsel types ########
 
     def test_create_obsel_type_no_id_no_label(self):
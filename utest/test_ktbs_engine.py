@@ -23,7 +23,7 @@ from pytest import raises as assert_raises
 from threading import Thread
 from wsgiref.simple_server import make_server
 
-from rdflib import BNode, Graph, Literal, RDF, RDFS, URIRef
+from rdflib import BNode, Graph, Literal, RDF, RDFS, URIRef, XSD
 
 from datetime import datetime, timedelta
 from rdfrest.exceptions import CanNotProceedError, InvalidDataError, \
@@ -32,13 +32,18 @@ from rdfrest.cores.factory import unregister_service
 from rdfrest.cores.local import LocalCore
 from rdfrest.cores.http_client import HttpClientCore
 from rdfrest.http_server import HttpFrontend
+from webob import Request
 from rdfrest.util.iso8601 import UTC
 from ktbs.api.ktbs_root import KtbsRootMixin
+from ktbs.engine.obsel import get_obsel_bounded_description, \
+    get_obsels_bounded_descriptions
 from ktbs.engine.resource import METADATA
 from ktbs.engine.service import KtbsService
 from ktbs.methods.filter import LOG as FILTER_LOG
 from ktbs.namespace import KTBS
+from ktbs.serpar.csv_serializers import iter_csv_rows
 from ktbs.time import lit2datetime
+from ktbs.utils import SKOS
 from ktbs.config import get_ktbs_configuration
 from ktbs.engine.service import make_ktbs
 from .utils import StdoutHandler
@@ -420,6 +425,107 @@ class TestKtbs(KtbsTestCase):
         with assert_raises(InvalidDataError):
             created_homonymic = trace.post_graph(graph2)
 
+    def test_mint_obsel_uris(self):
+        base = self.my_ktbs.create_base()
+        model = base.create_model()
+        otype = model.create_obsel_type("#MyObsel")
+        trace = base.create_stored_trace(None, model, "1970-01-01T00:00:00Z",
+                                         "alice")
+        # a client-provided id conflicting with the next minted one
+        trace.create_obsel("o-000002", otype, 0)
+        uris = [ trace.create_obsel(None, otype, i).uri for i in range(3) ]
+        graph = Graph()
+        obs = BNode()
+        graph.add((obs, KTBS.hasTrace, trace.uri))
+        graph.add((obs, RDF.type, otype.uri))
+        graph.add((obs, KTBS.hasBegin, Literal(3)))
+        graph.add((obs, SKOS.prefLabel, Literal("Foo Bar")))
+        uris.extend(trace.post_graph(graph))
+        assert uris == [ URIRef(trace.uri + i) for i in [
+            "o-000001", "o-000003", "o-000004", "foo-bar-000001",
+        ]]
+
+    def test_post_lines_ndjson(self):
+        base = self.my_ktbs.create_base()
+        model = base.create_model()
+        otype1 = model.create_obsel_type("#MyObsel1")
+        trace = base.create_stored_trace(None, model, "1970-01-01T00:00:00Z",
+                                         "alice")
+        old_tag = trace.obsel_collection.str_mon_tag
+        lines = [
+            '{"@id": "o1", "@type": "m:MyObsel1", "begin": 1, "end": 2}',
+            '',
+            '{"@type": "m:MyObsel1", "begin": 3, "m:foo": "bar"}',
+            '{"@id": "o1", "@type": "m:MyObsel1", "begin": 4}',
+            'this is not JSON',
+            '["not", "an", "obsel"]',
+        ]
+        created, errors = trace.post_lines(lines, "application/x-ndjson")
+        assert len(created) == 2
+        assert created[0] == URIRef(trace.uri + "o1")
+        assert [ lineno for lineno, _ in errors ] == [4, 5, 6]
+        obs2 = trace.get_obsel(created[1])
+        assert obs2.begin == 3
+        assert obs2.end == 3
+        assert obs2.obsel_type == otype1
+        assert obs2.get_attribute_value(URIRef(model.uri + "#foo")) \
+            == "bar"
+        assert len(trace.obsels) == 2
+        assert trace.obsel_collection.str_mon_tag == old_tag
+
+        # non-ASCII ids
+        created, errors = trace.post_lines(
+            [u'{"@id": "\xe9", "@type": "m:MyObsel1", "begin": 5}'],
+            "application/x-ndjson")
+        assert created == [URIRef(trace.uri + u"\xe9")]
+        assert errors == []
+
+    def test_post_lines_http(self):
+        base = self.my_ktbs.create_base()
+        model = base.create_model()
+        model.create_obsel_type("#MyObsel1")
+        trace = base.create_stored_trace(None, model, "1970-01-01T00:00:00Z",
+                                         "alice")
+        app = HttpFrontend(self.service, get_ktbs_configuration())
+        body = u"\n".join([
+            u'{"@id": "\xe9", "@type": "m:MyObsel1", "begin": 1}',
+            u'{"@id": "\xe9", "@type": "m:MyObsel1", "begin": 2}',
+        ]).encode("utf-8")
+        request = Request.blank(str(trace.uri), method="POST", body=body,
+                                content_type="application/x-ndjson")
+        response = request.get_response(app)
+        assert response.status_int == 201
+        assert response.headers["location"] == str(trace.uri) + "%C3%A9"
+        lines = response.body.decode("utf-8").splitlines()
+        assert lines[0] == unicode(trace.uri) + u"\xe9"
+        assert lines[1].startswith(u"# line 2: ")
+        assert len(trace.obsels) == 1
+
+    def test_post_lines_ntriples(self):
+        base = self.my_ktbs.create_base()
+        model = base.create_model()
+        otype1 = model.create_obsel_type("#MyObsel1")
+        trace = base.create_stored_trace(None, model, "1970-01-01T00:00:00Z",
+                                         "alice")
+        tpl = '<{0}> <{1}> {2} .'
+        lines = [
+            tpl.format(trace.uri + "o1", RDF.type, otype1.uri.n3()),
+            tpl.format(trace.uri + "o1", KTBS.hasBegin, '"1"^^<%s>'
+                       % XSD.integer),
+            '# a comment',
+            tpl.format(trace.uri + "o1", KTBS.hasTrace, trace.uri.n3()),
+            '_:b <%s> <%s> .' % (RDF.type, otype1.uri),
+            '_:b <%s> <%s> .' % (KTBS.hasTrace, trace.uri),
+            '_:b <%s> "2"^^<%s> .' % (KTBS.hasBegin, XSD.integer),
+            'not a triple',
+        ]
+        created, errors = trace.post_lines(lines, "application/n-triples")
+        assert len(created) == 2
+        assert created[0] == URIRef(trace.uri + "o1")
+        assert isinstance(created[1], URIRef)
+        assert [ lineno for lineno, _ in errors ] == [8]
+        assert [ o.begin for o in trace.obsels ] == [1, 2]
+
     def test_lineage(self):
         b = self.my_ktbs.create_base()
         model = b.create_model()
@@ -624,6 +730,49 @@ class TestObsels(KtbsTestCase):
         o2.delete()
         assert log_mon_tag != t.obsel_collection.log_mon_tag
 
+    def test_obsels_bounded_descriptions(self):
+        t = self.trace
+        ot = self.ot
+        rel = URIRef(self.model.uri + "#rel")
+        o1 = t.create_obsel("o1", ot, 10, 20)
+        o2 = t.create_obsel("o2", ot, 5, 20, relations=[(rel, o1)])
+        o3 = t.create_obsel("o3", ot, 0, 3, inverse_relations=[(rel, o2)])
+        state = t.obsel_collection.state
+        nodes = [o3.uri, o2.uri]
+        batch = get_obsels_bounded_descriptions(nodes, state)
+        expected = Graph()
+        for node in nodes:
+            get_obsel_bounded_description(node, state, expected)
+        assert set(batch) == set(expected)
+        assert (o1.uri, KTBS.hasTrace, t.uri) in batch
+        assert (o1.uri, KTBS.hasBegin, None) not in batch
+        page = t.obsel_collection.get_state({"limit": "2"})
+        for triple in batch:
+            assert triple in page
+
+    def test_csv_rows(self):
+        t = self.trace
+        ot = self.ot
+        at2 = URIRef(self.model.uri + "#at2")
+        o1 = t.create_obsel("o1", ot, 10, 20, attributes={at2: Literal(1)})
+        o2 = t.create_obsel("o2", ot, 0, 3, source_obsels=[o1])
+        o3 = t.create_obsel("o3", ot, 3, 3, attributes={at2: Literal(7)})
+        state = t.obsel_collection.state
+        otu = unicode(ot.uri)
+        assert list(iter_csv_rows(t.uri, state)) == [
+            [u"id", u"type", u"begin", u"end", u"at2", u"sourceObsel"],
+            [o2.uri, otu, u"0", u"3", u"", unicode(o1.uri)],
+            [o3.uri, otu, u"3", u"3", u"7", u""],
+            [o1.uri, otu, u"10", u"20", u"1", u""],
+        ]
+        assert list(iter_csv_rows(t.uri, state,
+                                  columns=[at2, KTBS.hasEnd])) == [
+            [u"id", u"at2", u"end"],
+            [o2.uri, u"", u"3"],
+            [o3.uri, u"7", u"3"],
+            [o1.uri, u"1", u"20"],
+        ]
+
 
 class TestKtbsSynthetic(KtbsTestCase):
 
@@ -631,7 +780,7 @@ class TestKtbsSynthetic(KtbsTestCase):
         my_ktbs = self.my_ktbs
         with assert_raises(MethodNotAllowedError):
             my_ktbs.delete()
-        assert len(my_ktbs.builtin_methods) == 6
+        assert len(my_ktbs.builtin_methods) == 7
         assert my_ktbs.bases == []
         base = my_ktbs.create_base(label="My new base")
         print "--- base:", base
@@ -1,10 +1,27 @@
 from test_ktbs_engine import KtbsTestCase
+from os.path import exists
+from subprocess import Popen
+from threading import Event, Thread
+from time import sleep, time
 from unittest import skipUnless
 from pytest import raises as assert_raises
 
+import posix_ipc
+from webob import Request
+
+from rdfrest.exceptions import CanNotProceedError
+from rdfrest.http_server import HttpFrontend
+from ktbs.config import get_ktbs_configuration
 from ktbs.engine.lock import WithLockMixin
-from ktbs.engine.lock import get_semaphore_name
+from ktbs.engine.lock import get_semaphore_name, single_flight, \
+    _get_flight_owner_path, _get_flight_semaphore
 from ktbs.engine.service import make_ktbs
+from ktbs.engine.trace_obsels import set_refresh_scheduler
+from ktbs.engine.trace_stats import NS as STATS
+from ktbs.engine.resource import METADATA
+from ktbs.namespace import KTBS
+from ktbs.plugins.background_refresh import RefreshScheduler
+from rdflib import Graph, Literal, RDF, RDFS, URIRef
 
 
 class TestKtbsTraceObsels(KtbsTestCase):
@@ -33,9 +50,13 @@ class TestKtbsTraceObsels(KtbsTestCase):
 
         def get_etags(**params):
             if not params:
-                return list(oc.iter_etags())
+                ret = list(oc.iter_etags())
+                assert oc.precompute_etags() == ret
             else:
-                return oc.get_state(params).etags
+                precomputed = oc.precompute_etags(dict(params))
+                ret = oc.get_state(params).etags
+                assert precomputed == ret
+            return ret
 
         assert get_etags() == [ etag ]
         assert get_etags(limit=100) == [etag,]
@@ -55,3 +76,583 @@ class TestKtbsTraceObsels(KtbsTestCase):
         assert get_etags(before=self.obsels[3]) == [etag, mstag,]
         assert get_etags(before=self.obsels[4]) == [etag, mstag,]
         assert get_etags(after=self.obsels[-1]) == [etag,]
+        assert get_etags(after=self.obsels[2], limit=1) == [etag, mstag,]
+        assert get_etags(minb=3000, reverse="yes") == [etag,]
+        assert get_etags(maxe=500) == [etag, mstag, pstag,]
+        assert oc.precompute_etags({"refresh": "force"}) is None
+
+    def test_precomputed_slice_keys(self):
+        oc = self.trace.obsel_collection
+        calls = []
+        iter_slice_keys = oc._iter_slice_keys
+        def counting_iter_slice_keys(*args, **kw):
+            calls.append(args)
+            return iter_slice_keys(*args, **kw)
+        oc._iter_slice_keys = counting_iter_slice_keys
+
+        # keys looked up by precompute_etags are reused by get_state
+        oc.precompute_etags({"limit": "2"})
+        graph = oc.get_state({"limit": "2"})
+        assert len(calls) == 1
+        assert len(list(graph.subjects(KTBS.hasTrace, self.trace.uri))) == 2
+
+        # but not for other parameters
+        oc.precompute_etags({"limit": "2"})
+        oc.get_state({"limit": "3"})
+        assert len(calls) == 3
+
+        # nor if the collection has changed in between
+        oc.precompute_etags({"limit": "2"})
+        self.trace.create_obsel('o-1', self.ot, -100, -50)
+        graph = oc.get_state({"limit": "2"})
+        assert len(calls) == 5
+        assert URIRef(self.trace.uri + "o-1") in set(
+            graph.subjects(KTBS.hasTrace, self.trace.uri))
+
+    def test_temporal_index_slices(self):
+        t = self.trace
+        # add obsels with same end and various begins
+        t.create_obsel('p0', self.ot, 2500, 3000)
+        t.create_obsel('p1', self.ot, 2000, 3000)
+        t.create_obsel('p2', self.ot, 3000, 3000)
+        oc = t.obsel_collection
+        o1, o3 = self.obsels[1].uri, self.obsels[3].uri
+        for params in [
+            {},
+            {'reverse': True},
+            {'begin': 1000},
+            {'end': 3000},
+            {'begin': 1500, 'end': 3000},
+            {'mine': 2500, 'maxb': 2500},
+            {'after': o1},
+            {'before': o3, 'reverse': True},
+            {'after': o1, 'before': o3},
+            {'limit': 2, 'offset': 1},
+            {'limit': 2, 'offset': 1, 'reverse': True},
+            {'after': t.uri + 'o0', 'limit': 3},
+            {'after': t.uri + 'no-such-obsel'},
+        ]:
+            got = list(oc.iter_obsel_keys(**params))
+            params.setdefault('maxb', None)
+            params.setdefault('mine', None)
+            for key in ('begin', 'end', 'after', 'before', 'reverse',
+                        'limit', 'offset'):
+                params.setdefault(key, None)
+            expected = list(oc._iter_obsel_keys_sparql(**params))
+            assert got == expected, params
+
+    def test_temporal_index_maintenance(self):
+        t = self.trace
+        oc = t.obsel_collection
+        index = oc.get_temporal_index()
+        assert len(index) == 5
+        assert index.etag == oc.etag
+
+        # adding obsels maintains the index
+        t.create_obsel('o5', self.ot, 5000)
+        assert oc.get_temporal_index() is index
+        assert index.etag == oc.etag
+        assert index.get_last_key() == (5000, 5000, t.uri + 'o5')
+
+        # other modifications require to rebuild the index
+        with oc.edit(_trust=True) as editable:
+            editable.remove((t.uri + 'o5', None, None))
+        index2 = oc.get_temporal_index()
+        assert index2 is not index
+        assert len(index2) == 5
+        assert index2.get_last_key() == (4000, 4000, t.uri + 'o4')
+
+    def test_last_obsel_key(self):
+        t = self.trace
+        oc = t.obsel_collection
+        assert oc.get_last_obsel_key() == (4000, 4000, self.obsels[4].uri)
+
+        t.create_obsel('long', self.ot, 500, 4000)
+        assert oc.get_last_obsel_key() == (4000, 4000, self.obsels[4].uri)
+        t.create_obsel('o5', self.ot, 4500, 5000)
+        assert oc.get_last_obsel_key() == (5000, 4500, t.uri + 'o5')
+
+        # removing the last obsel is not monotonic
+        with oc.edit(_trust=True) as editable:
+            editable.remove((t.uri + 'o5', None, None))
+        assert oc.get_last_obsel_key() == (4000, 4000, self.obsels[4].uri)
+        with oc.edit(_trust=True) as editable:
+            editable.remove((self.obsels[4].uri, None, None))
+        assert oc.get_last_obsel_key() == (4000, 500, t.uri + 'long')
+
+        oc.delete()
+        assert oc.get_last_obsel_key() is None
+
+    def test_statistics(self):
+        t = self.trace
+        oc = t.obsel_collection
+        ot2 = self.model.create_obsel_type("#OT2")
+        stats = oc.get_statistics()
+        assert stats == oc._compute_statistics()
+        assert stats == {
+            "count": 5,
+            "types": { unicode(self.ot.uri): 5 },
+            "minb": 0,
+            "maxe": 4000,
+        }
+
+        # adding obsels updates the stored statistics without recomputing them
+        t.create_obsel('o5', ot2, 4500, 6000)
+        oc._compute_statistics = None # must not be called
+        stats = oc.get_statistics()
+        del oc._compute_statistics
+        assert stats == oc._compute_statistics()
+        assert stats["count"] == 6
+        assert stats["types"][unicode(ot2.uri)] == 1
+        assert stats["maxe"] == 6000
+
+        # non-monotonic changes invalidate the stored statistics
+        with oc.edit(_trust=True) as editable:
+            editable.remove((t.uri + 'o0', None, None))
+        stats = oc.get_statistics()
+        assert stats["count"] == 5
+        assert stats["minb"] == 1000
+
+        tstats = t.trace_statistics.state
+        assert tstats.value(t.uri, STATS.obselCount).toPython() == 5
+        assert tstats.value(t.uri, STATS.duration).toPython() == 5000
+
+    def test_add_obsel_graphs(self):
+        # each batch is a list of (id, begin, end, related obsel id),
+        # followed by the expected (str_mon, pse_mon, last obsel)
+        batches = [
+            ([("n0", 5000, 5000, None), ("n1", 6000, 6000, "n0")],
+             (False, True, "n1")),
+            ([("n0", 5000, 5000, None), ("n1", 4500, 4500, None)],
+             (False, True, "n0")),
+            ([("n0", 3500, 4500, None), ("n1", 6000, 6000, None)],
+             (True, True, "n1")),
+            ([("n0", 1000, 1000, None)],
+             (False, False, "o4")),
+            ([("n0", 5000, 5000, "o1")],
+             (False, False, "n0")),
+            ([("n0", 5000, 5000, None), ("n1", 6000, 6000, "o3")],
+             (False, True, "n1")),
+            ([("n0", 4000, 4000, None)],
+             (False, True, "o4")),
+            ([("p", 4000, 4000, None), ("q", 4000, 4000, None)],
+             (True, True, "q")),
+        ]
+        ot = self.ot
+        for i, (batch, expected) in enumerate(batches):
+            for batched in (False, True):
+                t = self.base.create_stored_trace("t%s%s/" % (i, batched),
+                                                  self.model,
+                                                  origin="1970-01-01T00:00:00Z")
+                t.pseudomon_range = 2000
+                for j in range(5):
+                    t.create_obsel('o%s' % j, ot, 1000 * j)
+                oc = t.obsel_collection
+                old_tags = (oc.str_mon_tag, oc.pse_mon_tag, oc.log_mon_tag)
+
+                graphs = []
+                for oid, begin, end, related in batch:
+                    obs = URIRef(t.uri + oid)
+                    graph = Graph()
+                    graph.add((obs, KTBS.hasTrace, t.uri))
+                    graph.add((obs, RDF.type, ot.uri))
+                    graph.add((obs, KTBS.hasBegin, Literal(begin)))
+                    graph.add((obs, KTBS.hasEnd, Literal(end)))
+                    if related:
+                        graph.add((obs, RDFS.seeAlso, URIRef(t.uri + related)))
+                    graphs.append(graph)
+                if batched:
+                    oc.add_obsel_graphs(iter(graphs))
+                else:
+                    for graph in graphs:
+                        oc.add_obsel_graph(graph)
+
+                assert oc.log_mon_tag == old_tags[2]
+                last = oc.metadata.value(oc.uri, METADATA.last_obsel)
+                result = (oc.str_mon_tag == old_tags[0],
+                          oc.pse_mon_tag == old_tags[1],
+                          last[len(t.uri):])
+                assert result == expected, (batch, batched)
+
+    def test_earliest_change(self):
+        t = self.trace
+        oc = t.obsel_collection
+        tag0 = oc.str_mon_tag
+        assert oc.get_earliest_change(tag0) is None # nothing changed
+
+        t.create_obsel('o5', self.ot, 5000)
+        assert oc.str_mon_tag == tag0 # strictly monotonic
+        t.create_obsel('late', self.ot, 3500)
+        tag1 = oc.str_mon_tag
+        assert oc.get_earliest_change(tag0) == 3500
+        t.create_obsel('later', self.ot, 2500, 4500)
+        assert oc.get_earliest_change(tag1) == 4500
+        assert oc.get_earliest_change(tag0) == 3500
+        assert oc.get_earliest_change("unknown") is None
+
+        # removing obsels from a timestamp keeps the temporal index
+        tag2 = oc.str_mon_tag
+        index = oc.get_temporal_index()
+        oc.remove_obsels_from(3000)
+        assert oc.get_temporal_index() is index
+        assert [ key[2] for key in oc.iter_obsel_keys() ] == \
+            [ obs.uri for obs in self.obsels[:3] ]
+        assert oc.get_last_obsel_key() == (2000, 2000, self.obsels[2].uri)
+        assert oc.get_earliest_change(tag2) == 3000
+        assert oc.get_earliest_change(tag0) == 3000
+
+        # other modifications make the earliest change unknown
+        tag3 = oc.str_mon_tag
+        with oc.edit(_trust=True) as editable:
+            editable.remove((self.obsels[2].uri, None, None))
+        assert oc.get_earliest_change(tag3) is None
+        assert oc.get_earliest_change(tag0) is None
+
+
+class TestBackgroundRefresh(KtbsTestCase):
+    """Test the background recomputation of computed traces."""
+
+    def setup(self):
+        super(TestBackgroundRefresh, self).setup()
+        self.base = b = self.my_ktbs.create_base("b/")
+        self.model = m = b.create_model("m")
+        self.ot = ot = m.create_obsel_type("#OT1")
+        self.trace = t = b.create_stored_trace("t/", m,
+                                               origin="1970-01-01T00:00:00Z")
+        for i in range(5):
+            t.create_obsel('o%s' % i, ot, 1000 * i)
+        self.ctr = ctr = b.create_computed_trace("ctr/", KTBS.filter, {},
+                                                 [t])
+        assert len(ctr.obsels) == 5
+        self.scheduler = RefreshScheduler(0.2, 5)
+        self.scheduler.start()
+        set_refresh_scheduler(self.scheduler)
+
+    def teardown(self):
+        set_refresh_scheduler(None)
+        self.scheduler.stop()
+        super(TestBackgroundRefresh, self).teardown()
+
+    def count_obsels(self, graph):
+        return len(set(graph.subjects(KTBS.hasTrace, self.ctr.uri)))
+
+    def test_stale_while_revalidate(self):
+        oc = self.ctr.obsel_collection
+        self.trace.create_obsel('o5', self.ot, 5000)
+        assert self.scheduler.is_pending(oc.uri)
+        graph = oc.get_state()
+        assert graph.stale
+        assert self.count_obsels(graph) == 5
+        assert oc.precompute_etags() is None
+        graph = oc.get_state({"limit": "2", "reverse": "1"})
+        assert graph.stale
+        assert self.count_obsels(graph) == 2
+        assert URIRef(self.ctr.uri + "o4") in set(graph.subjects())
+
+        assert self.scheduler.wait_idle(5)
+        graph = oc.get_state()
+        assert not getattr(graph, "stale", False)
+        assert self.count_obsels(graph) == 6
+
+    def test_forced_refresh(self):
+        oc = self.ctr.obsel_collection
+        self.trace.create_obsel('o5', self.ot, 5000)
+        graph = oc.get_state({"refresh": "force"})
+        assert not getattr(graph, "stale", False)
+        assert self.count_obsels(graph) == 6
+
+    def test_debounce(self):
+        impl = self.ctr._method_impl
+        calls = []
+        def compute_obsels(computed_trace, from_scratch=False):
+            calls.append(computed_trace.uri)
+            return type(impl).compute_obsels(impl, computed_trace,
+                                             from_scratch)
+        impl.compute_obsels = compute_obsels
+        try:
+            for i in range(5, 10):
+                self.trace.create_obsel('o%s' % i, self.ot, 1000 * i)
+            assert self.scheduler.wait_idle(5)
+        finally:
+            del impl.compute_obsels
+        assert calls == [self.ctr.uri]
+        assert self.count_obsels(self.ctr.obsel_collection.get_state()) == 10
+
+    def test_modifications_during_recomputation(self):
+        oc = self.ctr.obsel_collection
+        impl = self.ctr._method_impl
+        started, proceed = Event(), Event()
+        services = []
+        def compute_obsels(computed_trace, from_scratch=False):
+            services.append(computed_trace.service)
+            started.set()
+            proceed.wait(5)
+            return type(impl).compute_obsels(impl, computed_trace,
+                                             from_scratch)
+        impl.compute_obsels = compute_obsels
+        try:
+            self.trace.create_obsel('o5', self.ot, 5000)
+            assert started.wait(5)
+            # the computation neither locks the base nor modifies the store
+            self.trace.create_obsel('o6', self.ot, 6000)
+            graph = oc.get_state()
+            assert graph.stale
+            assert self.count_obsels(graph) == 5
+            assert self.count_obsels(Graph(self.service.store, oc.uri)) == 5
+            proceed.set()
+            assert self.scheduler.wait_idle(5)
+        finally:
+            del impl.compute_obsels
+        assert services[0].staged_from is self.service
+        assert self.count_obsels(oc.get_state()) == 7
+
+    def test_stale_warning_header(self):
+        app = HttpFrontend(self.service, get_ktbs_configuration())
+        uri = str(self.ctr.obsel_collection.uri)
+        self.trace.create_obsel('o5', self.ot, 5000)
+        response = Request.blank(uri, accept="text/turtle").get_response(app)
+        assert response.status_int == 200
+        assert response.headers.get("warning") == '110 - "Response is Stale"'
+
+        assert self.scheduler.wait_idle(5)
+        response = Request.blank(uri, accept="text/turtle").get_response(app)
+        assert response.status_int == 200
+        assert "warning" not in response.headers
+
+
+class TestComputedTraceRefresh(KtbsTestCase):
+    """Test the refreshing of computed traces depending on each other."""
+
+    def setup(self):
+        super(TestComputedTraceRefresh, self).setup()
+        self.base = b = self.my_ktbs.create_base("b/")
+        self.model = m = b.create_model("m")
+        self.ot = ot = m.create_obsel_type("#OT1")
+        self.trace = t = b.create_stored_trace("t/", m,
+                                               origin="1970-01-01T00:00:00Z")
+        t.create_obsel('o0', ot, 0)
+        # a diamond: d depends on b1 and b2, which both depend on a
+        self.a = a = b.create_computed_trace("a/", KTBS.filter, {}, [t])
+        self.b1 = b1 = b.create_computed_trace("b1/", KTBS.filter, {}, [a])
+        self.b2 = b2 = b.create_computed_trace("b2/", KTBS.filter, {}, [a])
+        self.d = b.create_computed_trace("d/", KTBS.fusion, {}, [b1, b2])
+
+    def check_computations(self, parameters, expected):
+        impl = self.a._method_impl
+        fusion_impl = self.d._method_impl
+        calls = []
+        def wrap(impl):
+            def compute_obsels(computed_trace, from_scratch=False):
+                calls.append(computed_trace.uri[len(self.base.uri):])
+                return type(impl).compute_obsels(impl, computed_trace,
+                                                 from_scratch)
+            impl.compute_obsels = compute_obsels
+        wrap(impl)
+        wrap(fusion_impl)
+        try:
+            self.d.obsel_collection.force_state_refresh(parameters)
+        finally:
+            del impl.compute_obsels
+            del fusion_impl.compute_obsels
+        assert len(calls) == len(expected)
+        assert set(calls) == set(expected)
+        return calls
+
+    def test_topological_order(self):
+        calls = self.check_computations(None, ["a/", "b1/", "b2/", "d/"])
+        assert calls[0] == "a/" and calls[-1] == "d/"
+        self.check_computations(None, [])
+        self.trace.create_obsel('o1', self.ot, 1000)
+        self.check_computations(None, ["a/", "b1/", "b2/", "d/"])
+        assert len(self.d.obsels) == 4
+
+    def test_dirty_propagation(self):
+        def get_dirty():
+            return [ ctr.uri[len(self.base.uri):]
+                     for ctr in (self.a, self.b1, self.b2, self.d)
+                     if ctr.obsel_collection.metadata.value(
+                         ctr.obsel_collection.uri, METADATA.dirty) ]
+
+        def get_stored_dependents(trace):
+            return trace.metadata.value(trace.uri, METADATA.dependent_obsels)
+
+        self.check_computations(None, ["a/", "b1/", "b2/", "d/"])
+        assert get_dirty() == []
+        # clean traces do not even look at their sources
+        obsels = self.d.obsel_collection
+        obsels._iter_computed_ancestors = None
+        try:
+            obsels.force_state_refresh()
+        finally:
+            del obsels._iter_computed_ancestors
+
+        # changes are propagated to all dependent traces at once
+        self.trace.create_obsel('o1', self.ot, 1000)
+        assert get_dirty() == ["a/", "b1/", "b2/", "d/"]
+        assert get_stored_dependents(self.trace) is not None
+        self.check_computations(None, ["a/", "b1/", "b2/", "d/"])
+
+        # stored dependents are invalidated when sources change,
+        # but only for the traces the new trace depends on
+        f = self.base.create_computed_trace("f/", KTBS.filter, {}, [self.a])
+        for trace in (self.trace, self.a, self.b1, self.b2, self.d, f):
+            list(trace.iter_dependent_obsels_uris())
+        e = self.base.create_computed_trace("e/", KTBS.filter, {}, [self.d])
+        for trace in (self.trace, self.a, self.b1, self.b2, self.d):
+            assert get_stored_dependents(trace) is None
+        assert get_stored_dependents(f) is not None
+        assert len(e.obsels) == 4
+        self.trace.create_obsel('o2', self.ot, 2000)
+        assert e.obsel_collection.metadata.value(e.obsel_collection.uri,
+                                                 METADATA.dirty) is not None
+        assert len(e.obsels) == 6
+
+    def test_refresh_parameter(self):
+        self.check_computations(None, ["a/", "b1/", "b2/", "d/"])
+        self.check_computations({"refresh": "force"}, ["d/"])
+        self.check_computations({"refresh": "recursive"},
+                                ["a/", "b1/", "b2/", "d/"])
+        self.check_computations({"refresh": "no"}, [])
+
+    def test_concurrent_branches(self):
+        self.check_computations(None, ["a/", "b1/", "b2/", "d/"])
+        self.trace.create_obsel('o1', self.ot, 1000)
+        impl = self.a._method_impl
+        fusion_impl = self.d._method_impl
+        spans = {}
+        def wrap(impl):
+            def compute_obsels(computed_trace, from_scratch=False):
+                name = computed_trace.uri[len(self.base.uri):]
+                start = time()
+                if name in ("b1/", "b2/"):
+                    sleep(0.3)
+                ret = type(impl).compute_obsels(impl, computed_trace,
+                                                from_scratch)
+                spans[name] = (start, time())
+                return ret
+            impl.compute_obsels = compute_obsels
+        wrap(impl)
+        wrap(fusion_impl)
+        try:
+            assert len(self.d.obsels) == 4
+        finally:
+            del impl.compute_obsels
+            del fusion_impl.compute_obsels
+        # b1 and b2 only depend on a, so they are computed concurrently
+        assert spans["a/"][1] <= min(spans["b1/"][0], spans["b2/"][0])
+        assert spans["b1/"][0] < spans["b2/"][1]
+        assert spans["b2/"][0] < spans["b1/"][1]
+        assert max(spans["b1/"][1], spans["b2/"][1]) <= spans["d/"][0]
+
+    def test_failed_branch(self):
+        self.check_computations(None, ["a/", "b1/", "b2/", "d/"])
+        self.trace.create_obsel('o1', self.ot, 1000)
+        e = self.base.create_computed_trace("e/", KTBS.filter, {}, [self.b1])
+        f = self.base.create_computed_trace("f/", KTBS.fusion, {},
+                                            [e, self.b2])
+        impl = self.a._method_impl
+        calls = []
+        def compute_obsels(computed_trace, from_scratch=False):
+            name = computed_trace.uri[len(self.base.uri):]
+            calls.append(name)
+            if name == "b1/":
+                raise ValueError("b1 failed")
+            return type(impl).compute_obsels(impl, computed_trace,
+                                             from_scratch)
+        impl.compute_obsels = compute_obsels
+        try:
+            with assert_raises(CanNotProceedError):
+                f.obsel_collection.force_state_refresh()
+        finally:
+            del impl.compute_obsels
+        # the dependents of b1 are skipped, but not the other branches
+        assert sorted(calls) == ["a/", "b1/", "b2/"]
+        obsels = self.b1.obsel_collection
+        assert obsels.metadata.value(obsels.uri, METADATA.dirty) is not None
+        assert len(self.b2.obsels) == 2
+
+    def test_modified_during_recomputation(self):
+        impl = self.a._method_impl
+        calls = []
+        def compute_obsels(computed_trace, from_scratch=False):
+            calls.append(computed_trace.uri[len(self.base.uri):])
+            if len(calls) == 1:
+                # the computation is discarded, then retried
+                self.a.label = "modified"
+            return type(impl).compute_obsels(impl, computed_trace,
+                                             from_scratch)
+        impl.compute_obsels = compute_obsels
+        try:
+            assert len(self.a.obsels) == 1
+        finally:
+            del impl.compute_obsels
+        assert calls == ["a/", "a/"]
+        assert self.a.label == "modified"
+
+    def test_single_flight(self):
+        self.check_computations(None, ["a/", "b1/", "b2/", "d/"])
+        self.trace.create_obsel('o1', self.ot, 1000)
+        impl = self.a._method_impl
+        calls = []
+        def compute_obsels(computed_trace, from_scratch=False):
+            calls.append(computed_trace.uri[len(self.base.uri):])
+            sleep(0.2) # give other threads a chance to enter
+            return type(impl).compute_obsels(impl, computed_trace,
+                                             from_scratch)
+        impl.compute_obsels = compute_obsels
+        results = []
+        def read():
+            results.append(len(self.b1.obsels))
+        threads = [ Thread(target=read) for _ in range(4) ]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            del impl.compute_obsels
+        assert results == [2, 2, 2, 2]
+        assert calls == ["a/", "b1/"]
+
+    def test_single_flight_slow_owner(self):
+        uri = self.a.obsel_collection.uri
+        events = []
+        def slow_flight():
+            with single_flight(uri):
+                events.append("start")
+                sleep(0.5)
+                events.append("end")
+        thread = Thread(target=slow_flight)
+        thread.start()
+        try:
+            while not events:
+                sleep(0.01)
+            # the owner is alive, so waiting threads outlast the timeout
+            with single_flight(uri, 0.1):
+                events.append("waiter")
+        finally:
+            thread.join()
+        assert events == ["start", "end", "waiter"]
+
+    def test_single_flight_crashed_owner(self):
+        uri = self.a.obsel_collection.uri
+        semaphore = _get_flight_semaphore(uri)
+        semaphore.acquire(0)
+        # simulate a process that crashed during the flight
+        crashed = Popen(["true"])
+        crashed.wait()
+        with open(_get_flight_owner_path(uri), "w") as owner_file:
+            owner_file.write(str(crashed.pid))
+        start = time()
+        with single_flight(uri, 0.1):
+            assert time() - start < 5
+        assert semaphore.value == 1
+        assert not exists(_get_flight_owner_path(uri))
+
+    def test_forget_flight_on_delete(self):
+        uri = self.d.obsel_collection.uri
+        with single_flight(uri):
+            pass
+        self.d.delete()
+        with assert_raises(posix_ipc.ExistentialError):
+            posix_ipc.Semaphore(get_semaphore_name(uri + "#flight"))
@@ -84,7 +84,8 @@ class TestJsonRoot(KtbsTestCase):
             '@id': 'http://localhost:12345/',
             '@type': 'KtbsRoot',
             'hasBuiltinMethod':
-                ['filter', 'external', 'fusion', 'sparql', 'isparql', 'fsa',],
+                ['filter', 'external', 'fusion', 'sparql', 'isparql', 'fsa',
+                 'window',],
                 'version': '%s%s' % (ktbs_version, ktbs_commit),
         })
         assert_roundtrip(json_content, self.my_ktbs)
@@ -124,7 +125,8 @@ class TestJsonRoot(KtbsTestCase):
             '@context':
                 'http://liris.cnrs.fr/silex/2011/ktbs-jsonld-context',
             'hasBuiltinMethod':
-                ['filter', 'external', 'fusion', 'sparql', 'isparql', 'fsa',],
+                ['filter', 'external', 'fusion', 'sparql', 'isparql', 'fsa',
+                 'window',],
             '@id': 'http://localhost:12345/',
             '@type': 'KtbsRoot',
             'additionalType': [ 'http://example.org/ns/other-type' ],
@@ -154,7 +156,8 @@ class TestJsonRoot(KtbsTestCase):
             '@context':
                 'http://liris.cnrs.fr/silex/2011/ktbs-jsonld-context',
             'hasBuiltinMethod':
-                ['filter', 'external', 'fusion', 'sparql', 'isparql', 'fsa',],
+                ['filter', 'external', 'fusion', 'sparql', 'isparql', 'fsa',
+                 'window',],
             '@id': 'http://localhost:12345/',
             '@type': 'KtbsRoot',
             'hasBase': [ 'b1/', 'b2/', 'b3/', ],
@@ -1235,6 +1238,15 @@ class TestJsonObsels(KtbsTestCase):
         })
         assert_roundtrip(json_content, self.o3)
 
+    def test_streamed_obsels(self):
+        self.populate()
+        obsels = self.t1.obsel_collection
+        chunks = list(serialize_json_trace_obsels(obsels.state, obsels))
+        assert len(chunks) > 1
+        expected = dumps(trace_obsels_to_json(obsels.state, obsels),
+                         ensure_ascii=False, indent=4)
+        assert "".join(chunks) == expected.encode("utf-8")
+
     def test_post_obsel(self):
         """
         Test posting an obsel with minimal JSON (no @context, no hasTrace...)
@@ -21,10 +21,11 @@ from unittest import skip
 
 from fsa4streams.fsa import FSA
 from json import dumps, loads
-from rdflib import Literal, XSD
+from rdflib import Graph, Literal, URIRef, XSD
 
 from ktbs.engine.resource import METADATA
-from ktbs.methods.fsa import LOG as FSA_LOG
+from ktbs.methods.fsa import LOG as FSA_LOG, compile_sparql_ask
+from ktbs.methods.utils import get_attribute_rows
 from ktbs.namespace import KTBS, KTBS_NS_URI
 
 from .test_ktbs_engine import KtbsTestCase
@@ -660,3 +661,44 @@ class TestFSAKtbsSpecificProperties(KtbsTestCase):
         assert ctr.obsels[-1].get_attribute_value(self.atypeMax) == "foo"
         assert ctr.obsels[-1].get_attribute_value(self.atypeSpan) == None
         assert ctr.obsels[-1].get_attribute_value(self.atypeConcat) == "42 foo"
+
+
+def test_get_attribute_rows():
+    obs1, obs2 = URIRef("http://ex.org/o1"), URIRef("http://ex.org/o2")
+    at1, at2 = URIRef("http://ex.org/at1"), URIRef("http://ex.org/at2")
+    graph = Graph()
+    graph.add((obs1, at1, Literal(1)))
+    graph.add((obs1, at1, Literal(2)))
+    graph.add((obs2, at1, Literal(3)))
+    graph.add((obs2, at2, Literal(4)))
+    attributes = [(None, at1, None), (None, at2, None)]
+    cache = {}
+    rows = get_attribute_rows(graph, [obs1, obs2], attributes, cache)
+    assert sorted(rows[:2]) == [(Literal(1), None), (Literal(2), None)]
+    assert rows[2:] == [(Literal(3), Literal(4))]
+    # values are cached, so the graph is not used again
+    assert get_attribute_rows(Graph(), [obs2], attributes, cache) \
+        == [(Literal(3), Literal(4))]
+
+def test_compile_sparql_ask():
+    m_ns = "http://ex.org/m#"
+    obs1, obs2 = URIRef("http://ex.org/o1"), URIRef("http://ex.org/o2")
+    atV = URIRef(m_ns + "atV")
+    graph = Graph()
+    graph.add((obs1, atV, Literal(42)))
+    graph.add((obs2, atV, Literal(43)))
+
+    simple = compile_sparql_ask("?obs m:atV 42", m_ns)
+    assert simple.__name__ == "match_triple"
+    assert simple(graph, obs1, None)
+    assert not simple(graph, obs2, None)
+
+    free = compile_sparql_ask("?obs m:atV ?any", m_ns)
+    assert free.__name__ == "match_triple"
+    assert free(graph, obs2, None)
+    assert not free(graph, URIRef("http://ex.org/o3"), None)
+
+    join = compile_sparql_ask("?obs m:atV ?v. ?pred m:atV ?v", m_ns)
+    assert join.__name__ == "match_query"
+    assert join(graph, obs1, obs1)
+    assert not join(graph, obs1, obs2)
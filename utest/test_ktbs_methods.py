@@ -23,10 +23,13 @@ from pytest import raises as assert_raises
 
 from json import loads
 
+from rdflib import URIRef
+
 from ktbs.engine.resource import METADATA
 from ktbs.methods.fusion import LOG as FUSION_LOG
 from ktbs.methods.filter import LOG as FILTER_LOG
 from ktbs.namespace import KTBS, KTBS_NS_URI
+from ktbs.plugins import meth_external
 from rdfrest.exceptions import CanNotProceedError
 
 from .test_ktbs_engine import KtbsTestCase, HttpKtbsTestCaseMixin
@@ -134,6 +137,31 @@ class TestFilter(KtbsTestCase):
         assert get_custom_state(ctr, 'passed_maxtime') == True
 
 
+    def test_filter_late_obsel(self):
+        base = self.my_ktbs.create_base("b/")
+        model = base.create_model("m")
+        otype = model.create_obsel_type("#ot")
+        src = base.create_stored_trace("s/", model, default_subject="alice")
+        ctr = base.create_computed_trace("ctr/", KTBS.filter,
+                                         {"otypes": otype.uri}, [src],)
+        for i in range(0, 40, 10):
+            src.create_obsel("o%02d" % i, otype, i)
+        assert len(ctr.obsels) == 4
+        ctr_obsels = ctr.obsel_collection
+        old_tag = ctr_obsels.str_mon_tag
+
+        self.log.info(">late obsel: only obsels ending after 15 are recomputed")
+        src.create_obsel("o15", otype, 15)
+        assert [ obs.begin for obs in ctr.obsels ] == [0, 10, 15, 20, 30]
+        assert ctr_obsels.get_earliest_change(old_tag) == 15
+
+        self.log.info(">removing an obsel: everything is recomputed")
+        old_tag = ctr_obsels.str_mon_tag
+        with src.obsel_collection.edit() as editable:
+            editable.remove((src.uri + "o20", None, None))
+        assert [ obs.begin for obs in ctr.obsels ] == [0, 10, 15, 30]
+        assert ctr_obsels.get_earliest_change(old_tag) is None
+
     def test_filter_temporal_intervals(self):
         base = self.my_ktbs.create_base("b/")
         model = base.create_model("m")
@@ -266,6 +294,51 @@ class TestFilter(KtbsTestCase):
         assert get_custom_state(ctr, 'last_seen_b') == 30
 
 
+    def test_filter_subtypes(self):
+        base = self.my_ktbs.create_base("b/")
+        model = base.create_model("m")
+        otype1 = model.create_obsel_type("#ot1")
+        otype2 = model.create_obsel_type("#ot2", [otype1])
+        otype3 = model.create_obsel_type("#ot3")
+        src = base.create_stored_trace("s/", model, default_subject="alice")
+        exact = base.create_computed_trace("exact/", KTBS.filter,
+                                           {"otypes": unicode(otype1.uri)},
+                                           [src],)
+        subtypes = base.create_computed_trace("subtypes/", KTBS.filter,
+                                              {"otypes": unicode(otype1.uri),
+                                               "subtypes": "true"},
+                                              [src],)
+        src.create_obsel("o1", otype1, 10)
+        src.create_obsel("o2", otype2, 20)
+        src.create_obsel("o3", otype3, 30)
+        assert len(exact.obsels) == 1
+        assert len(subtypes.obsels) == 2
+
+    def test_filter_bgp_and_native(self):
+        # the same filter, with and without a bgp, must give the same obsels
+        base = self.my_ktbs.create_base("b/")
+        model = base.create_model("m")
+        otype1 = model.create_obsel_type("#ot1")
+        otype2 = model.create_obsel_type("#ot2")
+        src = base.create_stored_trace("s/", model, default_subject="alice")
+        params = {"otypes": unicode(otype1.uri), "after": "10", "before": "40"}
+        native = base.create_computed_trace("native/", KTBS.filter,
+                                            params, [src],)
+        params = dict(params, bgp="?obs a ?any.")
+        sparql = base.create_computed_trace("sparql/", KTBS.filter,
+                                            params, [src],)
+
+        def source_obsels(ctr):
+            return sorted( obs.source_obsels[0].uri for obs in ctr.obsels )
+
+        for i, ts in enumerate([30, 0, 15, 10, 45, 20, 40, 5, 35, 25]):
+            otype = (otype1, otype2)[i%2]
+            src.create_obsel("o%02d" % ts, otype, ts)
+            assert source_obsels(native) == source_obsels(sparql)
+        assert len(native.obsels) == 4 # o15, o30, o35, o40
+        assert get_custom_state(native, 'last_seen_u') \
+            == get_custom_state(sparql, 'last_seen_u')
+
     def test_filter_relations(self):
         base = self.my_ktbs.create_base("b/")
         model = base.create_model("m")
@@ -344,6 +417,37 @@ class TestFusion(KtbsTestCase):
             editable.remove((o21.uri, None, None))
         assert len(ctr.obsels) == 4
 
+    def test_fusion_monotonic(self):
+        base = self.my_ktbs.create_base("b/")
+        model = base.create_model("m")
+        otype = model.create_obsel_type("#ot")
+        src1 = base.create_stored_trace("s1/", model, origin="orig-abc",
+                                        default_subject="alice")
+        src2 = base.create_stored_trace("s2/", model, origin="orig-abc",
+                                        default_subject="bob")
+        ctr = base.create_computed_trace("ctr/", KTBS.fusion, {},
+                                         [src1, src2],)
+        src1.create_obsel("o10", otype, 0)
+        src2.create_obsel("o21", otype, 10)
+        assert len(ctr.obsels) == 2
+        ctr_obsels = ctr.obsel_collection
+        log_mon_tag = ctr_obsels.log_mon_tag
+        str_mon_tag = ctr_obsels.str_mon_tag
+
+        # both sources grow; new obsels are merged in temporal order
+        src2.create_obsel("o23", otype, 30)
+        src1.create_obsel("o12", otype, 20)
+        assert [ obs.uri.rsplit("/", 1)[1] for obs in ctr.obsels ] \
+            == ["s1_o10", "s2_o21", "s1_o12", "s2_o23"]
+        assert ctr_obsels.log_mon_tag == log_mon_tag
+        assert ctr_obsels.str_mon_tag == str_mon_tag
+
+        # an obsel in the past of the fused trace
+        src1.create_obsel("o11", otype, 25)
+        assert len(ctr.obsels) == 5
+        assert ctr_obsels.log_mon_tag == log_mon_tag
+        assert ctr_obsels.str_mon_tag != str_mon_tag
+
 
 class TestExternal(KtbsTestCase):
 
@@ -411,6 +515,95 @@ class TestExternal(KtbsTestCase):
         assert len(ctr.obsels) == 4
 
 
+    def test_external_persistent(self):
+        base = self.my_ktbs.create_base("b/")
+        model = base.create_model("m")
+        otype = model.create_obsel_type("#ot")
+        src1 = base.create_stored_trace("s1/", model, origin="orig-abc",
+                                        default_subject="alice")
+        # a worker copying every obsel it receives
+        cmdline = """sed -u -n -e '/^#end$/p' -e '/^#/d' """ \
+                  """-e 's|%(__sources__)s|%(__destination__)s|g' -e p"""
+        ctr = base.create_computed_trace("ctr/", KTBS.external, {
+                                             "command-line": cmdline,
+                                             "persistent": "true",
+                                         }, [src1],)
+        assert len(ctr.obsels) == 0
+        worker = meth_external._WORKERS[ctr.uri]
+
+        o10 = src1.create_obsel("o10", otype, 0)
+        assert len(ctr.obsels) == 1
+        o21 = src1.create_obsel("o21", otype, 10)
+        assert len(ctr.obsels) == 2
+        o11 = src1.create_obsel("o11", otype, 5)
+        assert len(ctr.obsels) == 3
+        assert ctr.diagnosis is None
+        assert meth_external._WORKERS[ctr.uri] is worker
+        assert worker.is_alive()
+
+        with src1.obsel_collection.edit() as editable:
+            editable.remove((o10.uri, None, None))
+        assert len(ctr.obsels) == 2
+        assert meth_external._WORKERS[ctr.uri] is worker
+
+        # changing the parameters stops the worker
+        ctr.set_parameter("timeout", "30")
+        assert not worker.is_alive()
+        assert len(ctr.obsels) == 2
+        assert meth_external._WORKERS[ctr.uri] is not worker
+        worker = meth_external._WORKERS[ctr.uri]
+
+        # deleting the computed trace stops the worker
+        ctr_uri = ctr.uri
+        ctr.delete()
+        assert not worker.is_alive()
+        assert ctr_uri not in meth_external._WORKERS
+
+    def test_external_persistent_pseudomon(self):
+        base = self.my_ktbs.create_base("b/")
+        model = base.create_model("m")
+        otype = model.create_obsel_type("#ot")
+        src1 = base.create_stored_trace("s1/", model, origin="orig-abc",
+                                        default_subject="alice")
+        src1.pseudomon_range = 10
+        # a worker answering a blank obsel for every obsel it receives
+        cmdline = r"""sed -u -n -e '/^#end$/p' -e '/^#/d' """ \
+                  r"""-e '/ktbs#hasTrace>/{h;""" \
+                  r"""s|^<%(__sources__)s\([^>]*\)> .*|_:\1 """ \
+                  r"""<http://liris.cnrs.fr/silex/2009/ktbs#hasSourceObsel> """ \
+                  r"""<%(__sources__)s\1> .|p;g}' """ \
+                  r"""-e 's|^<%(__sources__)s\([^>]*\)>|_:\1|' """ \
+                  r"""-e 's|%(__sources__)s|%(__destination__)s|g' -e p"""
+        ctr = base.create_computed_trace("ctr/", KTBS.external, {
+                                             "command-line": cmdline,
+                                             "persistent": "true",
+                                         }, [src1],)
+        src1.create_obsel("o00", otype, 0)
+        src1.create_obsel("o10", otype, 10)
+        assert [ obs.begin for obs in ctr.obsels ] == [0, 10]
+
+        # pseudo-monotonic change: obsels sent again are not duplicated
+        src1.create_obsel("o05", otype, 5)
+        assert [ obs.begin for obs in ctr.obsels ] == [0, 5, 10]
+        assert ctr.diagnosis is None
+        ctr.delete()
+
+    def test_external_persistent_timeout(self):
+        base = self.my_ktbs.create_base("b/")
+        model = base.create_model("m")
+        otype = model.create_obsel_type("#ot")
+        src1 = base.create_stored_trace("s1/", model, origin="orig-abc",
+                                        default_subject="alice")
+        ctr = base.create_computed_trace("ctr/", KTBS.external, {
+                                             "command-line": "cat >/dev/null",
+                                             "persistent": "true",
+                                             "timeout": "0.2",
+                                         }, [src1],)
+        with assert_raises(CanNotProceedError):
+            ctr.obsel_collection.force_state_refresh()
+        assert ctr.uri not in meth_external._WORKERS
+
+
 class TestSparql(KtbsTestCase):
 
     def setup(self):
@@ -515,6 +708,77 @@ class TestSparql(KtbsTestCase):
         assert ctr.obsels[0].get_attribute_value(self.atype) == \
             o1.get_attribute_value(self.atype)
 
+    def test_sparql_incremental(self):
+        sparql = """
+          PREFIX : <%s#>
+          PREFIX k: <http://liris.cnrs.fr/silex/2009/ktbs#>
+
+          CONSTRUCT {
+              [ k:hasSourceObsel ?sobs ] .
+          }
+          WHERE {
+              ?sobs a :ot1 .
+          }
+        """ % self.model.uri
+        ctr = self.base.create_computed_trace("ctr/", KTBS.sparql, {
+                                                  "sparql": sparql,
+                                                  "inherit": "yes",
+                                                  "incremental": "yes",
+                                              }, [self.src1],)
+        assert len(ctr.obsels) == 0
+        assert ctr.diagnosis == None
+        ctr_obsels = ctr.obsel_collection
+
+        self.src1.create_obsel("o1", self.otype1, 0)
+        self.src1.create_obsel("o2", self.otype2, 10)
+        assert len(ctr.obsels) == 1
+        log_mon_tag = ctr_obsels.log_mon_tag
+        self.src1.create_obsel("o3", self.otype1, 20)
+        assert len(ctr.obsels) == 2
+        self.src1.create_obsel("o4", self.otype1, 30)
+        assert [ obs.begin for obs in ctr.obsels ] == [0, 20, 30]
+        assert ctr_obsels.log_mon_tag == log_mon_tag
+
+        # non-monotonic change of the source: full recomputation
+        with self.src1.obsel_collection.edit() as editable:
+            editable.remove((URIRef(self.src1.uri + "o3"), None, None))
+        assert [ obs.begin for obs in ctr.obsels ] == [0, 30]
+        assert ctr_obsels.log_mon_tag != log_mon_tag
+
+    def test_sparql_incremental_pseudomon(self):
+        sparql = """
+          PREFIX : <%s#>
+          PREFIX k: <http://liris.cnrs.fr/silex/2009/ktbs#>
+
+          CONSTRUCT {
+              [ k:hasSourceObsel ?sobs ] .
+          }
+          WHERE {
+              ?sobs a :ot1 .
+          }
+        """ % self.model.uri
+        self.src1.pseudomon_range = 100
+        ctr = self.base.create_computed_trace("ctr/", KTBS.sparql, {
+                                                  "sparql": sparql,
+                                                  "inherit": "yes",
+                                                  "incremental": "yes",
+                                              }, [self.src1],)
+        self.src1.create_obsel("o1", self.otype1, 0)
+        self.src1.create_obsel("o2", self.otype1, 50)
+        assert [ obs.begin for obs in ctr.obsels ] == [0, 50]
+
+        # pseudo-monotonic change: obsels computed again are not duplicated
+        self.src1.create_obsel("o3", self.otype1, 40)
+        assert [ obs.begin for obs in ctr.obsels ] == [0, 40, 50]
+
+    def test_sparql_incremental_bad_scope(self):
+        ctr = self.base.create_computed_trace("ctr/", KTBS.sparql, {
+            "sparql": "CONSTRUCT { ?s ?p ?o } WHERE { ?s ?p ?o }",
+            "scope": "base",
+            "incremental": "yes",
+        }, [self.src1],)
+        assert ctr.diagnosis is not None
+
     def test_sparql_inherit_some(self):
 
         sparql = """
@@ -678,6 +942,100 @@ class TestSparql(KtbsTestCase):
                 assert len(ctr.obsels) == 0
 
 
+class TestWindow(KtbsTestCase):
+
+    def setup(self):
+        super(TestWindow, self).setup()
+        self.base = self.my_ktbs.create_base("b/")
+        self.model = self.base.create_model("m")
+        self.otype = self.model.create_obsel_type("#ot")
+        self.atype = self.model.create_attribute_type("#at")
+        self.src = self.base.create_stored_trace("s/", self.model,
+                                                 default_subject="alice")
+
+    def get_windows(self, ctr, *attributes):
+        ret = []
+        for obs in ctr.obsels:
+            values = tuple( obs.state.value(obs.uri, self.model.uri + i)
+                            for i in attributes )
+            ret.append((obs.begin, obs.end) + tuple(
+                i if i is None else i.toPython() for i in values ))
+        return ret
+
+    def test_window_tumbling(self):
+        ctr = self.base.create_computed_trace("ctr/", KTBS.window, {
+            "width": "10",
+            "aggregates": "#n count\n#total sum #at\n#max max #at",
+        }, [self.src],)
+        ctr_obsels = ctr.obsel_collection
+
+        self.src.create_obsel("o00", self.otype, 0, attributes={self.atype: 1})
+        self.src.create_obsel("o03", self.otype, 3, attributes={self.atype: 2})
+        assert self.get_windows(ctr) == [] # window 0 is not closed yet
+        log_mon_tag = ctr_obsels.log_mon_tag
+
+        self.src.create_obsel("o12", self.otype, 12, attributes={self.atype: 5})
+        assert self.get_windows(ctr, "#n", "#total", "#max") == [
+            (0, 9, 2, 3, 2),
+        ]
+        self.src.create_obsel("o15", self.otype, 15, attributes={self.atype: 7})
+        self.src.create_obsel("o25", self.otype, 25)
+        assert self.get_windows(ctr, "#n", "#total", "#max") == [
+            (0, 9, 2, 3, 2),
+            (10, 19, 2, 12, 7),
+        ]
+        # closed windows are only added
+        assert ctr_obsels.log_mon_tag == log_mon_tag
+
+        self.src.create_obsel("o08", self.otype, 8, attributes={self.atype: 4})
+        assert self.get_windows(ctr, "#n", "#total", "#max") == [
+            (0, 9, 3, 7, 4),
+            (10, 19, 2, 12, 7),
+        ]
+
+    def test_window_sliding_partial(self):
+        ctr = self.base.create_computed_trace("ctr/", KTBS.window, {
+            "width": "10",
+            "step": "5",
+            "partial": "true",
+            "aggregates": "#n count",
+        }, [self.src],)
+
+        self.src.create_obsel("o03", self.otype, 3)
+        assert self.get_windows(ctr, "#n") == [(-5, 4, 1), (0, 9, 1)]
+        self.src.create_obsel("o07", self.otype, 7)
+        assert self.get_windows(ctr, "#n") == [
+            (-5, 4, 1), (0, 9, 2), (5, 14, 1),
+        ]
+
+    def test_window_late_obsel(self):
+        ctr = self.base.create_computed_trace("ctr/", KTBS.window, {
+            "width": "10",
+            "aggregates": "#n count",
+        }, [self.src],)
+        ctr_obsels = ctr.obsel_collection
+        for i in (0, 12, 25, 38, 41):
+            self.src.create_obsel("o%02d" % i, self.otype, i)
+        assert self.get_windows(ctr, "#n") == [
+            (0, 9, 1), (10, 19, 1), (20, 29, 1), (30, 39, 1),
+        ]
+        old_tag = ctr_obsels.str_mon_tag
+
+        # only the windows ending after the late obsel are recomputed
+        self.src.create_obsel("o27", self.otype, 27)
+        assert self.get_windows(ctr, "#n") == [
+            (0, 9, 1), (10, 19, 1), (20, 29, 2), (30, 39, 1),
+        ]
+        assert ctr_obsels.get_earliest_change(old_tag) == 27
+
+    def test_window_bad_parameters(self):
+        ctr = self.base.create_computed_trace("ctr/", KTBS.window, {
+            "width": "0",
+            "aggregates": "#n median #at",
+        }, [self.src],)
+        assert ctr.diagnosis is not None
+
+
 class TestIssue28(KtbsTestCase):
 
     def setup(self):
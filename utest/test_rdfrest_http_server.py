@@ -32,7 +32,8 @@ from example2 import Group2Implementation, Item2Implementation, \
     make_example2_service
 from rdfrest.exceptions import SerializeError
 from rdfrest.cores.factory import unregister_service
-from rdfrest.http_server import HttpFrontend
+from rdfrest.http_server import HttpFrontend, parse_resource_cache, \
+    ResponseCache
 from rdfrest.serializers import register_serializer
 from rdfrest.util import urisplit
 from rdfrest.util.config import get_service_configuration
@@ -124,6 +125,16 @@ class TestHttpFront(object):
         resp, content = self.request(URL)
         assert resp.status_int == 200
 
+    def test_get_not_modified(self):
+        resp, content = self.request(URL)
+        assert resp.status_int == 200
+        resp2, content2 = self.request(URL, headers={
+            "if-none-match": resp.etag,
+        })
+        assert resp2.status_int == 304
+        assert resp2.etag == resp.etag
+        assert content2 == ""
+
     def test_get_valid_params(self):
         resp, content = self.request(URL+"?valid=a")
         assert resp.status_int == 200
@@ -335,6 +346,43 @@ class TestHttpFront(object):
         assert resp.cache_control is not None
 
 
+    def test_response_cache(self):
+        self.app.response_cache = cache = ResponseCache(100000)
+        resp1, content1 = self.request(URL)
+        assert (cache.hits, cache.misses, len(cache)) == (0, 1, 1)
+        resp2, content2 = self.request(URL)
+        assert (cache.hits, cache.misses, len(cache)) == (1, 1, 1)
+        assert resp2.etag == resp1.etag
+        assert content2 == content1
+        assert resp2.last_modified == resp1.last_modified is not None
+        assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0,
+                                 "size": cache.size, "entries": 1}
+
+        # modifying the resource makes the cached response stale
+        reqhead = { "content-type": "text/turtle" }
+        resp, _ = self.request(URL, "POST", POSTABLE_TURTLE, reqhead)
+        assert resp.status_int == 201
+        resp3, content3 = self.request(URL)
+        assert (cache.hits, cache.misses, len(cache)) == (1, 2, 1)
+        assert resp3.etag != resp1.etag
+        assert content3 != content1
+
+        # least recently used responses are evicted
+        cache.max_bytes = cache.size + 1
+        self.request(URL+"foo")
+        assert (cache.evictions, len(cache)) == (1, 1)
+
+    def test_not_modified_last_modified(self):
+        resp1, _ = self.request(URL)
+        resp2, _ = self.request(URL, headers={"if-none-match": resp1.headers["etag"]})
+        assert resp2.status_int == 304
+        assert resp2.last_modified == resp1.last_modified is not None
+
+    def test_parse_resource_cache(self):
+        assert parse_resource_cache("false") == 0
+        assert parse_resource_cache("true") > 0
+        assert parse_resource_cache("12345") == 12345
+
     def test_serialize_error(self):
         # we use the fact that rdfrest_demo can "simulate" a serialize error
         resp, content = self.request(URL, headers={"accept": "text/errer"})
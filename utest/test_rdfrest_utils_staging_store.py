@@ -0,0 +1,54 @@
+from rdflib import Graph, Literal, Namespace
+
+from rdfrest.util.staging_store import StagingStore
+
+EX = Namespace('http://localhost:1234/')
+
+class TestStagingStore(object):
+
+    def setup(self):
+        self.base = Graph().store
+        self.g1 = Graph(self.base, EX['g1'])
+        self.g1.add((EX.s, EX.p, Literal(1)))
+        self.g1.add((EX.s, EX.p, Literal(2)))
+        self.store = StagingStore(self.base)
+        self.s1 = Graph(self.store, EX['g1'])
+        self.s2 = Graph(self.store, EX['g2'])
+
+    def test_read_through(self):
+        assert set(self.s1) == set(self.g1)
+        assert len(self.s1) == 2
+        assert len(self.s2) == 0
+
+    def test_staged_changes(self):
+        self.s1.remove((EX.s, EX.p, Literal(1)))
+        self.s1.add((EX.s, EX.p, Literal(3)))
+        self.s2.add((EX.s, EX.q, EX.o))
+        assert set(self.s1.objects(EX.s, EX.p)) == set([Literal(2), Literal(3)])
+        assert len(self.s1) == 2
+        assert len(self.s2) == 1
+        # the underlying store is not modified
+        assert set(self.g1.objects(EX.s, EX.p)) == set([Literal(1), Literal(2)])
+        assert len(Graph(self.base, EX['g2'])) == 0
+
+    def test_remove_then_add(self):
+        self.s1.remove((EX.s, None, None))
+        assert len(self.s1) == 0
+        self.s1.add((EX.s, EX.p, Literal(1)))
+        self.s1.set((EX.s, EX.q, EX.o))
+        self.s1.set((EX.s, EX.q, EX.o2))
+        assert set(self.s1) == set([(EX.s, EX.p, Literal(1)),
+                                    (EX.s, EX.q, EX.o2)])
+
+    def test_apply(self):
+        self.s1.remove((EX.s, EX.p, Literal(1)))
+        self.s1.add((EX.s, EX.p, Literal(3)))
+        self.s2.add((EX.s, EX.q, EX.o))
+        self.store.apply()
+        assert set(self.g1.objects(EX.s, EX.p)) == set([Literal(2), Literal(3)])
+        assert set(Graph(self.base, EX['g2'])) == set([(EX.s, EX.q, EX.o)])
+        # nothing left to apply
+        assert set(self.s1) == set(self.g1)
+        self.g1.remove((EX.s, None, None))
+        self.store.apply()
+        assert len(self.g1) == 0